@@ -1,85 +1,252 @@
+import argparse
+import concurrent.futures
+import logging
+import os
+import pathlib
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import sqlalchemy
-from authentication import DB_CONNECTION_STRING
+from arguments import parse_seasons
+
+# 'sqlalchemy' builds results from DBAPI row tuples,
+# 'arrow' streams columnar record batches (ADBC when installed, COPY otherwise),
+# 'duckdb' runs the queries in-process over the parquet warehouse in WAREHOUSE_DIR
+FETCH_BACKEND = 'sqlalchemy'
+WAREHOUSE_DIR = pathlib.Path(__file__).parent / 'warehouse'
+# created on first use
+warehouse = None
+
+# query results are reused until the pipeline reloads a season they read
+USE_RESULT_CACHE = True
+RESULT_CACHE_DIR = pathlib.Path(__file__).parent / '.cache' / 'queries'
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# created on first use
+result_cache = None
+
+logger = logging.getLogger(__name__)
+
+
+# pooled engine of the atp database, shared with the pipeline through the backend
+# and created on first use, so importing this module does not touch the database
+def get_engine() -> sqlalchemy.Engine:
+    import backend
+    return backend.get_engine()
+
+
+# parquet warehouse of the duckdb backend, created on first use
+def get_warehouse():
+    global warehouse
+    if warehouse is None:
+        # duckdb is only imported by this backend
+        from warehouse import Warehouse
+        warehouse = Warehouse(directory=WAREHOUSE_DIR)
+    return warehouse
+
+
+# query result cache, created on first use; None when disabled
+def get_result_cache():
+    global result_cache
+    if result_cache is None and USE_RESULT_CACHE:
+        # pyarrow is only imported when results are cached
+        from cache import QueryCache
+        result_cache = QueryCache(directory=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES)
+    return result_cache
+
+
+# data versions of the given seasons, or of every season, as [[season, version], ...]
+def data_version(seasons: list[int] | None = None) -> list[list[int]]:
+    if FETCH_BACKEND == 'duckdb':
+        return get_warehouse().data_version(seasons=seasons)
+    query = 'SELECT "season", "version" FROM "data_version"'
+    params = {}
+    if seasons is not None:
+        query += ' WHERE "season" IN :seasons'
+        params['seasons'] = list(seasons)
+    statement = sqlalchemy.sql.text(query + ' ORDER BY "season"').bindparams(
+        *[sqlalchemy.bindparam(name, expanding=True) for name in params]
+    )
+    with get_engine().connect() as db_connection:
+        return [list(row) for row in db_connection.execute(statement, params)]
+
+
+# read a query result, from the result cache while the seasons it reads are unchanged;
+# a "season" filter parameter limits the data versions in the key to those seasons
+def read_sql(sql: str | sqlalchemy.TextClause, params: dict | None = None) -> pd.DataFrame:
+    cache = get_result_cache()
+    if cache is None:
+        return fetch_sql(sql, params)
+    # the version is read before the result, so a result is never cached under a newer version
+    key = cache.key(
+        str(sql), params, data_version(seasons=(params or {}).get('season')), source=data_source()
+    )
+    table = cache.get(key)
+    if table is None:
+        table = fetch_sql(sql, params)
+        cache.put(key, table)
+    return table
+
+
+# fetch backend and the database or warehouse it reads, with any password hidden
+def data_source() -> str:
+    if FETCH_BACKEND == 'duckdb':
+        return f"{FETCH_BACKEND}:{get_warehouse().directory.resolve()}"
+    return f"{FETCH_BACKEND}:{get_engine().url.render_as_string(hide_password=True)}"
+
+
+# read a query result with the configured fetch backend
+def fetch_sql(sql: str | sqlalchemy.TextClause, params: dict | None = None) -> pd.DataFrame:
+    if FETCH_BACKEND == 'duckdb':
+        return get_warehouse().read_sql(sql=sql, params=params)
+    # the arrow readers stream from postgresql, other databases are read through sqlalchemy
+    if FETCH_BACKEND == 'arrow' and get_engine().dialect.name == 'postgresql':
+        # pyarrow is only imported by this backend
+        import columnar
+        if isinstance(sql, sqlalchemy.TextClause):
+            # the arrow backends take driver sql, with the expanding filter lists spelled out
+            compiled = sql.bindparams(**(params or {})).compile(
+                dialect=get_engine().dialect, compile_kwargs={'render_postcompile': True}
+            )
+            sql, params = str(compiled), compiled.params
+        return columnar.read_arrow(query=sql, engine=get_engine(), parameters=params, arrow_dtypes=False)
+    return pd.read_sql(sql=sql, con=get_engine(), params=params)
+
+
+# WHERE clause and parameters selecting match facts by season and tournament;
+# None leaves a field unfiltered
+def match_facts_filter(
+    seasons: list[int] | None = None,
+    tourney_ids: list[str] | None = None,
+    tourney_levels: list[str] | None = None,
+    surfaces: list[str] | None = None,
+) -> tuple[str, dict]:
+    conditions = []
+    params = {}
+    for column, values in (
+        ('season', seasons),
+        ('tourney_id', tourney_ids),
+        ('tourney_level', tourney_levels),
+        ('surface', surfaces),
+    ):
+        if values is None:
+            continue
+        conditions.append(f'"{column}" IN :{column}')
+        params[column] = list(values)
+    if not conditions:
+        return '', params
+    return 'WHERE ' + ' AND '.join(conditions), params
+
+
+# text query of a report, with its filter values bound as expanding parameters,
+# any other parameters bound as single values and dialect-specific fragments spelled out
+def filtered_query(
+    template: str,
+    filters: tuple[str, dict],
+    fragments: dict | None = None,
+    **scalars,
+) -> tuple[sqlalchemy.TextClause, dict]:
+    where, params = filters
+    statement = sqlalchemy.sql.text(template.format(where=where, **(fragments or {}))).bindparams(
+        *[sqlalchemy.bindparam(name, expanding=True) for name in params]
+    )
+    return statement, {**params, **scalars}
 
-engine = sqlalchemy.create_engine(DB_CONNECTION_STRING)
 
 # PART 4: EDA
+# full denormalized match facts, maintained by the pipeline (see pipeline.MATCH_FACTS_QUERY);
+# the reports below compute their aggregates in the database instead of fetching every row
 query = """
     SELECT 
-        t."tourney_name",
-        t."tourney_level",
-        t."tourney_date",
-        t."surface",
-        t."draw_size",
-        m."season",
-        pw."name"       AS "winner_name",
-        pw."hand"       AS "winner_hand",
-        pw."height"     AS "winner_height",
-        pw."ioc"        AS "winner_ioc",
-        pw."birth_year" AS "winner_birth_year",
-        pl."name"       AS "loser_name",
-        pl."hand"       AS "loser_hand",
-        pl."height"     AS "loser_height",
-        pl."ioc"        AS "loser_ioc",
-        pl."birth_year" AS "loser_birth_year",
-        m."score",
-        m."best_of",
-        m."round",
-        m."minutes",
-        m."winner_aces",
-        m."winner_double_faults",
-        m."winner_serve_points",
-        m."winner_first_serve_in",
-        m."winner_first_serve_won",
-        m."winner_second_serve_won",
-        m."winner_service_games",
-        m."winner_break_points_saved",
-        m."winner_break_points_faced",
-        m."loser_aces",
-        m."loser_double_faults",
-        m."loser_serve_points",
-        m."loser_first_serve_in",
-        m."loser_first_serve_won",
-        m."loser_second_serve_won",
-        m."loser_service_games",
-        m."loser_break_points_saved",
-        m."loser_break_points_faced",
-        rw."rank"       AS "winner_rank",
-        rw."points"     AS "winner_points",
-        rl."rank"       AS "loser_rank",
-        rl."points"     AS "loser_points"
-    FROM "tournaments" t
-    JOIN "matches" m ON t."tourney_id" = m."tourney_id"
-    JOIN "players" pw ON m."winner_id" = pw."player_id"
-    JOIN "players" pl ON m."loser_id" = pl."player_id"
-    LEFT JOIN "rankings" rw 
-        ON rw."player_id" = pw."player_id" 
-        AND rw."tourney_id" = t."tourney_id" 
-        AND rw."season" = m."season"
-    LEFT JOIN "rankings" rl 
-        ON rl."player_id" = pl."player_id" 
-        AND rl."tourney_id" = t."tourney_id" 
-        AND rl."season" = m."season"
-    ORDER BY t."tourney_date", m."match_num";
+        "tourney_name",
+        "tourney_level",
+        "tourney_date",
+        "surface",
+        "draw_size",
+        "season",
+        "winner_name",
+        "winner_hand",
+        "winner_height",
+        "winner_ioc",
+        "winner_birth_year",
+        "loser_name",
+        "loser_hand",
+        "loser_height",
+        "loser_ioc",
+        "loser_birth_year",
+        "score",
+        "best_of",
+        "round",
+        "minutes",
+        "winner_aces",
+        "winner_double_faults",
+        "winner_serve_points",
+        "winner_first_serve_in",
+        "winner_first_serve_won",
+        "winner_second_serve_won",
+        "winner_service_games",
+        "winner_break_points_saved",
+        "winner_break_points_faced",
+        "loser_aces",
+        "loser_double_faults",
+        "loser_serve_points",
+        "loser_first_serve_in",
+        "loser_first_serve_won",
+        "loser_second_serve_won",
+        "loser_service_games",
+        "loser_break_points_saved",
+        "loser_break_points_faced",
+        "winner_rank",
+        "winner_points",
+        "loser_rank",
+        "loser_points"
+    FROM "match_facts"
+    ORDER BY "tourney_date", "match_num";
 
 """
 
-table = pd.read_sql(sql=query, con=engine)
-table.info()
-
-nummerical_variables = table.select_dtypes(exclude=object)
-nummerical_variables.describe()
-categorical_variables = table.select_dtypes(include=object)
-categorical_variables.describe()
-
-plt.figure(figsize=(25, 15))
-correlation_matrix = nummerical_variables.corr()
-sns.heatmap(correlation_matrix, cmap="YlGnBu", annot=True) 
-plt.savefig('heatmap.png')
-plt.close()
+# numerical columns of the match facts, in the order of the correlation matrix
+numerical_columns = [
+    'draw_size', 'season',
+    'winner_height', 'winner_birth_year', 'loser_height', 'loser_birth_year',
+    'best_of', 'minutes',
+    'winner_aces', 'winner_double_faults', 'winner_serve_points',
+    'winner_first_serve_in', 'winner_first_serve_won', 'winner_second_serve_won',
+    'winner_service_games', 'winner_break_points_saved', 'winner_break_points_faced',
+    'loser_aces', 'loser_double_faults', 'loser_serve_points',
+    'loser_first_serve_in', 'loser_first_serve_won', 'loser_second_serve_won',
+    'loser_service_games', 'loser_break_points_saved', 'loser_break_points_faced',
+    'winner_rank', 'winner_points', 'loser_rank', 'loser_points',
+]
+
+# pairwise correlations in a single pass over the table, like DataFrame.corr()
+# each pair only uses the rows where both columns are present
+correlation_query = "SELECT " + ",\n".join(
+    f'corr("{x}", "{y}") AS "{x}:{y}"'
+    for i, x in enumerate(numerical_columns)
+    for y in numerical_columns[i+1:]
+) + ' FROM "match_facts" {where}'
+
+
+# correlation matrix of the numerical match facts
+def correlation_matrix(filters: tuple[str, dict] = ('', {})) -> pd.DataFrame:
+    correlation_pairs = read_sql(*filtered_query(correlation_query, filters)).iloc[0]
+    # reshape the pairs into a symmetric matrix with ones on the diagonal
+    matrix = pd.DataFrame(
+        1.0, index=numerical_columns, columns=numerical_columns
+    )
+    for pair, value in correlation_pairs.items():
+        x, y = pair.split(':')
+        matrix.loc[x, y] = matrix.loc[y, x] = value
+    return matrix
+
+
+# draw the correlation matrix as an annotated heatmap
+def plot_heatmap(matrix: pd.DataFrame, path: str = 'heatmap.png') -> None:
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    plt.figure(figsize=(25, 15))
+    sns.heatmap(matrix, cmap="YlGnBu", annot=True) 
+    plt.savefig(path)
+    plt.close()
 
 """
 Here are some key insights and interpretations from the correlation matrix of various tennis game statistics:
@@ -114,70 +281,179 @@ Evolution of the Game: Over the years, the game of tennis has seen changes in ra
 Challenges for the Returner: A powerful serve coming from a high release point can be challenging to read and return. The trajectory and bounce are different from serves of shorter players, making it trickier for the returner to anticipate and position themselves.
 """
 
-# Lambda function to rename columns: It takes the last portion of a string after the underscore
-rename_function = lambda x: x.split('_')[-1]
-
-# Extract relevant columns for winners and rename the columns
-winner_table = table[['season','winner_height','winner_aces']]
-winner_table = winner_table.rename(rename_function, axis=1)
-winner_table['type'] = 'winner'
-
-# Extract relevant columns for losers and rename the columns
-loser_table = table[['season','loser_height','loser_aces']]
-loser_table = loser_table.rename(rename_function, axis=1)
-loser_table['type'] = 'loser'
-
-# Merge both winner and loser tables vertically and drop any rows with missing data
-analysis_table = pd.concat(
-    [winner_table, loser_table], 
-    axis=0
-).dropna(how='any')
-
-# Initialize a grid of plots with an Axes for each season.
-# This FacetGrid will allow us to create a multi-plot grid for 
-# visualizing relationships across many levels of a categorical variable
-g = sns.FacetGrid(
-    data=analysis_table, 
-    col="season", 
-    hue="type", 
-    height=3, 
-    aspect=1.5, 
-    col_wrap=4,     # number of columns before wrapping to the next row
-    sharey=False,   # each facet/plot will have its own y-axis scale
-)
-# Apply the regression plot onto the FacetGrid to show the relationship 
-# between height and aces for each type
-g = g.map_dataframe(
-    func=sns.regplot, 
-    x="height", 
-    y="aces", 
-    scatter_kws={'s': 30},      # specify size of scatter points
-    line_kws={'linewidth': 3}   # specify linewidth of the regression line
-)
+# Regression of aces on height per season, for winners and losers separately,
+# computed in the database; rows missing either value are ignored like dropna()
+regression_query = """
+    SELECT 
+        "season",
+        'winner'                                        AS "type",
+        regr_slope("winner_aces", "winner_height")      AS "slope",
+        regr_intercept("winner_aces", "winner_height")  AS "intercept",
+        min("winner_height") FILTER (WHERE "winner_aces" IS NOT NULL) AS "min_height",
+        max("winner_height") FILTER (WHERE "winner_aces" IS NOT NULL) AS "max_height"
+    FROM "match_facts"
+    {where}
+    GROUP BY "season"
+    UNION ALL
+    SELECT 
+        "season",
+        'loser'                                         AS "type",
+        regr_slope("loser_aces", "loser_height")        AS "slope",
+        regr_intercept("loser_aces", "loser_height")    AS "intercept",
+        min("loser_height") FILTER (WHERE "loser_aces" IS NOT NULL) AS "min_height",
+        max("loser_height") FILTER (WHERE "loser_aces" IS NOT NULL) AS "max_height"
+    FROM "match_facts"
+    {where}
+    GROUP BY "season"
+    ORDER BY "season", "type" DESC;
+"""
+
 
-# Set x and y axis labels with increased font size
-g.set_axis_labels(x_var="Height", y_var="Aces", fontsize=20)
+# fitted lines of aces on height per season and player type
+def height_aces_regressions(filters: tuple[str, dict] = ('', {})) -> pd.DataFrame:
+    return read_sql(*filtered_query(regression_query, filters)).dropna(how='any')
 
-# Set title for each subplot based on the season, with specified font style and size
-g.set_titles(template="{col_name}", fontweight="bold", fontsize=20)
 
-# Add the legend without a title and specify the order of labels
-g.add_legend(title="", fontsize=20, label_order=["winner", "loser"])
+# Mean aces at every height of each season and player type, the points behind the fitted lines
+height_bins_query = """
+    SELECT 
+        "season",
+        'winner'                AS "type",
+        "winner_height"         AS "height",
+        avg("winner_aces")      AS "mean_aces",
+        count(*)                AS "count"
+    FROM (SELECT * FROM "match_facts" {where}) AS "facts"
+    WHERE "winner_height" IS NOT NULL AND "winner_aces" IS NOT NULL
+    GROUP BY "season", "winner_height"
+    UNION ALL
+    SELECT 
+        "season",
+        'loser'                 AS "type",
+        "loser_height"          AS "height",
+        avg("loser_aces")       AS "mean_aces",
+        count(*)                AS "count"
+    FROM (SELECT * FROM "match_facts" {where}) AS "facts"
+    WHERE "loser_height" IS NOT NULL AND "loser_aces" IS NOT NULL
+    GROUP BY "season", "loser_height"
+    ORDER BY "season", "type" DESC, "height";
+"""
+
+# A repeatable random sample of the rows behind the fitted lines, for a scatter layer
+height_sample_query = """
+    SELECT "season", 'winner' AS "type", "winner_height" AS "height", "winner_aces" AS "aces"
+    FROM (SELECT * FROM {sampled_facts} {where}) AS "facts"
+    WHERE "winner_height" IS NOT NULL AND "winner_aces" IS NOT NULL
+    UNION ALL
+    SELECT "season", 'loser' AS "type", "loser_height" AS "height", "loser_aces" AS "aces"
+    FROM (SELECT * FROM {sampled_facts} {where}) AS "facts"
+    WHERE "loser_height" IS NOT NULL AND "loser_aces" IS NOT NULL;
+"""
 
-# Adjust legend title and label sizes
-plt.setp(g._legend.get_title(), fontsize=20)
-plt.setp(g._legend.get_texts(), fontsize=20)
 
-# Adjust font sizes for tick labels on x and y axes
-g.set_xticklabels(fontsize=15)
-g.set_yticklabels(fontsize=15)
+# repeatable bernoulli sample of the match facts; sqlite has no TABLESAMPLE, so it keeps
+# the rows whose scrambled rowid falls below the percent of the 32 bit range
+SAMPLED_FACTS = '"match_facts" TABLESAMPLE BERNOULLI (:percent) REPEATABLE (0)'
+SQLITE_SAMPLED_FACTS = (
+    '(SELECT * FROM "match_facts" '
+    'WHERE ("rowid" * 2654435761) % 4294967296 < :percent * 42949672.96) AS "match_facts"'
+)
 
-# Set the y-axis to start from 0
-g.set(ylim=(0, None))
 
-# Display the plots
-plt.savefig('analysis1.png')
-plt.close()
+# sample of the match facts in the dialect of the fetch backend
+def sampled_facts() -> str:
+    if FETCH_BACKEND != 'duckdb' and get_engine().dialect.name == 'sqlite':
+        return SQLITE_SAMPLED_FACTS
+    return SAMPLED_FACTS
+
+
+# mean aces per height, season and player type
+def height_aces_bins(filters: tuple[str, dict] = ('', {})) -> pd.DataFrame:
+    return read_sql(*filtered_query(height_bins_query, filters))
+
+
+# sampled winner and loser rows, about the given fraction of them
+def height_aces_sample(filters: tuple[str, dict] = ('', {}), fraction: float = 0.05) -> pd.DataFrame:
+    return read_sql(*filtered_query(
+        height_sample_query, filters, fragments={'sampled_facts': sampled_facts()}, percent=100 * fraction
+    ))
+
+
+# Draw a fitted regression line over the observed height range of one facet
+def plot_regression_line(data: pd.DataFrame, color, label: str, **kwargs):
+    import matplotlib.pyplot as plt
+    for row in data.itertuples():
+        heights = [row.min_height, row.max_height]
+        aces = [row.intercept + row.slope * height for height in heights]
+        plt.plot(heights, aces, color=color, label=label, **kwargs)
+
+
+# draw the regression lines of every season in a grid of plots
+def plot_height_aces(
+    analysis_table: pd.DataFrame,
+    path: str = 'analysis1.png',
+    bins: pd.DataFrame | None = None,
+    sample: pd.DataFrame | None = None,
+) -> None:
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # Initialize a grid of plots with an Axes for each season.
+    # This FacetGrid will allow us to create a multi-plot grid for 
+    # visualizing relationships across many levels of a categorical variable
+    g = sns.FacetGrid(
+        data=analysis_table, 
+        col="season", 
+        hue="type", 
+        height=3, 
+        aspect=1.5, 
+        col_wrap=4,     # number of columns before wrapping to the next row
+        sharey=False,   # each facet/plot will have its own y-axis scale
+    )
+    # Draw the regression lines onto the FacetGrid to show the relationship 
+    # between height and aces for each type
+    g = g.map_dataframe(
+        func=plot_regression_line, 
+        linewidth=3,                # specify linewidth of the regression line
+    )
+
+    # Draw the sampled rows and the binned means of each facet in the colors of its lines,
+    # point sizes growing with the number of matches behind each mean
+    colors = dict(zip(g.hue_names, sns.color_palette(n_colors=len(g.hue_names))))
+    for layer, y_column in ((sample, 'aces'), (bins, 'mean_aces')):
+        if layer is None:
+            continue
+        for (season, kind), rows in layer.groupby(['season', 'type']):
+            if season not in g.axes_dict or kind not in colors:
+                continue
+            sizes = 4 if y_column == 'aces' else 10 + 90 * rows['count'] / rows['count'].max()
+            g.axes_dict[season].scatter(
+                rows['height'], rows[y_column], s=sizes, color=colors[kind],
+                alpha=0.2 if y_column == 'aces' else 0.6, linewidths=0,
+            )
+
+    # Set x and y axis labels with increased font size
+    g.set_axis_labels(x_var="Height", y_var="Aces", fontsize=20)
+
+    # Set title for each subplot based on the season, with specified font style and size
+    g.set_titles(template="{col_name}", fontweight="bold", fontsize=20)
+
+    # Add the legend without a title and specify the order of labels
+    g.add_legend(title="", fontsize=20, label_order=["winner", "loser"])
+
+    # Adjust legend title and label sizes
+    plt.setp(g._legend.get_title(), fontsize=20)
+    plt.setp(g._legend.get_texts(), fontsize=20)
+
+    # Adjust font sizes for tick labels on x and y axes
+    g.set_xticklabels(fontsize=15)
+    g.set_yticklabels(fontsize=15)
+
+    # Set the y-axis to start from 0
+    g.set(ylim=(0, None))
+
+    # Display the plots
+    plt.savefig(path)
+    plt.close()
 
 
 
@@ -189,62 +465,206 @@ In tennis, the serve is a foundational stroke that can set the tone for a point.
 This pattern suggests that in professional tennis, it's not just about serving to start the rally; it's about using the serve as a potent weapon. The ability to consistently get the first serve in and then effectively handle the subsequent play can be a decisive factor in the outcome of a match. The data emphasizes the strategic importance of an effective first serve in the high-stakes environment of professional tennis.
 """
 
-# Define a function to split a string at the first underscore and return the second portion; 
-# if there's no underscore, return the string as it is.
-rename_function = lambda x: x.split('_', maxsplit=1)[1] if '_' in x else x
-
-# Extract relevant columns for winners and rename them using the previously defined function
-winner_table = table[[
-    'season', 
-    'winner_first_serve_in', 
-    'winner_first_serve_won'
-]]
-winner_table = winner_table.rename(rename_function, axis=1)
-# Add a column to label the data as 'winner'
-winner_table['type'] = 'winner'
-
-# Extract relevant columns for losers and rename them similarly
-loser_table = table[[
-    'season',
-    'loser_first_serve_in',
-    'loser_first_serve_won'
-]]
-loser_table = loser_table.rename(rename_function, axis=1)
-# Add a column to label the data as 'loser'
-loser_table['type'] = 'loser'
-
-# Merge both winner and loser tables vertically and drop any rows with missing data
-analysis_table = pd.concat(
-    [winner_table, loser_table], 
-    axis=0
-).dropna(how='any')
-
-# Set the Seaborn plot style to "whitegrid"
-sns.set_style("whitegrid")
-# Set Seaborn plot context to "talk" which is optimal for presentations;
-sns.set_context("talk")
-
-# Create a jointplot to visualize the relationship between 'first_serve_in' and 'first_serve_won' 
-jp = sns.jointplot(
-    x="first_serve_in", 
-    y="first_serve_won", 
-    data=analysis_table,
-    kind="reg", 
-    truncate=False,
-    height=7,
-    scatter_kws={'s': 50, 'alpha': 0.7},
-    line_kws={'linewidth': 2.5}
-)
-
-# Adjust plot labels
-jp.ax_joint.set_xlabel("First Serve In", fontsize=14)
-jp.ax_joint.set_ylabel("First Serve Won", fontsize=14)
-# Adds dashed gridlines to the histograms on the top and right side of the jointplot
-jp.ax_marg_x.grid(True, which="both", linestyle="--", linewidth=0.5)
-jp.ax_marg_y.grid(True, which="both", linestyle="--", linewidth=0.5)
+# Pool winners and losers and regress first serves won on first serves in, in the database
+serves_query = """
+        SELECT "winner_first_serve_in" AS "first_serve_in", "winner_first_serve_won" AS "first_serve_won"
+        FROM "match_facts"
+        {where}
+        UNION ALL
+        SELECT "loser_first_serve_in", "loser_first_serve_won"
+        FROM "match_facts"
+        {where}
+"""
+first_serve_query = f"""
+    WITH "serves" AS ({serves_query})
+    SELECT 
+        regr_slope("first_serve_won", "first_serve_in")     AS "slope",
+        regr_intercept("first_serve_won", "first_serve_in") AS "intercept",
+        corr("first_serve_won", "first_serve_in")           AS "correlation",
+        regr_count("first_serve_won", "first_serve_in")     AS "count",
+        min("first_serve_in") FILTER (WHERE "first_serve_won" IS NOT NULL) AS "min_first_serve_in",
+        max("first_serve_in") FILTER (WHERE "first_serve_won" IS NOT NULL) AS "max_first_serve_in"
+    FROM "serves";
+"""
 
+# Number of serves at every (first serve in, first serve won) pair, for the joint distribution
+first_serve_bins_query = f"""
+    WITH "serves" AS ({serves_query})
+    SELECT "first_serve_in", "first_serve_won", count(*) AS "count"
+    FROM "serves"
+    WHERE "first_serve_in" IS NOT NULL AND "first_serve_won" IS NOT NULL
+    GROUP BY "first_serve_in", "first_serve_won";
+"""
 
-# Display the plots
-plt.tight_layout()
-plt.savefig('analysis2.png', dpi=300, bbox_inches="tight")
 
+# pooled regression of first serves won on first serves in
+def first_serve_regression(filters: tuple[str, dict] = ('', {})) -> pd.Series:
+    return read_sql(*filtered_query(first_serve_query, filters)).iloc[0]
+
+
+# number of serves per (first serve in, first serve won) pair
+def first_serve_bins(filters: tuple[str, dict] = ('', {})) -> pd.DataFrame:
+    return read_sql(*filtered_query(first_serve_bins_query, filters))
+
+
+# draw the fitted first serve line with its correlation and sample size,
+# over the hexbin counts and marginal histograms of the serves when given
+def plot_first_serve(
+    first_serve: pd.Series,
+    path: str = 'analysis2.png',
+    bins: pd.DataFrame | None = None,
+) -> None:
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # Use the Seaborn plot style "whitegrid" and the context "talk", which is optimal
+    # for presentations, for this figure only
+    with sns.axes_style("whitegrid"), sns.plotting_context("talk"):
+        if bins is None:
+            fig, ax = plt.subplots(figsize=(7, 7))
+        else:
+            # Hexbin counts of the serves with their marginal histograms, from the pre-aggregated pairs
+            grid = sns.JointGrid(height=7)
+            fig, ax = grid.figure, grid.ax_joint
+            ax.hexbin(
+                bins['first_serve_in'], bins['first_serve_won'], C=bins['count'],
+                reduce_C_function=np.sum, gridsize=40, mincnt=1, cmap="Blues",
+            )
+            marginal_x = bins.groupby('first_serve_in')['count'].sum()
+            marginal_y = bins.groupby('first_serve_won')['count'].sum()
+            grid.ax_marg_x.bar(marginal_x.index, marginal_x.to_numpy(), width=1)
+            grid.ax_marg_y.barh(marginal_y.index, marginal_y.to_numpy(), height=1)
+
+        # Plot the fitted line between 'first_serve_in' and 'first_serve_won' over the observed range
+        first_serve_in = [first_serve['min_first_serve_in'], first_serve['max_first_serve_in']]
+        ax.plot(
+            first_serve_in,
+            [first_serve['intercept'] + first_serve['slope'] * x for x in first_serve_in],
+            linewidth=2.5,
+            color="C1" if bins is not None else None,
+        )
+        title = f"r = {first_serve['correlation']:.2f}, n = {first_serve['count']:,.0f}"
+        if bins is None:
+            ax.set_title(title, fontsize=14)
+        else:
+            fig.suptitle(title, fontsize=14, y=1.02)
+
+        # Adjust plot labels
+        ax.set_xlabel("First Serve In", fontsize=14)
+        ax.set_ylabel("First Serve Won", fontsize=14)
+
+        # Display the plots
+        plt.tight_layout()
+        plt.savefig(path, dpi=300, bbox_inches="tight")
+        plt.close(fig)
+
+
+# plot arguments of every report; the fast mode adds the data layers of the figures,
+# aggregated in the database instead of drawn from every row
+def prepare_heatmap(filters: tuple[str, dict], fast: bool = False, sample_fraction: float = 0.0) -> dict:
+    return {'matrix': correlation_matrix(filters)}
+
+
+def prepare_height_aces(filters: tuple[str, dict], fast: bool = False, sample_fraction: float = 0.0) -> dict:
+    arguments = {'analysis_table': height_aces_regressions(filters)}
+    if fast:
+        arguments['bins'] = height_aces_bins(filters)
+    if fast and sample_fraction > 0:
+        arguments['sample'] = height_aces_sample(filters, fraction=sample_fraction)
+    return arguments
+
+
+def prepare_first_serve(filters: tuple[str, dict], fast: bool = False, sample_fraction: float = 0.0) -> dict:
+    arguments = {'first_serve': first_serve_regression(filters)}
+    if fast:
+        arguments['bins'] = first_serve_bins(filters)
+    return arguments
+
+
+# report name: (function querying the plot arguments, function drawing them, default figure)
+REPORTS = {
+    'heatmap'       : (prepare_heatmap, plot_heatmap, 'heatmap.png'),
+    'height-aces'   : (prepare_height_aces, plot_height_aces, 'analysis1.png'),
+    'first-serve'   : (prepare_first_serve, plot_first_serve, 'analysis2.png'),
+}
+
+
+# render figures, in parallel worker processes when there are several;
+# the queries run before, in this process, so workers never open database connections
+def render(figures: list[tuple], jobs: int | None = None) -> None:
+    jobs = jobs or min(len(figures), os.cpu_count() or 1)
+    if len(figures) < 2 or jobs == 1:
+        for plot, arguments, path in figures:
+            plot(path=path, **arguments)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(plot, path=path, **arguments)
+            for plot, arguments, path in figures
+        ]
+        for future in futures:
+            future.result()
+
+
+# parse a comma separated list
+def parse_list(text: str) -> list[str]:
+    return [value.strip() for value in text.split(',') if value.strip()]
+
+
+# command line entry point
+def main(argv: list[str] | None = None) -> None:
+    global FETCH_BACKEND, USE_RESULT_CACHE, WAREHOUSE_DIR
+    # filters shared by every report
+    filter_parser = argparse.ArgumentParser(add_help=False)
+    filter_parser.add_argument('--seasons', type=parse_seasons, default=None)
+    filter_parser.add_argument('--tourney-ids', type=parse_list, default=None)
+    filter_parser.add_argument('--tourney-levels', type=parse_list, default=None)
+    filter_parser.add_argument('--surfaces', type=parse_list, default=None)
+    filter_parser.add_argument('--fetch-backend', choices=['sqlalchemy', 'arrow', 'duckdb'], default=FETCH_BACKEND)
+    filter_parser.add_argument('--warehouse', type=pathlib.Path, default=WAREHOUSE_DIR, help='parquet warehouse of the duckdb backend')
+    filter_parser.add_argument('--database-url', default=None, help='database to query, e.g. sqlite:///atp.sqlite (see backend.py)')
+    filter_parser.add_argument('--no-cache', action='store_true', help='always query the database')
+    filter_parser.add_argument('--fast', action='store_true', help='draw binned means and hexbin counts aggregated in the database')
+    filter_parser.add_argument('--sample-fraction', type=float, default=0.0, help='fraction of rows in scatter layers of the fast mode')
+    filter_parser.add_argument('--jobs', type=int, default=None, help='figures rendered in parallel, up to one per cpu by default')
+    parser = argparse.ArgumentParser(description='ATP match analysis reports')
+    subparsers = parser.add_subparsers(dest='report', required=True)
+    for name, (_, _, default_path) in REPORTS.items():
+        report_parser = subparsers.add_parser(name, parents=[filter_parser])
+        report_parser.add_argument('--output', default=default_path, help='figure path')
+    all_parser = subparsers.add_parser('all', parents=[filter_parser], help='render every report')
+    all_parser.add_argument('--output-dir', type=pathlib.Path, default=pathlib.Path('.'), help='directory of the figures, created if missing')
+    args = parser.parse_args(argv)
+    FETCH_BACKEND = args.fetch_backend
+    WAREHOUSE_DIR = args.warehouse
+    USE_RESULT_CACHE = not args.no_cache
+    if args.database_url is not None:
+        import backend
+        backend.configure(url=args.database_url)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    filters = match_facts_filter(
+        seasons=args.seasons,
+        tourney_ids=args.tourney_ids,
+        tourney_levels=args.tourney_levels,
+        surfaces=args.surfaces,
+    )
+    if args.report == 'all':
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        reports = {
+            name: args.output_dir / default_path
+            for name, (_, _, default_path) in REPORTS.items()
+        }
+    else:
+        reports = {args.report: args.output}
+    figures = []
+    for name, path in reports.items():
+        prepare, plot, _ = REPORTS[name]
+        arguments = prepare(filters, fast=args.fast, sample_fraction=args.sample_fraction)
+        figures.append((plot, arguments, path))
+    render(figures, jobs=args.jobs)
+    if get_result_cache() is not None:
+        logger.info("result cache: %s", get_result_cache().stats)
+
+
+if __name__ == '__main__':
+    main()
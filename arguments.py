@@ -0,0 +1,11 @@
+# command line argument types shared by the pipeline and the analysis, kept free of
+# dependencies so importing them does not load either side
+
+
+# parse a season range such as "1991-2023", "2020" or "1991,1995-1997"
+def parse_seasons(text: str) -> list[int]:
+    seasons = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        seasons.update(range(int(first), int(last or first) + 1))
+    return sorted(seasons)
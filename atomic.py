@@ -0,0 +1,23 @@
+import contextlib
+import os
+import pathlib
+import uuid
+
+
+# path of a temporary file next to the given file, moved over it when the block succeeds
+# and removed when it fails, so readers never see a partial file
+@contextlib.contextmanager
+def replacing(path: str | os.PathLike):
+    path = pathlib.Path(path)
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+# write a text file atomically
+def write_text(path: str | os.PathLike, text: str) -> None:
+    with replacing(path) as temp_path:
+        temp_path.write_text(text)
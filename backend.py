@@ -0,0 +1,440 @@
+import contextlib
+import io
+import os
+import uuid
+import pandas as pd
+import sqlalchemy
+import instrumentation
+
+
+# database of the pipeline and the analysis, authentication.DB_CONNECTION_STRING unless given
+# here, in the ATP_DATABASE_URL environment variable or through configure,
+# e.g. "sqlite:///atp.sqlite" for a local file created from create_sqlite.sql
+DATABASE_URL = os.environ.get('ATP_DATABASE_URL')
+
+# connection pool of the engine: connections kept open, extra connections opened under load,
+# seconds to wait for a free connection and seconds after which a connection is reopened
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 30
+POOL_RECYCLE = 1800
+# test pooled connections before handing them out, so a restarted database is reconnected
+POOL_PRE_PING = True
+
+# rows per executemany batch, and values per IN list of dialects without array parameters
+INSERT_BATCH_SIZE = 10_000
+
+# pragmas of every sqlite connection: concurrent readers next to the writer of the
+# write-ahead log, syncs on checkpoints only, and the foreign keys of create_sqlite.sql
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous' : 'normal',
+    'foreign_keys': 'on',
+}
+
+
+# statistical aggregates of the analysis queries that sqlite lacks, registered on every sqlite
+# connection with the postgresql semantics: rows with a null argument are ignored and
+# undefined results are null; sums of squares are updated around running means
+class _Regression:
+
+    # concrete constructor
+    def __init__(self) -> None:
+        # assign instance variables
+        self.count = 0
+        self.mean_x = self.mean_y = 0.0
+        self.sum_xx = self.sum_yy = self.sum_xy = 0.0
+
+    # add a row; the dependent variable comes first, like regr_slope(y, x)
+    def step(self, y, x) -> None:
+        if y is None or x is None:
+            return
+        self.count += 1
+        delta_x = x - self.mean_x
+        delta_y = y - self.mean_y
+        self.mean_x += delta_x / self.count
+        self.mean_y += delta_y / self.count
+        self.sum_xx += delta_x * (x - self.mean_x)
+        self.sum_yy += delta_y * (y - self.mean_y)
+        self.sum_xy += delta_x * (y - self.mean_y)
+
+    # abstract method: the aggregate of the added rows
+    def finalize(self):
+        raise NotImplementedError
+
+
+class _RegrCount(_Regression):
+
+    # implement
+    def finalize(self):
+        return self.count
+
+
+class _RegrSlope(_Regression):
+
+    # implement
+    def finalize(self):
+        if self.count == 0 or self.sum_xx == 0:
+            return None
+        return self.sum_xy / self.sum_xx
+
+
+class _RegrIntercept(_Regression):
+
+    # implement
+    def finalize(self):
+        if self.count == 0 or self.sum_xx == 0:
+            return None
+        return self.mean_y - self.mean_x * self.sum_xy / self.sum_xx
+
+
+class _Corr(_Regression):
+
+    # implement
+    def finalize(self):
+        if self.count == 0 or self.sum_xx == 0 or self.sum_yy == 0:
+            return None
+        return self.sum_xy / (self.sum_xx * self.sum_yy) ** 0.5
+
+
+# aggregates of every sqlite connection: name -> (number of arguments, aggregate class)
+SQLITE_AGGREGATES = {
+    'corr'          : (2, _Corr),
+    'regr_count'    : (2, _RegrCount),
+    'regr_slope'    : (2, _RegrSlope),
+    'regr_intercept': (2, _RegrIntercept),
+}
+
+# created on first use, so importing a module does not touch the database
+engine = None
+
+
+# url of the configured database
+def database_url() -> str:
+    if DATABASE_URL is not None:
+        return DATABASE_URL
+    from authentication import DB_CONNECTION_STRING
+    return DB_CONNECTION_STRING
+
+
+# engine with an explicitly sized pool; sqlite connections get the SQLITE_PRAGMAS
+# and the SQLITE_AGGREGATES
+def create_engine(url: str | sqlalchemy.URL) -> sqlalchemy.Engine:
+    url = sqlalchemy.make_url(url)
+    options = {'pool_pre_ping': POOL_PRE_PING}
+    # in-memory sqlite databases live in a single connection and keep their default pool
+    if url.get_backend_name() != 'sqlite' or url.database not in (None, '', ':memory:'):
+        options.update(
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+        )
+    engine = sqlalchemy.create_engine(url, **options)
+    if url.get_backend_name() == 'sqlite':
+
+        @sqlalchemy.event.listens_for(engine, 'connect')
+        def set_pragmas(db_connection, _):
+            cursor = db_connection.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f'pragma {name} = {value}')
+            cursor.close()
+            for name, (arguments, aggregate) in SQLITE_AGGREGATES.items():
+                db_connection.create_aggregate(name, arguments, aggregate)
+
+    return engine
+
+
+# engine of the configured database, created on first use
+def get_engine() -> sqlalchemy.Engine:
+    global engine
+    if engine is None:
+        engine = create_engine(database_url())
+    return engine
+
+
+# point the backend at another database or engine, or resize the pool of the next engine;
+# the connections of the previous engine are closed
+def configure(
+    url: str | None = None,
+    engine: sqlalchemy.Engine | None = None,
+    pool_size: int | None = None,
+    max_overflow: int | None = None,
+) -> None:
+    global DATABASE_URL, POOL_SIZE, MAX_OVERFLOW
+    if url is not None:
+        DATABASE_URL = url
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if max_overflow is not None:
+        MAX_OVERFLOW = max_overflow
+    previous = globals()['engine']
+    if previous is not None and previous is not engine:
+        previous.dispose()
+    globals()['engine'] = engine
+
+
+# open a transaction on the given connection, or on a new pooled connection
+@contextlib.contextmanager
+def begin(connection: sqlalchemy.Connection | None = None):
+    if connection is not None:
+        yield connection
+        return
+    with get_engine().begin() as db_connection:
+        yield db_connection
+
+
+# whether the database has season partitions, the stand-ins have unpartitioned fact tables
+def supports_partitions(connection: sqlalchemy.Connection | None = None) -> bool:
+    dialect = connection.dialect if connection is not None else get_engine().dialect
+    return dialect.name == 'postgresql'
+
+
+# bulk load through COPY FROM STDIN with an in-memory csv buffer (postgresql)
+def _copy_rows(table_name: str, table: pd.DataFrame, connection: sqlalchemy.Connection) -> None:
+    buffer = io.StringIO()
+    table.to_csv(buffer, header=False, index=False, na_rep=r'\N', date_format='%Y-%m-%d')
+    buffer.seek(0)
+    columns = ', '.join(f'"{column}"' for column in table.columns)
+    query = f"""copy "{table_name}" ({columns}) from stdin with (format csv, null '\\N')"""
+    # COPY bypasses the statement events of sqlalchemy, so it is timed here
+    with connection.connection.cursor() as cursor, instrumentation.measure('db_seconds'):
+        cursor.copy_expert(sql=query, file=buffer)
+
+
+# bulk load through executemany of the DBAPI driver with row tuples (sqlite),
+# skipping the per-row parameter processing of sqlalchemy
+def _executemany_rows(table_name: str, table: pd.DataFrame, connection: sqlalchemy.Connection) -> None:
+    columns = ', '.join(f'"{column}"' for column in table.columns)
+    placeholders = ', '.join('?' for _ in table.columns)
+    query = f'insert into "{table_name}" ({columns}) values ({placeholders})'
+    # sqlite keeps dates as iso text, which sorts and compares like the dates
+    table = table.copy()
+    for column in table.select_dtypes(include='datetime').columns:
+        table[column] = table[column].dt.strftime('%Y-%m-%d')
+    # convert missing values of every dtype to None
+    records = list(table.astype(object).where(table.notna(), None).itertuples(index=False, name=None))
+    for start in range(0, len(records), INSERT_BATCH_SIZE):
+        connection.exec_driver_sql(query, records[start:start + INSERT_BATCH_SIZE])
+
+
+# bulk load through batched executemany inserts (other dialects)
+def _insert_rows(table_name: str, table: pd.DataFrame, connection: sqlalchemy.Connection) -> None:
+    statement = sqlalchemy.table(
+        table_name, *[sqlalchemy.column(column) for column in table.columns]
+    ).insert()
+    # convert missing values of every dtype to None
+    records = table.astype(object).where(table.notna(), None).to_dict('records')
+    for start in range(0, len(records), INSERT_BATCH_SIZE):
+        connection.execute(statement, records[start:start + INSERT_BATCH_SIZE])
+
+
+# bulk loader per sqlalchemy dialect name, other dialects use batched inserts
+bulk_loaders = {
+    'postgresql': _copy_rows,
+    'sqlite'    : _executemany_rows,
+}
+
+
+# append the rows of a frame to a db table with the fastest loader of the dialect
+def bulk_insert(table_name: str, table: pd.DataFrame, connection: sqlalchemy.Connection) -> None:
+    loader = bulk_loaders.get(connection.dialect.name, _insert_rows)
+    loader(table_name, table, connection)
+
+
+# temporary table holding the given values in one column, for joins with large id sets (sqlite)
+@contextlib.contextmanager
+def _id_table(connection: sqlalchemy.Connection, values: list):
+    name = f"ids_{uuid.uuid4().hex}"
+    connection.exec_driver_sql(f'create temporary table "{name}" ("value" primary key) without rowid')
+    try:
+        for start in range(0, len(values), INSERT_BATCH_SIZE):
+            connection.exec_driver_sql(
+                f'insert or ignore into "{name}" ("value") values (?)',
+                [(value,) for value in values[start:start + INSERT_BATCH_SIZE]],
+            )
+        yield name
+    finally:
+        connection.exec_driver_sql(f'drop table "{name}"')
+
+
+# run a statement with a "{condition}" placeholder for the given values of a column,
+# return the first column of its result rows: a single array parameter on postgresql,
+# a join with a temporary id table on sqlite and batched IN lists elsewhere
+def _execute_in(connection: sqlalchemy.Connection, statement: str, column: str, values: list) -> list:
+    values = list(values)
+    if connection.dialect.name == 'postgresql':
+        queries = [(f'"{column}" = any(:values)', {'values': values})]
+    elif connection.dialect.name == 'sqlite':
+        with _id_table(connection, values) as id_table:
+            query = sqlalchemy.sql.text(statement.format(
+                condition=f'"{column}" in (select "value" from "{id_table}")'
+            ))
+            result = connection.execute(statement=query)
+            # rows are fetched before the id table is dropped
+            return result.scalars().all() if result.returns_rows else []
+    else:
+        # batches stay below the bound parameter limit
+        queries = [
+            (f'"{column}" in :values', {'values': values[start:start + INSERT_BATCH_SIZE]})
+            for start in range(0, len(values), INSERT_BATCH_SIZE)
+        ]
+    rows = []
+    for condition, parameters in queries:
+        query = sqlalchemy.sql.text(statement.format(condition=condition))
+        if connection.dialect.name != 'postgresql':
+            query = query.bindparams(sqlalchemy.bindparam('values', expanding=True))
+        result = connection.execute(statement=query, parameters=parameters)
+        if result.returns_rows:
+            rows += result.scalars().all()
+    return rows
+
+
+# delete the rows of a db table whose column takes one of the given values
+def delete_in(connection: sqlalchemy.Connection, table_name: str, column: str, values: list) -> None:
+    if len(values) == 0:
+        return
+    _execute_in(connection, f'delete from "{table_name}" where {{condition}}', column=column, values=values)
+
+
+# values of a db table column that exist among the given values, or the distinct values
+# of another column, the result column, in the rows where the column takes one of them
+def select_in(
+    connection: sqlalchemy.Connection,
+    table_name: str,
+    column: str,
+    values: list,
+    result_column: str | None = None,
+) -> pd.Index:
+    if len(values) == 0:
+        return pd.Index([])
+    if result_column is None:
+        statement = f'select "{column}" from "{table_name}" where {{condition}}'
+    else:
+        statement = f'select distinct "{result_column}" from "{table_name}" where {{condition}}'
+    return pd.Index(_execute_in(connection, statement, column=column, values=values)).unique()
+
+
+# create an empty temporary staging table with the given columns of a db table;
+# temporary tables are not written to the WAL, like unlogged tables
+def create_stage(
+    connection: sqlalchemy.Connection,
+    stage_name: str,
+    table_name: str,
+    columns: list[str],
+) -> None:
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    connection.exec_driver_sql(f'drop table if exists "{stage_name}"')
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(
+            f'create temporary table "{stage_name}" as '
+            f'select {column_list} from "{table_name}" with no data'
+        )
+    else:
+        connection.exec_driver_sql(
+            f'create temporary table "{stage_name}" as '
+            f'select {column_list} from "{table_name}" where 0 = 1'
+        )
+
+
+# comparison of row values that treats nulls as equal;
+# sqlite spells "is distinct from" as "is not"
+def _is_distinct(connection: sqlalchemy.Connection) -> str:
+    return 'is distinct from' if connection.dialect.name == 'postgresql' else 'is not'
+
+
+# values a merge writes into the value columns of a target row, given the target and the
+# new row references; estimates, as {column: support column}, and their supports keep their
+# target values unless the new estimate is known and supported at least as well
+def _merged_values(
+    value_columns: list[str],
+    estimates: dict[str, str],
+    target: str,
+    new: str,
+) -> list[str]:
+    conditions = {
+        column: (
+            f'{new}."{column}" is not null and '
+            f'({target}."{support}" is null or {new}."{support}" >= {target}."{support}")'
+        )
+        for estimate, support in estimates.items()
+        for column in (estimate, support)
+    }
+    return [
+        f'case when {conditions[column]} then {new}."{column}" else {target}."{column}" end'
+        if column in conditions else f'{new}."{column}"'
+        for column in value_columns
+    ]
+
+
+# keys of the existing rows of a db table whose values a merge of the staging table would
+# change; a change of the support of an estimate alone does not count
+def changed_keys(
+    connection: sqlalchemy.Connection,
+    stage_name: str,
+    table_name: str,
+    columns: list[str],
+    key_columns: tuple[str, ...],
+    estimates: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    estimates = estimates or {}
+    value_columns = [
+        column for column in columns
+        if column not in key_columns and column not in estimates.values()
+    ]
+    if not value_columns:
+        return pd.DataFrame(columns=list(key_columns))
+    key_list = ', '.join(f's."{column}"' for column in key_columns)
+    key_match = ' and '.join(f't."{column}" = s."{column}"' for column in key_columns)
+    target_values = ', '.join(f't."{column}"' for column in value_columns)
+    stage_values = ', '.join(_merged_values(value_columns, estimates, target='t', new='s'))
+    return pd.read_sql(
+        sql=sqlalchemy.sql.text(
+            f'select distinct {key_list} from "{stage_name}" s join "{table_name}" t on {key_match} '
+            f'where ({target_values}) {_is_distinct(connection)} ({stage_values})'
+        ),
+        con=connection,
+    )
+
+
+# insert the rows of a staging table into a db table, updating the rows whose key exists
+# only where a value changed; one of several staged rows with the same key is written,
+# estimates only replace existing ones supported by no more rows (see _merged_values)
+def merge_stage(
+    connection: sqlalchemy.Connection,
+    stage_name: str,
+    table_name: str,
+    columns: list[str],
+    key_columns: tuple[str, ...],
+    estimates: dict[str, str] | None = None,
+) -> None:
+    estimates = estimates or {}
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    key_list = ', '.join(f'"{column}"' for column in key_columns)
+    value_columns = [column for column in columns if column not in key_columns]
+    distinct = _is_distinct(connection)
+    if value_columns:
+        merged_values = _merged_values(value_columns, estimates, target=f'"{table_name}"', new='excluded')
+        assignments = ', '.join(
+            f'"{column}" = {value}' for column, value in zip(value_columns, merged_values)
+        )
+        target_values = ', '.join(f'"{table_name}"."{column}"' for column in value_columns)
+        excluded_values = ', '.join(merged_values)
+        on_conflict = f'do update set {assignments} where ({target_values}) {distinct} ({excluded_values})'
+    else:
+        on_conflict = 'do nothing'
+    # a row may be proposed only once per key, otherwise on conflict fails
+    if connection.dialect.name == 'postgresql':
+        rows = f'select distinct on ({key_list}) {column_list} from "{stage_name}" order by {key_list}'
+    else:
+        # the key index serves the deduplication and the joins with the target table,
+        # which sqlite would otherwise run as nested scans
+        connection.exec_driver_sql(f'create index "{stage_name}_key" on "{stage_name}" ({key_list})')
+        # the where clause also keeps sqlite from parsing on conflict as a join constraint
+        rows = (
+            f'select {column_list} from "{stage_name}" '
+            f'where rowid in (select max(rowid) from "{stage_name}" group by {key_list})'
+        )
+    connection.exec_driver_sql(
+        f'insert into "{table_name}" ({column_list}) {rows} on conflict ({key_list}) {on_conflict}'
+    )
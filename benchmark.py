@@ -0,0 +1,348 @@
+import argparse
+import datetime
+import json
+import logging
+import pathlib
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import sqlalchemy
+import backend
+import pipeline
+from cache import FrameCache
+from fetcher import Fetcher
+
+
+# size of a real season at scale 1
+MATCHES_PER_SEASON = 3_000
+PLAYERS_PER_SEASON = 450
+MATCHES_PER_TOURNAMENT = 45
+
+# value pools of the synthetic seasons
+SURFACES = ['Hard', 'Clay', 'Grass', 'Carpet']
+TOURNEY_LEVELS = ['A', 'M', 'G', 'D', 'F']
+DRAW_SIZES = [8, 32, 64, 128]
+ROUNDS = ['R128', 'R64', 'R32', 'R16', 'QF', 'SF', 'F', 'RR']
+HANDS = ['R', 'L', 'U']
+IOC_CODES = ['USA', 'ESP', 'FRA', 'ARG', 'AUS', 'GER', 'ITA', 'SRB', 'SUI', 'GBR', 'RUS', 'CRO']
+ENTRIES = ['Q', 'WC', 'LL']
+SCORES = [
+    '6-4 6-3', '7-6(4) 3-6 6-4', '6-2 6-7(5) 7-5', '6-3 2-1 RET', 'W/O',
+    '4-6 6-4 6-3 3-6 7-5', '7-5 7-5', '6-1 6-0', '3-6 7-6(8) 6-4 6-4',
+]
+
+# sqlite schema used when no postgresql database is given
+SQLITE_SCHEMA = pathlib.Path(__file__).parent / 'create_sqlite.sql'
+
+logger = logging.getLogger(__name__)
+
+
+# seeded synthetic season with the columns and value types of ATP.type_mapping
+def generate_season(season: int, scale: float = 1.0, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng([seed, season])
+    n_matches = max(1, round(MATCHES_PER_SEASON * scale))
+    n_players = max(2, round(PLAYERS_PER_SEASON * scale))
+    n_tourneys = max(1, -(-n_matches // MATCHES_PER_TOURNAMENT))
+
+    # tournaments, in calendar order
+    tourney_dates = (
+        pd.Timestamp(year=season, month=1, day=1)
+        + pd.to_timedelta(np.sort(rng.integers(0, 365, n_tourneys)), unit='D')
+    )
+    tourney_levels = rng.choice(TOURNEY_LEVELS, n_tourneys, p=[0.55, 0.15, 0.05, 0.2, 0.05])
+
+    # players, with a fractional birth year to derive their age at each tournament
+    player_ids = np.arange(100_000, 100_000 + n_players).astype(str)
+    hands = rng.choice(HANDS, n_players, p=[0.85, 0.13, 0.02])
+    heights = rng.normal(186, 7, n_players).round()
+    heights[rng.random(n_players) < 0.2] = np.nan
+    iocs = rng.choice(IOC_CODES, n_players)
+    birth_years = season - rng.uniform(17, 38, n_players)
+    ranks = rng.permutation(n_players) + 1
+    points = np.round(12_000 / np.sqrt(ranks))
+
+    # matches, grouped by tournament so match numbers are contiguous
+    tourney = np.sort(rng.integers(0, n_tourneys, n_matches))
+    winner = rng.integers(0, n_players, n_matches)
+    loser = (winner + rng.integers(1, n_players, n_matches)) % n_players
+    match_dates = tourney_dates[tourney]
+    season_fraction = match_dates.year + (match_dates.dayofyear - 1) / 365.25
+
+    table = {
+        'tourney_id'        : np.char.add(f'{season}-', tourney.astype(str)),
+        'tourney_name'      : np.char.add('Tournament ', tourney.astype(str)),
+        'surface'           : rng.choice(SURFACES, n_tourneys)[tourney],
+        'draw_size'         : rng.choice(DRAW_SIZES, n_tourneys).astype(float)[tourney],
+        'tourney_level'     : tourney_levels[tourney],
+        'tourney_date'      : tourney_dates.strftime('%Y%m%d')[tourney],
+        'match_num'         : pd.Series(tourney).groupby(tourney).cumcount().to_numpy() + 1,
+        'score'             : rng.choice(SCORES, n_matches),
+        'best_of'           : np.where(tourney_levels[tourney] == 'G', 5.0, 3.0),
+        'round'             : rng.choice(ROUNDS, n_matches),
+        'minutes'           : np.where(rng.random(n_matches) < 0.1, np.nan, rng.integers(45, 300, n_matches)),
+    }
+    for side, players in (('winner', winner), ('loser', loser)):
+        seeds = np.where(ranks[players] <= 32, ranks[players], np.nan)
+        entries = np.where(rng.random(n_matches) < 0.1, rng.choice(ENTRIES, n_matches), None)
+        table[f'{side}_id'] = player_ids[players]
+        table[f'{side}_seed'] = seeds
+        table[f'{side}_entry'] = entries
+        table[f'{side}_name'] = np.char.add('Player ', player_ids[players])
+        table[f'{side}_hand'] = hands[players]
+        table[f'{side}_ht'] = heights[players]
+        table[f'{side}_ioc'] = iocs[players]
+        table[f'{side}_age'] = np.round(season_fraction - birth_years[players], 1)
+        table[f'{side}_rank'] = ranks[players].astype(float)
+        table[f'{side}_rank_points'] = points[players]
+
+    # serve statistics, missing for about one match in ten
+    missing = rng.random(n_matches) < 0.1
+    for prefix in ('w', 'l'):
+        serve_points = rng.integers(30, 130, n_matches)
+        first_in = rng.binomial(serve_points, 0.62)
+        break_points_faced = rng.integers(0, 15, n_matches)
+        statistics_table = {
+            'ace'       : rng.integers(0, 25, n_matches),
+            'df'        : rng.integers(0, 10, n_matches),
+            'svpt'      : serve_points,
+            '1stIn'     : first_in,
+            '1stWon'    : rng.binomial(first_in, 0.72),
+            '2ndWon'    : rng.binomial(serve_points - first_in, 0.5),
+            'SvGms'     : serve_points // 6,
+            'bpSaved'   : rng.binomial(break_points_faced, 0.6),
+            'bpFaced'   : break_points_faced,
+        }
+        for name, values in statistics_table.items():
+            table[f'{prefix}_{name}'] = np.where(missing, np.nan, values)
+
+    return pd.DataFrame(table)[list(pipeline.ATP.type_mapping)]
+
+
+# write a synthetic season where ATP reads it from, return the file path
+def write_season(directory: pathlib.Path, season: int, scale: float, seed: int) -> pathlib.Path:
+    path = directory / f"{pipeline.ATP.file_prefix}{season}.csv"
+    generate_season(season=season, scale=scale, seed=seed).to_csv(path, index=False)
+    return path
+
+
+# engine of the benchmark database, a fresh sqlite file unless a database url is given,
+# which is only emptied when the caller allows it
+def create_engine(
+    database_url: str | None,
+    directory: pathlib.Path,
+    allow_truncate: bool = False,
+) -> sqlalchemy.Engine:
+    if database_url is not None:
+        if not allow_truncate:
+            raise ValueError(f"the benchmark empties the tables of {database_url}, allow truncating it to use it")
+        engine = backend.create_engine(database_url)
+        # a postgresql database created from create.sql, emptied before the benchmark
+        with engine.begin() as db_connection:
+            db_connection.exec_driver_sql(
+                'truncate "tournaments", "players", "load_state", "match_facts", "player_features" cascade'
+            )
+        return engine
+    # in wal mode with the foreign keys of the schema, like every sqlite engine of the backend
+    engine = backend.create_engine(f"sqlite:///{directory / 'benchmark.sqlite'}")
+    db_connection = engine.raw_connection()
+    try:
+        db_connection.driver_connection.executescript(SQLITE_SCHEMA.read_text())
+    finally:
+        db_connection.close()
+    return engine
+
+
+# run a function, return its result and the elapsed wall clock time in seconds
+def timed(function, *args, **kwargs) -> tuple[object, float]:
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+# time reading, extracting, transforming and loading one synthetic season, then the analysis join
+def benchmark_season(
+    directory: pathlib.Path,
+    season: int,
+    repeats: int,
+) -> dict[tuple[str, str], dict]:
+    timings = {}
+
+    # record one timing of a stage step, with the number of rows it handled
+    def record(stage: str, step: str, seconds: float, rows: int) -> None:
+        timing = timings.setdefault((stage, step), {'seconds': [], 'rows': rows})
+        timing['seconds'].append(seconds)
+
+    cache_dir = directory / 'cache'
+    for _ in range(repeats):
+        # every repeat starts from an empty cache, so the first read parses the csv
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        pipeline.DataSource.cache = FrameCache(directory=cache_dir, max_bytes=pipeline.CACHE_MAX_BYTES)
+        pipeline.DataSource.fetcher = Fetcher(state_path=cache_dir / 'validators.json')
+        source = pipeline.ATP(season=season)
+        table, seconds = timed(lambda: source.table)
+        record('ATP', 'table', seconds, len(table))
+        cached_source = pipeline.ATP(season=season)
+        cached_source.content_hash = source.content_hash
+        table, seconds = timed(lambda: cached_source.table)
+        record('ATP', 'cached_table', seconds, len(table))
+
+        for etl_class in pipeline.DIMENSIONS + pipeline.FACTS:
+            etl = etl_class(source=source)
+            for step in ('extract', 'transform', 'load'):
+                _, seconds = timed(getattr(etl, step))
+                record(etl_class.__name__, step, seconds, len(etl._table))
+
+        _, seconds = timed(pipeline.refresh_match_facts, seasons=[season])
+        query = sqlalchemy.sql.text(pipeline.MATCH_FACTS_QUERY).bindparams(
+            sqlalchemy.bindparam('seasons', expanding=True)
+        )
+        if pipeline.ETL.warehouse is not None:
+            facts, join_seconds = timed(
+                pipeline.ETL.warehouse.read_sql, sql=query, params={'seasons': [season]}
+            )
+        else:
+            with backend.get_engine().connect() as db_connection:
+                facts, join_seconds = timed(
+                    pd.read_sql, sql=query, con=db_connection, params={'seasons': [season]}
+                )
+        record('match_facts', 'refresh', seconds, len(facts))
+        record('analysis', 'join', join_seconds, len(facts))
+        _, seconds = timed(pipeline.refresh_player_features, season=season)
+        record('player_features', 'refresh', seconds, 2 * len(facts))
+    return timings
+
+
+# run the benchmark at every scale, return the machine readable report
+def run(
+    scales: list[float],
+    season: int = 2023,
+    repeats: int = 3,
+    seed: int = 0,
+    database_url: str | None = None,
+    load_mode: str = 'replace',
+    use_warehouse: bool = False,
+    allow_truncate: bool = False,
+) -> dict:
+    pipeline.ETL.load_mode = load_mode
+    results = []
+    with tempfile.TemporaryDirectory(prefix='atp-benchmark-') as temp_dir:
+        directory = pathlib.Path(temp_dir)
+        pipeline.DATA_REPO = directory.as_uri() + '/'
+        if use_warehouse:
+            # duckdb is only imported by the warehouse target
+            import warehouse
+            pipeline.ETL.warehouse = warehouse.Warehouse(directory=directory / 'warehouse')
+        backend.configure(engine=create_engine(
+            database_url=database_url,
+            directory=directory,
+            allow_truncate=allow_truncate,
+        ))
+        for scale in scales:
+            _, seconds = timed(write_season, directory=directory, season=season, scale=scale, seed=seed)
+            logger.info("generated season %d at scale %g in %.3fs", season, scale, seconds)
+            timings = benchmark_season(directory=directory, season=season, repeats=repeats)
+            for (stage, step), timing in timings.items():
+                median_seconds = statistics.median(timing['seconds'])
+                results.append({
+                    'scale'         : scale,
+                    'stage'         : stage,
+                    'step'          : step,
+                    'rows'          : timing['rows'],
+                    'seconds'       : median_seconds,
+                    'min_seconds'   : min(timing['seconds']),
+                    'rows_per_second': timing['rows'] / median_seconds if median_seconds > 0 else None,
+                })
+        database = 'warehouse' if use_warehouse else backend.get_engine().dialect.name
+        # closes the pooled connections before the database file is removed
+        backend.configure()
+        pipeline.ETL.warehouse = None
+    return {
+        'created_at'    : datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'database'      : database,
+        'load_mode'     : load_mode,
+        'compact'       : pipeline.ATP.compact,
+        'season'        : season,
+        'seed'          : seed,
+        'repeats'       : repeats,
+        'python'        : platform.python_version(),
+        'pandas'        : pd.__version__,
+        'platform'      : platform.platform(),
+        'results'       : results,
+    }
+
+
+# steps whose throughput dropped by more than the tolerance against a baseline report
+def regressions(report: dict, baseline: dict, tolerance: float = 0.2) -> list[str]:
+    baseline_results = {
+        (result['scale'], result['stage'], result['step']): result
+        for result in baseline['results']
+    }
+    messages = []
+    for result in report['results']:
+        previous = baseline_results.get((result['scale'], result['stage'], result['step']))
+        if previous is None or not previous['rows_per_second'] or result['rows_per_second'] is None:
+            continue
+        ratio = result['rows_per_second'] / previous['rows_per_second']
+        if ratio < 1 - tolerance:
+            messages.append(
+                f"{result['stage']}.{result['step']} at scale {result['scale']:g}: "
+                f"{result['rows_per_second']:.0f} rows/s, {ratio:.0%} of the baseline"
+            )
+    return messages
+
+
+# command line entry point
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='ATP ETL benchmark on synthetic seasons')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100], help='multiples of a real season')
+    parser.add_argument('--season', type=int, default=2023)
+    parser.add_argument('--repeats', type=int, default=3, help='runs per scale, the median is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', default=None, help='postgresql database created from create.sql, sqlite by default')
+    parser.add_argument(
+        '--allow-truncate',
+        action='store_true',
+        help='empty the tables of the database given by --database-url before the benchmark',
+    )
+    parser.add_argument('--load-mode', choices=['replace', 'upsert', 'swap'], default='replace')
+    parser.add_argument('--warehouse', action='store_true', help='load into a parquet warehouse queried with duckdb')
+    parser.add_argument('--compact', action='store_true', help='parse seasons with the compact schema')
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('benchmark.json'))
+    parser.add_argument('--baseline', type=pathlib.Path, default=None, help='report to compare throughput against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput drop against the baseline')
+    args = parser.parse_args(argv)
+    if args.database_url is not None and not args.allow_truncate:
+        parser.error('--database-url empties the tables of that database, pass --allow-truncate to confirm')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    pipeline.ATP.compact = args.compact
+    report = run(
+        scales=args.scales,
+        season=args.season,
+        repeats=args.repeats,
+        seed=args.seed,
+        database_url=args.database_url,
+        load_mode=args.load_mode,
+        use_warehouse=args.warehouse,
+        allow_truncate=args.allow_truncate,
+    )
+    args.output.write_text(json.dumps(report, indent=1))
+    for result in report['results']:
+        logger.info(
+            "scale %g %s.%s: %d rows in %.3fs",
+            result['scale'], result['stage'], result['step'], result['rows'], result['seconds'],
+        )
+    if args.baseline is None:
+        return 0
+    messages = regressions(report, baseline=json.loads(args.baseline.read_text()), tolerance=args.tolerance)
+    for message in messages:
+        logger.warning("regression: %s", message)
+    return 1 if messages else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import pathlib
+import re
+import pandas as pd
+import pyarrow.feather
+import pyarrow.parquet
+import atomic
+
+
+# on-disk cache of parsed data frames with least-recently-used eviction
+class FrameCache:
+
+    # supported columnar file formats and their (reader, writer) pair
+    formats = {
+        'parquet'   : (pd.read_parquet, pd.DataFrame.to_parquet),
+        'feather'   : (pd.read_feather, pd.DataFrame.to_feather),
+    }
+
+    # concrete constructor
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        max_bytes: int,
+        file_format: str = 'parquet',
+    ) -> None:
+        if file_format not in type(self).formats:
+            raise ValueError(f"unsupported cache format: {file_format}")
+        # assign instance variables
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.file_format = file_format
+
+    # path of the cache file holding the given key
+    def path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{key}.{self.file_format}"
+
+    # return the cached frame or None, marking the entry as recently used
+    def get(self, key: str) -> pd.DataFrame | None:
+        path = self.path(key)
+        reader, _ = type(self).formats[self.file_format]
+        # another process may evict the entry at any time, which is a miss like a missing one
+        try:
+            table = reader(path)
+            # the modification time doubles as the last access time
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return table
+
+    # iterate over a cached frame in chunks of at most chunksize rows
+    def iter_chunks(self, key: str, chunksize: int):
+        path = self.path(key)
+        os.utime(path)
+        if self.file_format == 'parquet':
+            batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunksize)
+        else:
+            # memory mapped, so only the batches being converted are paged in
+            batches = pyarrow.feather.read_table(path, memory_map=True).to_batches(max_chunksize=chunksize)
+        for batch in batches:
+            yield batch.to_pandas()
+
+    # store a frame under the given key, then evict old entries
+    def put(self, key: str, table: pd.DataFrame) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _, writer = type(self).formats[self.file_format]
+        with atomic.replacing(self.path(key)) as temp_path:
+            writer(table.reset_index(drop=True), temp_path)
+        self.evict()
+
+    # most recently used key starting with the given prefix, or None
+    def latest(self, prefix: str) -> str | None:
+        entries = [
+            (path, stat) for path, stat in self.__entries()
+            if path.stem.startswith(prefix)
+        ]
+        if not entries:
+            return None
+        path, _ = max(entries, key=lambda entry: entry[1].st_mtime)
+        return path.stem
+
+    # total size of the cache in bytes
+    @property
+    def size(self) -> int:
+        return sum(stat.st_size for _, stat in self.__entries())
+
+    # remove least recently used entries until the cache fits its budget
+    def evict(self) -> None:
+        entries = sorted(self.__entries(), key=lambda entry: entry[1].st_mtime)
+        total_size = sum(stat.st_size for _, stat in entries)
+        # always keep the most recent entry, even if it alone exceeds the budget
+        for path, stat in entries[:-1]:
+            if total_size <= self.max_bytes:
+                break
+            total_size -= stat.st_size
+            path.unlink(missing_ok=True)
+
+    # private method listing the cache files with their stat, skipping files another
+    # process removed between listing and stat
+    def __entries(self) -> list[tuple[pathlib.Path, os.stat_result]]:
+        if not self.directory.exists():
+            return []
+        entries = []
+        for path in self.directory.glob(f"*.{self.file_format}"):
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+        return entries
+
+
+# cache of query results keyed by the normalized sql, its parameters and the data version
+class QueryCache:
+
+    # concrete constructor
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        max_bytes: int,
+        file_format: str = 'parquet',
+    ) -> None:
+        # assign instance variables
+        self.frames = FrameCache(directory=directory, max_bytes=max_bytes, file_format=file_format)
+        # lookups answered from and missed by the cache in this process
+        self.hits = 0
+        self.misses = 0
+
+    # cache key of a query result; the source names the backend and the database or warehouse
+    # it reads, so databases at the same data version never share entries
+    @staticmethod
+    def key(sql: str, parameters: dict | None, data_version, source: str) -> str:
+        # collapse whitespace outside of quoted literals, so reformatted queries share entries
+        parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""", sql.strip())
+        normalized = ''.join(
+            part if index % 2 else ' '.join(part.split())
+            for index, part in enumerate(parts)
+        )
+        payload = json.dumps([source, normalized, parameters, data_version], sort_keys=True, default=str)
+        return f"query-{hashlib.sha256(payload.encode()).hexdigest()}"
+
+    # return the cached result or None, counting hits and misses
+    def get(self, key: str) -> pd.DataFrame | None:
+        table = self.frames.get(key)
+        if table is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return table
+
+    # store a query result, then evict old entries
+    def put(self, key: str, table: pd.DataFrame) -> None:
+        self.frames.put(key, table)
+
+    # hit and miss counts of this process and the size of the cache
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'hit_rate'  : self.hits / lookups if lookups else None,
+            'bytes'     : self.frames.size,
+        }
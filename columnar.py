@@ -0,0 +1,137 @@
+import contextlib
+import os
+import threading
+import pandas as pd
+import pyarrow
+import pyarrow.csv
+import sqlalchemy
+
+# optional dependency: ADBC streams arrow record batches straight from PostgreSQL
+try:
+    import adbc_driver_postgresql.dbapi as adbc
+except ImportError:
+    adbc = None
+
+
+# arrow types of the PostgreSQL type oids in query results, others are read as strings
+POSTGRES_ARROW_TYPES = {
+    16      : pyarrow.bool_(),
+    20      : pyarrow.int64(),
+    21      : pyarrow.int16(),
+    23      : pyarrow.int32(),
+    700     : pyarrow.float32(),
+    701     : pyarrow.float64(),
+    1700    : pyarrow.float64(),
+    1082    : pyarrow.date32(),
+    1114    : pyarrow.timestamp('us'),
+    1184    : pyarrow.timestamp('us', tz='UTC'),
+}
+
+
+# open a query as a stream of arrow record batches
+# parameters use the pyformat style, e.g. %(season)s, and are quoted by the driver
+@contextlib.contextmanager
+def open_record_batches(
+    query: str,
+    engine: sqlalchemy.Engine,
+    parameters: dict | None = None,
+    block_size: int = 1 << 24,
+):
+    db_connection = engine.raw_connection()
+    try:
+        with db_connection.cursor() as cursor:
+            statement = cursor.mogrify(query, parameters).decode().strip().rstrip(';')
+        if adbc is not None:
+            yield from _adbc_record_batches(statement, engine, block_size)
+        else:
+            yield from _copy_record_batches(statement, db_connection, block_size)
+    finally:
+        db_connection.close()
+
+
+# read a query into a data frame without building python row tuples
+def read_arrow(
+    query: str,
+    engine: sqlalchemy.Engine,
+    parameters: dict | None = None,
+    arrow_dtypes: bool = True,
+) -> pd.DataFrame:
+    with open_record_batches(query, engine, parameters) as reader:
+        table = reader.read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype if arrow_dtypes else None)
+
+
+# iterate over a query batch by batch, without materializing every row first
+def iter_arrow(
+    query: str,
+    engine: sqlalchemy.Engine,
+    parameters: dict | None = None,
+    block_size: int = 1 << 24,
+    arrow_dtypes: bool = True,
+):
+    with open_record_batches(query, engine, parameters, block_size) as reader:
+        for batch in reader:
+            yield batch.to_pandas(types_mapper=pd.ArrowDtype if arrow_dtypes else None)
+
+
+# record batches fetched through ADBC
+def _adbc_record_batches(statement: str, engine: sqlalchemy.Engine, block_size: int):
+    uri = engine.url.set(drivername='postgresql', query={}).render_as_string(hide_password=False)
+    host = engine.url.query.get('host')
+    if host:
+        # unix socket directories are passed as a query parameter
+        uri = f"{uri}?host={host}"
+    with adbc.connect(uri) as adbc_connection:
+        with adbc_connection.cursor() as cursor:
+            cursor.adbc_statement.set_options(
+                **{'adbc.postgresql.batch_size_hint_bytes': str(block_size)}
+            )
+            cursor.execute(statement)
+            yield cursor.fetch_record_batch()
+
+
+# record batches parsed by arrow from the csv output of COPY TO STDOUT, which a thread writes
+# into a pipe while the batches are read, so only the blocks being parsed are held at once
+def _copy_record_batches(statement: str, db_connection, block_size: int):
+    with db_connection.cursor() as cursor:
+        # the result types come from the query itself, not from inference on the first block
+        cursor.execute(f"SELECT * FROM ({statement}) AS q LIMIT 0")
+        column_types = {
+            column.name: POSTGRES_ARROW_TYPES.get(column.type_code, pyarrow.string())
+            for column in cursor.description
+        }
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        # write the whole result, then close the pipe so the reader sees its end
+        def copy() -> None:
+            try:
+                with open(write_fd, 'wb', buffering=0) as output:
+                    cursor.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER)", output)
+            except Exception as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=copy, daemon=True)
+        with open(read_fd, 'rb', buffering=0) as source:
+            thread.start()
+            try:
+                yield pyarrow.csv.open_csv(
+                    source,
+                    read_options=pyarrow.csv.ReadOptions(block_size=block_size),
+                    convert_options=pyarrow.csv.ConvertOptions(
+                        column_types=column_types,
+                        # COPY writes NULL unquoted and empty strings quoted
+                        strings_can_be_null=True,
+                        quoted_strings_can_be_null=False,
+                    ),
+                )
+            finally:
+                # a reader stopping early breaks the pipe, which ends the copy
+                source.close()
+                thread.join()
+                if errors:
+                    # the connection is left in the middle of the copy
+                    db_connection.invalidate()
+        # a copy failing halfway ends the pipe like a complete one, so its error is raised here
+        if errors and not isinstance(errors[0], BrokenPipeError):
+            raise errors[0]
@@ -0,0 +1,233 @@
+-- sqlite stand-in of the "atp" database for local runs and benchmarks,
+-- the same tables as create.sql without the postgresql season partitions
+
+-- enforce the foreign keys and their cascading deletes (per connection)
+pragma foreign_keys = on;
+
+-- tournaments table
+create table if not exists "tournaments" (
+    "tourney_id"        varchar(255)    primary key
+    , "tourney_name"    varchar(255)    not null
+    , "tourney_level"   varchar(255)
+    , "tourney_date"    date
+    , "surface"         varchar(255)
+    , "draw_size"       integer
+);
+
+-- players table
+create table if not exists "players" (
+    "player_id"         varchar(15)     primary key
+    , "name"            varchar(255)    not null
+    , "hand"            varchar(5)      check ("hand" in ('R', 'L', 'A', 'U'))
+    , "height"          float
+    , "ioc"             varchar(5)      not null
+    , "birth_year"      integer
+    , "birth_year_appearances" integer
+);
+
+-- matches table with surrogate key
+create table if not exists "matches" (
+    "match_id"          integer         primary key
+    , "season"          integer         not null
+    , "tourney_id"      varchar(255)    not null references "tournaments" ("tourney_id") on delete cascade
+    , "match_num"       integer         not null
+    , "winner_id"       varchar(15)     not null references "players" ("player_id") on delete cascade
+    , "loser_id"        varchar(15)     not null references "players" ("player_id") on delete cascade
+    , "score"           varchar(255)
+    , "best_of"         integer
+    , "round"           varchar(50)
+    , "minutes"         integer
+    , "winner_aces"            integer
+    , "winner_double_faults"   integer
+    , "winner_serve_points"    integer
+    , "winner_first_serve_in"  integer
+    , "winner_first_serve_won" integer
+    , "winner_second_serve_won" integer
+    , "winner_service_games"   integer
+    , "winner_break_points_saved" integer
+    , "winner_break_points_faced" integer
+    , "loser_aces"            integer
+    , "loser_double_faults"   integer
+    , "loser_serve_points"    integer
+    , "loser_first_serve_in"  integer
+    , "loser_first_serve_won" integer
+    , "loser_second_serve_won" integer
+    , "loser_service_games"   integer
+    , "loser_break_points_saved" integer
+    , "loser_break_points_faced" integer
+    -- parsed from the score by scores.parse, from the point of view of the winner
+    , "set1_winner_games"       integer
+    , "set1_loser_games"        integer
+    , "set1_tiebreak"           integer
+    , "set2_winner_games"       integer
+    , "set2_loser_games"        integer
+    , "set2_tiebreak"           integer
+    , "set3_winner_games"       integer
+    , "set3_loser_games"        integer
+    , "set3_tiebreak"           integer
+    , "set4_winner_games"       integer
+    , "set4_loser_games"        integer
+    , "set4_tiebreak"           integer
+    , "set5_winner_games"       integer
+    , "set5_loser_games"        integer
+    , "set5_tiebreak"           integer
+    , "sets_played"             integer
+    , "winner_sets"             integer
+    , "loser_sets"              integer
+    , "winner_games"            integer
+    , "loser_games"             integer
+    , "total_games"             integer
+    , "match_tiebreak"          boolean         not null
+    , "retired"                 boolean         not null
+    , "walkover"                boolean         not null
+    , "defaulted"               boolean         not null
+    , "unfinished"              boolean         not null
+    , unique("season", "tourney_id", "match_num")   -- ensures combination is unique
+);
+
+-- join keys of the analysis query and of the cascading deletes
+create index if not exists "matches_tourney_id_idx" on "matches" ("tourney_id");
+create index if not exists "matches_winner_id_idx" on "matches" ("winner_id");
+create index if not exists "matches_loser_id_idx" on "matches" ("loser_id");
+
+-- rankings table
+create table if not exists "rankings" (
+    "ranking_id"        integer         primary key
+    , "season"          integer         not null
+    , "tourney_id"      varchar(255)    not null references "tournaments" ("tourney_id") on delete cascade
+    , "player_id"       varchar(15)     not null references "players" ("player_id") on delete cascade
+    , "rank"            float
+    , "points"          float
+    , unique("season", "tourney_id", "player_id")   -- ensures combination of season and player_id is unique
+);
+
+create index if not exists "rankings_tourney_id_idx" on "rankings" ("tourney_id");
+create index if not exists "rankings_player_id_idx" on "rankings" ("player_id", "tourney_id");
+
+-- load state of each season and ETL stage, used to skip unchanged seasons and resume crashed runs
+create table if not exists "load_state" (
+    "season"            integer         not null
+    , "stage"           varchar(50)     not null
+    , "source_hash"     varchar(64)     not null
+    , "row_count"       integer         not null
+    , "status"          varchar(20)     not null check ("status" in ('running', 'completed'))
+    , "updated_at"      timestamp       not null default current_timestamp
+    , primary key ("season", "stage")
+);
+
+-- version of the loaded data of each season, bumped by every load; cached analysis
+-- results are keyed by the versions of the seasons they read
+create table if not exists "data_version" (
+    "season"            integer         primary key
+    , "version"         bigint          not null
+    , "updated_at"      timestamp       not null default current_timestamp
+);
+
+-- denormalized match facts for analysis, refreshed by the pipeline for every loaded season;
+-- the primary key indexes the table by season
+create table if not exists "match_facts" (
+    "season"                    integer         not null
+    , "tourney_id"              varchar(255)    not null
+    , "match_num"               integer         not null
+    , "tourney_name"            varchar(255)
+    , "tourney_level"           varchar(255)
+    , "tourney_date"            date
+    , "surface"                 varchar(255)
+    , "draw_size"               integer
+    , "winner_name"             varchar(255)
+    , "winner_hand"             varchar(5)
+    , "winner_height"           float
+    , "winner_ioc"              varchar(5)
+    , "winner_birth_year"       integer
+    , "loser_name"              varchar(255)
+    , "loser_hand"              varchar(5)
+    , "loser_height"            float
+    , "loser_ioc"               varchar(5)
+    , "loser_birth_year"        integer
+    , "score"                   varchar(255)
+    , "best_of"                 integer
+    , "round"                   varchar(50)
+    , "minutes"                 integer
+    , "winner_aces"             integer
+    , "winner_double_faults"    integer
+    , "winner_serve_points"     integer
+    , "winner_first_serve_in"   integer
+    , "winner_first_serve_won"  integer
+    , "winner_second_serve_won" integer
+    , "winner_service_games"    integer
+    , "winner_break_points_saved" integer
+    , "winner_break_points_faced" integer
+    , "loser_aces"              integer
+    , "loser_double_faults"     integer
+    , "loser_serve_points"      integer
+    , "loser_first_serve_in"    integer
+    , "loser_first_serve_won"   integer
+    , "loser_second_serve_won"  integer
+    , "loser_service_games"     integer
+    , "loser_break_points_saved" integer
+    , "loser_break_points_faced" integer
+    , "winner_rank"             float
+    , "winner_points"           float
+    , "loser_rank"              float
+    , "loser_points"            float
+    , "set1_winner_games"       integer
+    , "set1_loser_games"        integer
+    , "set1_tiebreak"           integer
+    , "set2_winner_games"       integer
+    , "set2_loser_games"        integer
+    , "set2_tiebreak"           integer
+    , "set3_winner_games"       integer
+    , "set3_loser_games"        integer
+    , "set3_tiebreak"           integer
+    , "set4_winner_games"       integer
+    , "set4_loser_games"        integer
+    , "set4_tiebreak"           integer
+    , "set5_winner_games"       integer
+    , "set5_loser_games"        integer
+    , "set5_tiebreak"           integer
+    , "sets_played"             integer
+    , "winner_sets"             integer
+    , "loser_sets"              integer
+    , "winner_games"            integer
+    , "loser_games"             integer
+    , "total_games"             integer
+    , "match_tiebreak"          boolean         not null
+    , "retired"                 boolean         not null
+    , "walkover"                boolean         not null
+    , "defaulted"               boolean         not null
+    , "unfinished"              boolean         not null
+    , primary key ("season", "tourney_id", "match_num")
+);
+create index if not exists "match_facts_tourney_date_idx" on "match_facts" ("tourney_date", "match_num");
+
+-- elo rating and rolling serve and return stats of every player before and after each
+-- match, refreshed by the pipeline from the earliest loaded season on; the rows before a
+-- season are the state the refresh of that season resumes from
+create table if not exists "player_features" (
+    "season"                    integer         not null
+    , "tourney_id"              varchar(255)    not null
+    , "match_num"               integer         not null
+    , "player_id"               varchar(15)     not null
+    , "opponent_id"             varchar(15)     not null
+    , "tourney_date"            date
+    , "won"                     boolean         not null
+    , "matches_played"          integer         not null
+    , "elo_before"              float           not null
+    , "elo_after"               float           not null
+    , "opponent_elo_before"     float           not null
+    , "win_probability"         float           not null
+    , "aces"                    integer
+    , "service_games"           integer
+    , "serve_points"            integer
+    , "first_serve_in"          integer
+    , "break_points_saved"      integer
+    , "break_points_faced"      integer
+    , "return_points"           integer
+    , "return_points_won"       integer
+    , "rolling_aces_per_service_game"   float
+    , "rolling_first_serve_pct"         float
+    , "rolling_break_points_saved_pct"  float
+    , "rolling_return_points_won_pct"   float
+    , primary key ("season", "tourney_id", "match_num", "player_id")
+);
+create index if not exists "player_features_player_id_idx" on "player_features" ("player_id", "tourney_date", "tourney_id", "match_num");
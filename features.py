@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+
+# rating of a player before his first match
+INITIAL_RATING = 1500.0
+# k factor of a player's next match: K_SCALE / (matches played + K_OFFSET) ** K_SHAPE,
+# so ratings of newcomers move faster than those of established players
+K_SCALE = 250.0
+K_OFFSET = 5.0
+K_SHAPE = 0.4
+# number of previous matches the rolling stats are taken over
+WINDOW = 20
+
+# per match stats of a player, summed over the rolling window
+STAT_COLUMNS = (
+    'aces', 'service_games', 'serve_points', 'first_serve_in',
+    'break_points_saved', 'break_points_faced', 'return_points', 'return_points_won',
+)
+
+# rolling feature: (numerator stat, denominator stat)
+ROLLING_FEATURES = {
+    'rolling_aces_per_service_game' : ('aces', 'service_games'),
+    'rolling_first_serve_pct'       : ('first_serve_in', 'serve_points'),
+    'rolling_break_points_saved_pct': ('break_points_saved', 'break_points_faced'),
+    'rolling_return_points_won_pct' : ('return_points_won', 'return_points'),
+}
+
+# columns of the player_features table
+COLUMNS = [
+    'season', 'tourney_id', 'match_num', 'player_id', 'opponent_id', 'tourney_date', 'won',
+    'matches_played', 'elo_before', 'elo_after', 'opponent_elo_before', 'win_probability',
+    *STAT_COLUMNS, *ROLLING_FEATURES,
+]
+
+
+# one row per player and match, from the point of view of that player
+def player_rows(matches: pd.DataFrame) -> pd.DataFrame:
+    views = []
+    for side, other, won in (('winner', 'loser', True), ('loser', 'winner', False)):
+        opponent_serve_points = matches[f'{other}_serve_points']
+        views.append(pd.DataFrame({
+            'order'                 : np.arange(len(matches)),
+            'season'                : matches['season'],
+            'tourney_id'            : matches['tourney_id'],
+            'match_num'             : matches['match_num'],
+            'player_id'             : matches[f'{side}_id'],
+            'opponent_id'           : matches[f'{other}_id'],
+            'tourney_date'          : matches['tourney_date'],
+            'won'                   : won,
+            'aces'                  : matches[f'{side}_aces'],
+            'service_games'         : matches[f'{side}_service_games'],
+            'serve_points'          : matches[f'{side}_serve_points'],
+            'first_serve_in'        : matches[f'{side}_first_serve_in'],
+            'break_points_saved'    : matches[f'{side}_break_points_saved'],
+            'break_points_faced'    : matches[f'{side}_break_points_faced'],
+            'return_points'         : opponent_serve_points,
+            'return_points_won'     : opponent_serve_points
+                                      - matches[f'{other}_first_serve_won']
+                                      - matches[f'{other}_second_serve_won'],
+        }))
+    return pd.concat(views, ignore_index=True)
+
+
+# elo ratings before and after every match, in the order of the matches;
+# ratings and match counts of players seen before start from the given state
+def ratings(
+    winner_codes: np.ndarray,
+    loser_codes: np.ndarray,
+    initial_ratings: np.ndarray,
+    initial_counts: np.ndarray,
+) -> dict[str, np.ndarray]:
+    rating = initial_ratings.astype(float)
+    count = initial_counts.astype(float)
+    # a match goes into the wave after the last wave of either player, so no player
+    # occurs twice in a wave and every wave is one vectorized update
+    last_wave = [0] * len(rating)
+    waves = np.empty(len(winner_codes), dtype=np.int64)
+    for position, (winner, loser) in enumerate(zip(winner_codes.tolist(), loser_codes.tolist())):
+        wave = max(last_wave[winner], last_wave[loser]) + 1
+        last_wave[winner] = last_wave[loser] = wave
+        waves[position] = wave
+    order = np.argsort(waves, kind='stable')
+    starts = np.flatnonzero(np.diff(waves[order], prepend=0))
+    result = {
+        name: np.empty(len(winner_codes))
+        for name in ('winner_before', 'loser_before', 'winner_after', 'loser_after',
+                     'winner_count', 'loser_count', 'win_probability')
+    }
+    for positions in np.split(order, starts[1:]):
+        winners, losers = winner_codes[positions], loser_codes[positions]
+        winner_rating, loser_rating = rating[winners], rating[losers]
+        expected = 1.0 / (1.0 + 10.0 ** ((loser_rating - winner_rating) / 400.0))
+        winner_k = K_SCALE / (count[winners] + K_OFFSET) ** K_SHAPE
+        loser_k = K_SCALE / (count[losers] + K_OFFSET) ** K_SHAPE
+        rating[winners] = winner_rating + winner_k * (1.0 - expected)
+        rating[losers] = loser_rating - loser_k * (1.0 - expected)
+        result['winner_before'][positions] = winner_rating
+        result['loser_before'][positions] = loser_rating
+        result['winner_after'][positions] = rating[winners]
+        result['loser_after'][positions] = rating[losers]
+        result['winner_count'][positions] = count[winners]
+        result['loser_count'][positions] = count[losers]
+        result['win_probability'][positions] = expected
+        count[winners] += 1
+        count[losers] += 1
+    return result
+
+
+# sums of the stats over the previous WINDOW matches of every player, excluding the row itself;
+# rows have to be sorted by player and time
+def window_sums(rows: pd.DataFrame) -> pd.DataFrame:
+    # through the nullable float type, so missing values of nullable integer columns become nan
+    stats = rows[list(STAT_COLUMNS)].astype('Float64').astype(float)
+    # a ratio only counts matches where both of its stats were recorded
+    for numerator, denominator in ROLLING_FEATURES.values():
+        recorded = stats[numerator].notna() & stats[denominator].notna()
+        stats[numerator] = stats[numerator].where(recorded, 0.0)
+        stats[denominator] = stats[denominator].where(recorded, 0.0)
+    groups = stats.groupby(rows['player_id'].to_numpy(), sort=False)
+    before = groups.cumsum() - stats
+    return before - before.groupby(rows['player_id'].to_numpy(), sort=False).shift(WINDOW).fillna(0.0)
+
+
+# features of the given matches, sorted by tourney date and match number;
+# history holds the rows of the previous matches of the players, at least the last
+# WINDOW of each player, in the shape of the player_features table
+def compute(matches: pd.DataFrame, history: pd.DataFrame) -> pd.DataFrame:
+    rows = player_rows(matches)
+    # the latest state of every player seen before
+    latest = history.drop_duplicates(subset='player_id', keep='last')
+    players, codes = np.unique(
+        np.concatenate([latest['player_id'].to_numpy(object), rows['player_id'].to_numpy(object)]).astype(str),
+        return_inverse=True,
+    )
+    initial_ratings = np.full(len(players), INITIAL_RATING)
+    initial_counts = np.zeros(len(players))
+    initial_ratings[codes[:len(latest)]] = latest['elo_after'].to_numpy(float)
+    initial_counts[codes[:len(latest)]] = latest['matches_played'].to_numpy(float) + 1
+    match_codes = codes[len(latest):]
+    elo = ratings(
+        winner_codes=match_codes[:len(matches)],
+        loser_codes=match_codes[len(matches):],
+        initial_ratings=initial_ratings,
+        initial_counts=initial_counts,
+    )
+    rows['elo_before'] = np.concatenate([elo['winner_before'], elo['loser_before']])
+    rows['elo_after'] = np.concatenate([elo['winner_after'], elo['loser_after']])
+    rows['opponent_elo_before'] = np.concatenate([elo['loser_before'], elo['winner_before']])
+    rows['matches_played'] = np.concatenate([elo['winner_count'], elo['loser_count']]).astype(np.int64)
+    rows['win_probability'] = np.concatenate([elo['win_probability'], 1.0 - elo['win_probability']])
+    # previous rows of the players go first, so their windows carry over the boundary
+    previous = history[['player_id', *STAT_COLUMNS]].assign(
+        order=np.arange(-len(history), 0), new=False,
+    )
+    combined = pd.concat([previous, rows.assign(new=True)], ignore_index=True)
+    combined = combined.sort_values(['player_id', 'order'], kind='stable', ignore_index=True)
+    sums = window_sums(combined)
+    for feature, (numerator, denominator) in ROLLING_FEATURES.items():
+        combined[feature] = (sums[numerator] / sums[denominator].where(sums[denominator] > 0)).to_numpy()
+    features = rows.merge(
+        combined.loc[combined['new'], ['player_id', 'order', *ROLLING_FEATURES]],
+        on=['player_id', 'order'],
+    )
+    return features.sort_values(['order', 'won'], ascending=[True, False], ignore_index=True)[COLUMNS]
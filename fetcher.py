@@ -0,0 +1,263 @@
+import concurrent.futures
+import contextlib
+import dataclasses
+import email.utils
+import hashlib
+import http.client
+import io
+import json
+import os
+import pathlib
+import threading
+import time
+import urllib.error
+import urllib.request
+import atomic
+import instrumentation
+
+
+# status codes worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# errors of a connection lost while reading a response body, worth retrying
+TRANSIENT_READ_ERRORS = (TimeoutError, ConnectionError, http.client.IncompleteRead)
+
+
+# response of a (conditional) download
+@dataclasses.dataclass
+class FetchResult:
+    url: str
+    # None when the server answered 304 Not Modified
+    raw: bytes | None
+    etag: str | None = None
+    last_modified: str | None = None
+    # content hash remembered for an unmodified file
+    content_hash: str | None = None
+
+
+# binary stream computing the sha256 of everything read through it; when the connection is
+# lost, resume(offset) returns a stream of the rest, tried retries times per read
+class HashingReader(io.RawIOBase):
+
+    # concrete constructor
+    def __init__(self, raw, resume=None, retries: int = 0) -> None:
+        super().__init__()
+        # assign instance variables
+        self.raw = raw
+        self.resume = resume
+        self.retries = retries
+        self.hash = hashlib.sha256()
+        # headers of the first response, the validators of the whole file
+        self.headers = raw.headers
+        self.offset = 0
+
+    # implement
+    def readable(self) -> bool:
+        return True
+
+    # implement
+    def readinto(self, buffer) -> int:
+        for attempt in range(self.retries + 1):
+            try:
+                if self.raw is None:
+                    self.raw = self.resume(self.offset)
+                size = self.raw.readinto(buffer)
+                # http responses end quietly when the connection closes before their length
+                if not size and len(buffer) and getattr(self.raw, 'length', None):
+                    raise http.client.IncompleteRead(b'', self.raw.length)
+                break
+            except TRANSIENT_READ_ERRORS:
+                if self.resume is None or attempt == self.retries:
+                    raise
+                # the lost stream is replaced on the next attempt
+                if self.raw is not None:
+                    self.raw.close()
+                self.raw = None
+        self.offset += size
+        self.hash.update(memoryview(buffer)[:size])
+        instrumentation.add('fetched_bytes', size)
+        return size
+
+    # hex digest of the bytes read so far
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+# http downloader with conditional requests, retries and bounded concurrency
+class Fetcher:
+
+    # concrete constructor
+    def __init__(
+        self,
+        state_path: str | os.PathLike,
+        max_workers: int = 8,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30,
+    ) -> None:
+        # assign instance variables
+        self.state_path = pathlib.Path(state_path)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # validators per url, persisted between runs
+        self._validators = None
+        self._lock = threading.Lock()
+
+    # download a url, answering from the remembered validators when unchanged
+    def fetch(self, url: str, conditional: bool = True) -> FetchResult:
+        validators = self.validators.get(url, {}) if conditional else {}
+        request = self.__request(url, validators)
+
+        # a connection lost while reading the body is retried like one lost while opening
+        def download() -> FetchResult:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return FetchResult(
+                    url=url,
+                    raw=response.read(),
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                )
+
+        try:
+            result = self.__retrying(download)
+        except urllib.error.HTTPError as error:
+            if error.code != 304:
+                raise
+            return FetchResult(
+                url=url,
+                raw=None,
+                etag=validators.get('etag'),
+                last_modified=validators.get('last_modified'),
+                content_hash=validators.get('content_hash'),
+            )
+        instrumentation.add('fetched_bytes', len(result.raw))
+        return result
+
+    # content hash remembered for a url the server reports unchanged, without downloading
+    # the file; None when it changed or nothing is remembered of it
+    def unchanged(self, url: str) -> str | None:
+        validators = self.validators.get(url)
+        if not validators or not validators.get('content_hash'):
+            return None
+        request = self.__request(url, validators)
+        try:
+            # the body of a changed file is left unread
+            with self.__open(request):
+                return None
+        except urllib.error.HTTPError as error:
+            if error.code != 304:
+                raise
+            return validators['content_hash']
+
+    # open a url as a binary stream that hashes the bytes read through it, resuming
+    # where it stopped when the connection is lost
+    @contextlib.contextmanager
+    def stream(self, url: str):
+        response = self.__open(urllib.request.Request(url))
+        reader = HashingReader(
+            response,
+            resume=lambda offset: self.__resume(url, response.headers, offset),
+            retries=self.retries,
+        )
+        try:
+            yield reader
+        finally:
+            if reader.raw is not None:
+                reader.raw.close()
+
+    # apply a function to many items on a bounded thread pool, results in input order
+    def map(self, function, items) -> list:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+    # remember the validators and content hash of a downloaded file
+    def remember(self, result: FetchResult, content_hash: str) -> None:
+        if result.etag is None and result.last_modified is None:
+            return
+        with self._lock:
+            self.validators[result.url] = {
+                'etag'          : result.etag,
+                'last_modified' : result.last_modified,
+                'content_hash'  : content_hash,
+            }
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            atomic.write_text(self.state_path, json.dumps(self.validators, indent=1))
+
+    # validators loaded lazily from the state file
+    @property
+    def validators(self) -> dict[str, dict]:
+        if self._validators is None:
+            try:
+                self._validators = json.loads(self.state_path.read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._validators = {}
+        return self._validators
+
+    # private static method building a request, conditional on the given validators
+    @staticmethod
+    def __request(url: str, validators: dict) -> urllib.request.Request:
+        request = urllib.request.Request(url)
+        if validators.get('etag'):
+            request.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            request.add_header('If-Modified-Since', validators['last_modified'])
+        return request
+
+    # private method reopening a url at the given offset of the file whose first response
+    # had the given headers; servers ignoring the range send the file whole, read up to the offset
+    def __resume(self, url: str, headers, offset: int):
+        request = urllib.request.Request(url)
+        request.add_header('Range', f'bytes={offset}-')
+        validator = headers.get('ETag') or headers.get('Last-Modified')
+        if validator:
+            # the rest of the same version of the file, or all of a changed one
+            request.add_header('If-Range', validator)
+        response = self.__open(request)
+        if response.status == 206:
+            return response
+        if (response.headers.get('ETag'), response.headers.get('Last-Modified')) != (
+            headers.get('ETag'), headers.get('Last-Modified')
+        ):
+            response.close()
+            raise OSError(f"{url} changed while it was read")
+        skipped = 0
+        while skipped < offset:
+            size = len(response.read(min(offset - skipped, 2 ** 20)))
+            if size == 0:
+                response.close()
+                raise http.client.IncompleteRead(b'', offset - skipped)
+            instrumentation.add('fetched_bytes', size)
+            skipped += size
+        return response
+
+    # private method opening a request, retrying transient failures with backoff
+    def __open(self, request: urllib.request.Request):
+        return self.__retrying(lambda: urllib.request.urlopen(request, timeout=self.timeout))
+
+    # private method calling an attempt until it succeeds, retrying transient failures with backoff
+    def __retrying(self, attempt_function):
+        for attempt in range(self.retries + 1):
+            try:
+                return attempt_function()
+            except urllib.error.HTTPError as error:
+                if error.code not in TRANSIENT_STATUS_CODES or attempt == self.retries:
+                    raise
+                delay = self.__retry_after(error) or self.backoff * 2 ** attempt
+            except (urllib.error.URLError, *TRANSIENT_READ_ERRORS):
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            time.sleep(delay)
+
+    # private static method reading the delay of a Retry-After header
+    @staticmethod
+    def __retry_after(error: urllib.error.HTTPError) -> float | None:
+        value = error.headers.get('Retry-After') if error.headers else None
+        if value is None:
+            return None
+        if value.isdigit():
+            return float(value)
+        retry_time = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_time.timestamp() - time.time())
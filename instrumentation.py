@@ -0,0 +1,314 @@
+import contextlib
+import dataclasses
+import functools
+import json
+import logging
+import os
+import pathlib
+import sys
+import threading
+import time
+import tracemalloc
+import pandas as pd
+import sqlalchemy
+import atomic
+
+# optional dependency: resource is only available on unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# instrumented ETL steps; downloads of the data sources are measured as 'fetch' steps
+STEPS = ('extract', 'transform', 'load')
+
+logger = logging.getLogger(__name__)
+
+
+# measurements of one ETL step
+@dataclasses.dataclass
+class StepMetrics:
+    stage: str
+    step: str
+    season: int | None
+    started_at: float
+    wall_seconds: float
+    rows_in: int | None
+    rows_out: int | None
+    # growth of the peak memory during the step: exact under tracemalloc (python -X tracemalloc),
+    # otherwise the growth of the process peak resident set size
+    memory_delta_bytes: int | None
+    fetched_bytes: int
+    db_seconds: float
+    pid: int
+
+
+# base class of the metric sinks, every hook is optional
+class Sink:
+
+    # called when a step starts, the return value is handed back to finish
+    def start(self, stage: str, step: str, season: int | None):
+        return None
+
+    # called with the measurements of a finished step; the token is None for
+    # steps measured in another process
+    def finish(self, metrics: StepMetrics, token) -> None:
+        pass
+
+    # called once at the end of a run
+    def close(self) -> None:
+        pass
+
+
+# structured log line per step
+class JSONLogSink(Sink):
+
+    # concrete constructor
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.INFO) -> None:
+        # assign instance variables
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    # implement
+    def finish(self, metrics: StepMetrics, token) -> None:
+        self.logger.log(self.level, json.dumps(dataclasses.asdict(metrics)))
+
+
+# prometheus text exposition file, e.g. for the node exporter textfile collector
+class PrometheusSink(Sink):
+
+    # concrete constructor
+    def __init__(self, path: str | os.PathLike, prefix: str = 'atp_etl') -> None:
+        # assign instance variables
+        self.path = pathlib.Path(path)
+        self.prefix = prefix
+        self.records = []
+
+    # implement
+    def finish(self, metrics: StepMetrics, token) -> None:
+        self.records.append(metrics)
+
+    # implement: write the totals of the run
+    def close(self) -> None:
+        if not self.records:
+            return
+        totals = summarize(self.records)
+        families = [
+            ('steps_total', 'counter', 'calls', 'ETL step calls'),
+            ('step_seconds_total', 'counter', 'wall_seconds', 'wall time of ETL steps'),
+            ('step_rows_out_total', 'counter', 'rows_out', 'rows produced by ETL steps'),
+            ('step_fetched_bytes_total', 'counter', 'fetched_bytes', 'bytes downloaded during ETL steps'),
+            ('step_db_seconds_total', 'counter', 'db_seconds', 'database statement time of ETL steps'),
+            ('step_memory_delta_bytes', 'gauge', 'memory_delta_bytes', 'largest peak memory growth of an ETL step'),
+        ]
+        lines = []
+        for name, kind, column, description in families:
+            lines.append(f"# HELP {self.prefix}_{name} {description}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+            for row in totals.itertuples(index=False):
+                value = getattr(row, column)
+                if pd.isna(value):
+                    continue
+                lines.append(f'{self.prefix}_{name}{{stage="{row.stage}",step="{row.step}"}} {value}')
+        # the collector never reads a partial file
+        atomic.write_text(self.path, '\n'.join(lines) + '\n')
+        self.records = []
+
+
+# span-style callbacks, e.g. to open and close tracing spans around every step
+class CallbackSink(Sink):
+
+    # concrete constructor
+    def __init__(self, on_start=None, on_end=None) -> None:
+        # assign instance variables
+        self.on_start = on_start
+        self.on_end = on_end
+
+    # implement
+    def start(self, stage: str, step: str, season: int | None):
+        if self.on_start is None:
+            return None
+        return self.on_start(stage, step, season)
+
+    # implement
+    def finish(self, metrics: StepMetrics, token) -> None:
+        if self.on_end is not None:
+            self.on_end(token, metrics)
+
+
+# measurements of a run, forwarded to the configured sinks
+class Collector:
+
+    # concrete constructor
+    def __init__(self, sinks: list[Sink] | None = None) -> None:
+        # assign instance variables
+        self.sinks = list(sinks or [])
+        self.records = []
+
+    # notify the sinks that a step starts, return their tokens
+    def start(self, stage: str, step: str, season: int | None) -> list:
+        return [sink.start(stage, step, season) for sink in self.sinks]
+
+    # keep the measurements of a finished step and hand them to the sinks
+    def finish(self, metrics: StepMetrics, tokens: list | None = None) -> None:
+        self.records.append(metrics)
+        tokens = tokens or [None] * len(self.sinks)
+        for sink, token in zip(self.sinks, tokens):
+            sink.finish(metrics, token)
+
+    # take over measurements of steps run in other processes, e.g. pool workers
+    def absorb(self, records) -> None:
+        for metrics in records:
+            if metrics.pid != os.getpid():
+                self.finish(metrics)
+
+    # per stage and step totals of the measured steps
+    def summary(self) -> pd.DataFrame:
+        return summarize(self.records)
+
+    # forget the measurements of the previous run
+    def reset(self) -> None:
+        self.records = []
+
+    # close the sinks at the end of a run
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+# per stage and step totals of a list of measurements
+def summarize(records: list[StepMetrics]) -> pd.DataFrame:
+    columns = ['stage', 'step', 'calls', 'wall_seconds', 'rows_in', 'rows_out',
+               'fetched_bytes', 'db_seconds', 'memory_delta_bytes']
+    if not records:
+        return pd.DataFrame(columns=columns)
+    table = pd.DataFrame([dataclasses.asdict(metrics) for metrics in records])
+    return table.groupby(['stage', 'step'], sort=False).agg(
+        calls=('wall_seconds', 'size'),
+        wall_seconds=('wall_seconds', 'sum'),
+        rows_in=('rows_in', 'sum'),
+        rows_out=('rows_out', 'sum'),
+        fetched_bytes=('fetched_bytes', 'sum'),
+        db_seconds=('db_seconds', 'sum'),
+        memory_delta_bytes=('memory_delta_bytes', 'max'),
+    ).reset_index()[columns]
+
+
+# process-wide collector used by the instrumented ETL steps
+collector = Collector()
+
+
+# running totals of the current thread, read before and after every step
+_counters = threading.local()
+
+
+# add to a running total of the current thread, e.g. 'fetched_bytes' or 'db_seconds'
+def add(counter: str, amount: float) -> None:
+    setattr(_counters, counter, getattr(_counters, counter, 0) + amount)
+
+
+# running total of the current thread
+def total(counter: str) -> float:
+    return getattr(_counters, counter, 0)
+
+
+# add the elapsed time of the block to a running total
+@contextlib.contextmanager
+def measure(counter: str):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(counter, time.perf_counter() - start_time)
+
+
+# statement time of every sqlalchemy engine
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('statement_start_times', []).append(time.perf_counter())
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    add('db_seconds', time.perf_counter() - connection.info['statement_start_times'].pop())
+
+
+# a failed statement never reaches after_cursor_execute, so its start time is taken here
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'handle_error')
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is None or exception_context.statement is None:
+        return
+    start_times = connection.info.get('statement_start_times')
+    if start_times:
+        add('db_seconds', time.perf_counter() - start_times.pop())
+
+
+# peak memory so far, in bytes
+def _peak_memory() -> int | None:
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    if resource is None:
+        return None
+    # kilobytes on linux, bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# number of rows of a table, None when there is none
+def _rows(table) -> int | None:
+    return None if table is None else len(table)
+
+
+# decorator measuring a step method of an ETL or a data source and reporting it to the collector
+def instrumented(step: str):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # an override calling the instrumented method of its base class is measured once
+            if getattr(self, '_active_step', None) == step:
+                return method(self, *args, **kwargs)
+            stage = type(self).__name__
+            # an ETL has a source, a data source is its own
+            season = getattr(getattr(self, 'source', self), 'season', None)
+            tokens = collector.start(stage, step, season)
+            rows_in = _rows(self._table)
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            start_memory = (
+                tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else _peak_memory()
+            )
+            start_fetched_bytes = total('fetched_bytes')
+            start_db_seconds = total('db_seconds')
+            started_at = time.time()
+            start_time = time.perf_counter()
+            self._active_step = step
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                self._active_step = None
+            wall_seconds = time.perf_counter() - start_time
+            if step == 'extract':
+                # the rows read from the source
+                rows_in = _rows(getattr(self.source, '_table', None))
+            end_memory = _peak_memory()
+            metrics = StepMetrics(
+                stage=stage,
+                step=step,
+                season=season,
+                started_at=started_at,
+                wall_seconds=wall_seconds,
+                rows_in=rows_in,
+                rows_out=_rows(self._table),
+                memory_delta_bytes=None if end_memory is None else max(0, end_memory - start_memory),
+                fetched_bytes=int(total('fetched_bytes') - start_fetched_bytes),
+                db_seconds=total('db_seconds') - start_db_seconds,
+                pid=os.getpid(),
+            )
+            # measurements travel with the instance, e.g. back from pool workers
+            self.metrics.append(metrics)
+            collector.finish(metrics, tokens)
+            return result
+        return wrapper
+    return decorator
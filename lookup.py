@@ -0,0 +1,291 @@
+import argparse
+import json
+import logging
+import os
+import pathlib
+import numpy as np
+import pandas as pd
+import sqlalchemy
+import atomic
+
+
+# default snapshot file, rebuilt with "python lookup.py build" after loading seasons
+SNAPSHOT_PATH = pathlib.Path(__file__).parent / '.cache' / 'lookup.idx'
+# snapshot layout: magic, header length, json header, arrays aligned to ALIGNMENT bytes
+SNAPSHOT_MAGIC = b'ATPIDX1\n'
+ALIGNMENT = 64
+
+# every match with the date of its tournament, in the order of the match lists
+MATCHES_QUERY = """
+    SELECT
+        m."season",
+        m."tourney_id",
+        m."match_num",
+        t."tourney_date",
+        m."winner_id",
+        m."loser_id"
+    FROM "matches" m
+    JOIN "tournaments" t ON t."tourney_id" = m."tourney_id"
+    ORDER BY t."tourney_date", m."tourney_id", m."match_num"
+"""
+
+# every ranking with the date of the tournament it was taken at
+RANKINGS_QUERY = """
+    SELECT
+        r."player_id",
+        t."tourney_date",
+        r."rank",
+        r."points"
+    FROM "rankings" r
+    JOIN "tournaments" t ON t."tourney_id" = r."tourney_id"
+    WHERE t."tourney_date" IS NOT NULL
+"""
+
+logger = logging.getLogger(__name__)
+
+
+# array-backed index of matches and rankings by player, answering lookups without the database;
+# player ids are encoded as positions in the sorted player_ids array
+class MatchIndex:
+
+    # arrays of an index, as stored in a snapshot
+    array_names = (
+        # sorted ids of the encoded players and tournaments
+        'player_ids', 'tourney_ids',
+        # one entry per match, ordered by tourney date, tourney id and match number
+        'match_seasons', 'match_tourneys', 'match_nums', 'match_dates', 'match_winners', 'match_losers',
+        # csr lists: the matches of player code c are player_matches[player_offsets[c]:player_offsets[c + 1]]
+        'player_offsets', 'player_matches',
+        # csr lists of the matches between two players, by sorted pair key
+        'pair_keys', 'pair_offsets', 'pair_matches',
+        # rankings sorted by player code and date, see _rank_key
+        'rank_keys', 'rank_values', 'rank_points',
+    )
+
+    # concrete constructor
+    def __init__(self, arrays: dict[str, np.ndarray], data_version: list | None = None) -> None:
+        # assign instance variables
+        for name in type(self).array_names:
+            setattr(self, name, arrays[name])
+        # data versions of the seasons at build time, as [[season, version], ...]
+        self.data_version = data_version or []
+
+    # build an index from match rows (season, tourney_id, match_num, tourney_date, winner_id,
+    # loser_id) sorted by tourney date and ranking rows (player_id, tourney_date, rank, points)
+    @classmethod
+    def build(
+        cls,
+        matches: pd.DataFrame,
+        rankings: pd.DataFrame,
+        data_version: list | None = None,
+    ) -> 'MatchIndex':
+        player_ids = np.unique(np.concatenate([
+            matches['winner_id'].to_numpy(str),
+            matches['loser_id'].to_numpy(str),
+            rankings['player_id'].to_numpy(str),
+        ]))
+        tourney_ids = np.unique(matches['tourney_id'].to_numpy(str))
+        winners = np.searchsorted(player_ids, matches['winner_id'].to_numpy(str)).astype(np.int32)
+        losers = np.searchsorted(player_ids, matches['loser_id'].to_numpy(str)).astype(np.int32)
+        positions = np.arange(len(matches), dtype=np.int32)
+
+        # both players of a match list it, in match order
+        codes = np.concatenate([winners, losers])
+        both = np.concatenate([positions, positions])
+        order = np.lexsort((both, codes))
+        player_offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(player_ids)))])
+
+        pair_keys = cls._pair_key(winners, losers, len(player_ids))
+        order_by_pair = np.lexsort((positions, pair_keys))
+        unique_pairs, pair_starts = np.unique(pair_keys[order_by_pair], return_index=True)
+
+        rank_codes = np.searchsorted(player_ids, rankings['player_id'].to_numpy(str))
+        rank_dates = pd.to_datetime(rankings['tourney_date']).to_numpy('datetime64[D]')
+        rank_keys = cls._rank_key(rank_codes, rank_dates)
+        order_by_rank = np.argsort(rank_keys, kind='stable')
+
+        arrays = {
+            'player_ids'    : player_ids,
+            'tourney_ids'   : tourney_ids,
+            'match_seasons' : matches['season'].to_numpy(np.int32),
+            'match_tourneys': np.searchsorted(tourney_ids, matches['tourney_id'].to_numpy(str)).astype(np.int32),
+            'match_nums'    : matches['match_num'].to_numpy(np.int32),
+            'match_dates'   : pd.to_datetime(matches['tourney_date']).to_numpy('datetime64[D]'),
+            'match_winners' : winners,
+            'match_losers'  : losers,
+            'player_offsets': player_offsets.astype(np.int64),
+            'player_matches': both[order],
+            'pair_keys'     : unique_pairs,
+            'pair_offsets'  : np.append(pair_starts, len(pair_keys)).astype(np.int64),
+            'pair_matches'  : positions[order_by_pair],
+            'rank_keys'     : rank_keys[order_by_rank],
+            'rank_values'   : rankings['rank'].to_numpy(float)[order_by_rank],
+            'rank_points'   : rankings['points'].to_numpy(float)[order_by_rank],
+        }
+        return cls(arrays=arrays, data_version=data_version)
+
+    # build an index from the loaded tables
+    @classmethod
+    def from_db(cls, connection: sqlalchemy.Connection) -> 'MatchIndex':
+        matches = pd.read_sql(sql=sqlalchemy.sql.text(MATCHES_QUERY), con=connection)
+        rankings = pd.read_sql(sql=sqlalchemy.sql.text(RANKINGS_QUERY), con=connection)
+        data_version = connection.execute(
+            sqlalchemy.sql.text('SELECT "season", "version" FROM "data_version" ORDER BY "season"')
+        ).all()
+        return cls.build(matches=matches, rankings=rankings, data_version=[list(row) for row in data_version])
+
+    # write the index to a snapshot file that load maps into memory
+    def save(self, path: str | os.PathLike) -> None:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in type(self).array_names}
+        entries = {}
+        offset = 0
+        for name, array in arrays.items():
+            entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset = _aligned(offset + array.nbytes)
+        header = json.dumps({'arrays': entries, 'data_version': self.data_version}).encode()
+        data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header))
+        # readers never map a partial file
+        with atomic.replacing(path) as temp_path, open(temp_path, 'wb') as file:
+            file.write(SNAPSHOT_MAGIC)
+            file.write(len(header).to_bytes(8, 'little'))
+            file.write(header)
+            for name, array in arrays.items():
+                file.seek(data_start + entries[name]['offset'])
+                file.write(array.tobytes())
+
+    # open a snapshot file; memory mapped, processes mapping the same file share its pages
+    @classmethod
+    def load(cls, path: str | os.PathLike = SNAPSHOT_PATH, mmap: bool = True) -> 'MatchIndex':
+        if mmap:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(path, dtype=np.uint8)
+        if bytes(buffer[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError(f"not a match index snapshot: {path}")
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        header_length = int.from_bytes(bytes(buffer[len(SNAPSHOT_MAGIC):header_start]), 'little')
+        header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+        data_start = _aligned(header_start + header_length)
+        arrays = {}
+        for name, entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            start = data_start + entry['offset']
+            count = int(np.prod(entry['shape']))
+            arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+        return cls(arrays=arrays, data_version=header['data_version'])
+
+    # code of a player id, KeyError for unknown players
+    def code(self, player_id: str) -> int:
+        position = int(np.searchsorted(self.player_ids, player_id))
+        if position == len(self.player_ids) or self.player_ids[position] != player_id:
+            raise KeyError(player_id)
+        return position
+
+    # positions of the matches of a player, in match order
+    def player_matches_of(self, player_id: str) -> np.ndarray:
+        code = self.code(player_id)
+        return self.player_matches[self.player_offsets[code]:self.player_offsets[code + 1]]
+
+    # positions of the matches between two players, in match order
+    def head_to_head(self, player_id: str, opponent_id: str) -> np.ndarray:
+        key = type(self)._pair_key(self.code(player_id), self.code(opponent_id), len(self.player_ids))
+        position = int(np.searchsorted(self.pair_keys, key))
+        if position == len(self.pair_keys) or self.pair_keys[position] != key:
+            return self.pair_matches[:0]
+        return self.pair_matches[self.pair_offsets[position]:self.pair_offsets[position + 1]]
+
+    # (rank, points) of a player at the latest ranking on or before the date, None without one
+    def rank_as_of(self, player_id: str, date) -> tuple[float, float] | None:
+        code = self.code(player_id)
+        key = type(self)._rank_key(code, np.datetime64(pd.Timestamp(date).date(), 'D'))
+        position = int(np.searchsorted(self.rank_keys, key, side='right')) - 1
+        if position < 0 or self.rank_keys[position] >> 32 != code:
+            return None
+        return float(self.rank_values[position]), float(self.rank_points[position])
+
+    # ranks and points of many players at many dates in one vectorized search, nan without a ranking
+    def ranks_as_of(self, player_ids, dates) -> tuple[np.ndarray, np.ndarray]:
+        player_ids = np.asarray(player_ids, dtype=str)
+        codes = np.searchsorted(self.player_ids, player_ids)
+        known = codes < len(self.player_ids)
+        known[known] = self.player_ids[codes[known]] == player_ids[known]
+        keys = type(self)._rank_key(codes, pd.to_datetime(np.asarray(dates)).to_numpy('datetime64[D]'))
+        positions = np.searchsorted(self.rank_keys, keys, side='right') - 1
+        # the preceding ranking has to belong to the same player
+        found = known & (positions >= 0)
+        found[found] = (self.rank_keys[positions[found]] >> 32) == codes[found]
+        ranks = np.full(len(codes), np.nan)
+        points = np.full(len(codes), np.nan)
+        ranks[found] = self.rank_values[positions[found]]
+        points[found] = self.rank_points[positions[found]]
+        return ranks, points
+
+    # match rows at the given positions
+    def frame(self, positions: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({
+            'season'        : self.match_seasons[positions],
+            'tourney_id'    : self.tourney_ids[self.match_tourneys[positions]],
+            'match_num'     : self.match_nums[positions],
+            'tourney_date'  : self.match_dates[positions],
+            'winner_id'     : self.player_ids[self.match_winners[positions]],
+            'loser_id'      : self.player_ids[self.match_losers[positions]],
+        })
+
+    # key of an unordered pair of player codes
+    @staticmethod
+    def _pair_key(code, other_code, player_count: int):
+        return np.minimum(code, other_code).astype(np.int64) * player_count + np.maximum(code, other_code)
+
+    # key ordering rankings by player code, then date: the code in the high 32 bits,
+    # the days since 1970 shifted to be non-negative in the low 32 bits
+    @staticmethod
+    def _rank_key(codes, dates: np.ndarray) -> np.ndarray:
+        days = dates.astype('datetime64[D]').astype(np.int64)
+        return (np.asarray(codes, dtype=np.int64) << 32) + (days + (1 << 31))
+
+
+# offset rounded up to the array alignment of snapshots
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# command line entry point
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='ATP match and ranking lookups')
+    parser.add_argument('--snapshot', type=pathlib.Path, default=SNAPSHOT_PATH, help='index snapshot file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='build the snapshot from the loaded tables')
+    matches_parser = subparsers.add_parser('matches', help='matches of a player')
+    matches_parser.add_argument('player_id')
+    head_to_head_parser = subparsers.add_parser('head-to-head', help='matches between two players')
+    head_to_head_parser.add_argument('player_id')
+    head_to_head_parser.add_argument('opponent_id')
+    rank_parser = subparsers.add_parser('rank', help='rank of a player as of a date')
+    rank_parser.add_argument('player_id')
+    rank_parser.add_argument('date')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.command == 'build':
+        # the database is only needed to build the snapshot
+        import backend
+        with backend.get_engine().connect() as db_connection:
+            index = MatchIndex.from_db(connection=db_connection)
+        index.save(args.snapshot)
+        logger.info(
+            "wrote %d matches of %d players to %s",
+            len(index.match_seasons), len(index.player_ids), args.snapshot,
+        )
+        return
+    index = MatchIndex.load(args.snapshot)
+    if args.command == 'matches':
+        print(index.frame(index.player_matches_of(args.player_id)).to_string(index=False))
+    elif args.command == 'head-to-head':
+        print(index.frame(index.head_to_head(args.player_id, args.opponent_id)).to_string(index=False))
+    elif args.command == 'rank':
+        print(index.rank_as_of(args.player_id, args.date))
+
+
+if __name__ == '__main__':
+    main()
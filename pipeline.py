@@ -1,16 +1,45 @@
 import abc
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import logging
+import pathlib
+import time
+import numpy as np
 import pandas as pd
 import sqlalchemy
-from authentication import DB_CONNECTION_STRING
+import backend
+import features
+import instrumentation
+import scores
+import validation
+from arguments import parse_seasons
+from cache import FrameCache
+from fetcher import FetchResult, Fetcher
 
 
-engine = sqlalchemy.create_engine(DB_CONNECTION_STRING)
 DATA_REPO = r'https://raw.githubusercontent.com/dangvohiep/tennis_atp/master/'
+CACHE_DIR = pathlib.Path(__file__).parent / '.cache'
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+FETCH_WORKERS = 8
+# rows failing the table constraints are appended to <table>.csv here instead of being loaded
+QUARANTINE_DIR = pathlib.Path(__file__).parent / 'quarantine'
+
+logger = logging.getLogger(__name__)
 
 
 # abstract class
 class DataSource:
 
+    # shared on-disk cache of parsed tables, keyed by file prefix, season and content hash
+    cache = FrameCache(directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES)
+    # shared downloader remembering the ETag/Last-Modified of every source file
+    fetcher = Fetcher(state_path=CACHE_DIR / 'validators.json', max_workers=FETCH_WORKERS)
+    # when set, tables are served from the cache only and never downloaded
+    offline = False
+
     # abstract class variable
     @property
     @abc.abstractmethod
@@ -23,6 +52,94 @@ class DataSource:
         self.season = season
         # cached table
         self._table = None
+        # sha256 of the raw source file the table was parsed from
+        self.content_hash = None
+        # measurements of the instrumented steps run on this instance
+        self.metrics = []
+
+    # read-only abstract property: location of the source file
+    @property
+    @abc.abstractmethod
+    def url(self) -> str:
+        pass
+
+    # prefix of the cache keys, distinguishing tables parsed with different schemas
+    @classmethod
+    def cache_prefix(cls) -> str:
+        return cls.file_prefix
+
+    # cache key of this season's table for a given content hash
+    def cache_key(self, content_hash: str) -> str:
+        return f"{type(self).cache_prefix()}{self.season}-{content_hash}"
+
+    # download the source file if it changed and make sure its parse is cached
+    @instrumentation.instrumented('fetch')
+    def refresh(self, conditional: bool = True) -> str:
+        cls = type(self)
+        result = cls.fetcher.fetch(self.url, conditional=conditional)
+        if result.raw is None:
+            if result.content_hash and cls.cache.path(self.cache_key(result.content_hash)).exists():
+                self.content_hash = result.content_hash
+                return self.content_hash
+            # the parse of the unmodified file is gone, download it again
+            result = cls.fetcher.fetch(self.url, conditional=False)
+        self.content_hash = hashlib.sha256(result.raw).hexdigest()
+        key = self.cache_key(content_hash=self.content_hash)
+        if not cls.cache.path(key).exists():
+            self._table = self._parse(result.raw)
+            cls.cache.put(key, self._table)
+        cls.fetcher.remember(result, content_hash=self.content_hash)
+        return self.content_hash
+
+    # content hash of the source file without downloading it: of the newest cached parse in
+    # offline mode, else the remembered one when the server reports the file unchanged;
+    # None when the file changed or was never seen
+    def known_hash(self) -> str | None:
+        cls = type(self)
+        if cls.offline:
+            return self._cached_key().rsplit('-', maxsplit=1)[1]
+        return cls.fetcher.unchanged(self.url)
+
+    # refresh many seasons concurrently, return their content hashes
+    @classmethod
+    def prefetch(cls, seasons: list[int]) -> dict[int, str]:
+        # only the hashes are kept, tables are read back from the cache when needed
+        hashes = cls.fetcher.map(lambda season: cls(season=season).refresh(), seasons)
+        return dict(zip(seasons, hashes))
+
+    # key of the newest cached parse of this season, used without the raw file in offline mode
+    def _cached_key(self) -> str:
+        cls = type(self)
+        key = cls.cache.latest(prefix=self.cache_key(content_hash=''))
+        if key is None:
+            raise FileNotFoundError(
+                f"season {self.season} of {cls.file_prefix} is not cached and offline mode is on"
+            )
+        return key
+
+    # read the table from the cache, download and parse it on a miss
+    def _cached_table(self) -> pd.DataFrame:
+        cls = type(self)
+        if cls.offline:
+            key = self._cached_key()
+            self.content_hash = key.rsplit('-', maxsplit=1)[1]
+            return cls.cache.get(key)
+        # a content hash set by a prefetch skips the download
+        if self.content_hash is None:
+            self.refresh()
+        if self._table is not None:
+            return self._table
+        table = cls.cache.get(self.cache_key(content_hash=self.content_hash))
+        if table is None:
+            # the cached parse was evicted since the refresh
+            self.refresh(conditional=False)
+            table = self._table
+        return table
+
+    # abstract method parsing the raw bytes into a typed table
+    @abc.abstractmethod
+    def _parse(self, raw: bytes) -> pd.DataFrame:
+        pass
 
     # read-only abstract property
     @property
@@ -30,16 +147,140 @@ class DataSource:
     def table(self) -> pd.DataFrame:
         pass
 
+    # abstract method yielding the table in chunks of at most chunksize rows
+    @abc.abstractmethod
+    def chunks(self, chunksize: int):
+        pass
+
+    # single-season sources this source is made of
+    def parts(self) -> list['DataSource']:
+        return [self]
+
+
+# data source serving one chunk of another source's table
+class Chunk(DataSource):
+
+    # concrete constructor
+    def __init__(self, parent: DataSource, table: pd.DataFrame) -> None:
+        super().__init__(season=parent.season)
+        self.content_hash = parent.content_hash
+        self._table = table
+
+    # implement
+    @property
+    def table(self):
+        return self._table
+
+
+# data source standing for several seasons of other sources, for tables built across seasons
+class Seasons(DataSource):
+
+    # concrete constructor
+    def __init__(self, parents: list[DataSource]) -> None:
+        super().__init__(season=None)
+        self.parents = parents
+
+    # implement
+    def parts(self) -> list[DataSource]:
+        return self.parents
+
+    # implement: the chunks of every season in turn
+    def chunks(self, chunksize: int):
+        for parent in self.parents:
+            yield from parent.chunks(chunksize=chunksize)
+
+
+# concatenate tables vertically, keeping categorical columns categorical
+def concat_tables(tables: list[pd.DataFrame]) -> pd.DataFrame:
+    tables = [table.copy(deep=False) for table in tables]
+    for column in tables[0].columns:
+        if not all(isinstance(table[column].dtype, pd.CategoricalDtype) for table in tables):
+            continue
+        # tables with different categories would otherwise concatenate to object
+        categories = tables[0][column].cat.categories
+        for table in tables[1:]:
+            categories = categories.union(table[column].cat.categories)
+        for table in tables:
+            table[column] = table[column].cat.set_categories(categories)
+    return pd.concat(tables, ignore_index=True, axis=0)
+
+
+# open a transaction on the given connection, or on a new pooled connection of the backend;
+# no connection is opened when loading into a warehouse
+@contextlib.contextmanager
+def begin(connection: sqlalchemy.Connection | None = None):
+    if ETL.warehouse is not None:
+        yield connection
+        return
+    with backend.begin(connection) as db_connection:
+        yield db_connection
+
 
 # abstract class
 class ETL:
 
+    # 'replace' deletes and re-inserts, 'upsert' merges through a staging table,
+    # 'swap' rebuilds the season partition of fact tables and upserts dimension tables
+    load_mode = 'replace'
+
+    # abstract class variable: target db table
+    @property
+    @abc.abstractmethod
+    def table_name(self):
+        pass
+
+    # abstract class variable: unique key of the target db table
+    @property
+    @abc.abstractmethod
+    def key_columns(self):
+        pass
+
+    # season column of fact tables, None for dimension tables;
+    # rows of the loaded season missing from the internal table are removed on upsert
+    season_column = None
+
+    # tables extracted from every season and transformed and loaded once across seasons
+    cross_season = False
+
+    # estimated columns of dimension rows and the column counting the appearances each estimate
+    # rests on, a merge only replaces a stored estimate with one resting on at least as many
+    estimates = {}
+
+    # (fact table, column) pairs referencing the key of a dimension table, whose seasons
+    # have their match_facts rebuilt when a referenced dimension row changes
+    referenced_by = ()
+
+    # date columns, read from the source files as text like "19910101"
+    date_columns = ('tourney_date',)
+
+    # constraints of the target db table, checked before every load
+    constraints = validation.Constraints()
+
+    # keys of the dimension rows validated in this process, per table name
+    reference_keys = {}
+
+    # warehouse.Warehouse loaded instead of the database when set, e.g. for offline runs
+    warehouse = None
+
     # concrete constructor
     def __init__(self, source: DataSource) -> None:
         # assign instance variables
         self.source = source
         # internal table
         self._table = None
+        # measurements of the instrumented steps run on this instance
+        self.metrics = []
+        # keys of the existing dimension rows whose values the load changed
+        self.changed_keys = pd.DataFrame(columns=list(type(self).key_columns))
+        # seasons whose facts the replaced dimension rows cascaded into
+        self.cascaded_seasons = set()
+
+    # instrument the extract, transform and load steps of every subclass
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        for step in instrumentation.STEPS:
+            if step in cls.__dict__:
+                setattr(cls, step, instrumentation.instrumented(step)(cls.__dict__[step]))
 
     @abc.abstractmethod
     def extract(self):
@@ -49,10 +290,455 @@ class ETL:
     def transform(self):
         pass
 
+    # combine extracted tables of several seasons into one, to be transformed once
+    @classmethod
+    def combine(cls, etls: list['ETL']) -> 'ETL':
+        etl = cls(source=Seasons(parents=[part.source for part in etls]))
+        etl._table = concat_tables([part._table for part in etls])
+        return etl
+
+    # load mode used for this table, dimension tables have no partitions to swap;
+    # cross-season tables are always merged, so loading some seasons never removes the rows
+    # of the others, nor cascades into their facts;
+    # databases without partitions replace the season of fact tables in one transaction instead
+    @classmethod
+    def table_load_mode(cls) -> str:
+        if cls.cross_season:
+            return 'upsert'
+        if cls.load_mode == 'swap' and cls.season_column is None:
+            return 'upsert'
+        if cls.load_mode == 'swap' and ETL.warehouse is None and not backend.supports_partitions():
+            return 'replace'
+        return cls.load_mode
+
+    # streamed chunks are staged and merged once the stream closes when upserting, and also
+    # when a swap falls back to replacing: the dimension rows of the stream are merged only
+    # then, so fact chunks loaded right away would miss the rows they reference
+    @classmethod
+    def stages_stream(cls) -> bool:
+        if cls.table_load_mode() == 'upsert':
+            return True
+        return cls.load_mode == 'swap' and cls.table_load_mode() == 'replace'
+
+    # concrete method, loads the internal table in the configured load mode
+    @instrumentation.instrumented('load')
+    def load(self, connection: sqlalchemy.Connection | None = None):
+        with begin(connection) as db_connection:
+            self.validate(connection=db_connection)
+            if ETL.warehouse is not None:
+                self._write_warehouse()
+                return
+            if type(self).season_column is not None and type(self).table_load_mode() != 'swap':
+                self._ensure_partition(connection=db_connection)
+            if type(self).table_load_mode() == 'upsert':
+                self.upsert(connection=db_connection)
+            elif type(self).table_load_mode() == 'swap':
+                self._create_partition(connection=db_connection)
+                self.bulk_load(table_name=self._partition_name + '_new', connection=db_connection)
+                self._swap_partition(connection=db_connection)
+            else:
+                self._cascade(connection=db_connection)
+                self._delete(connection=db_connection)
+                # stream all records in the internal table to db in the same transaction
+                self.bulk_load(table_name=type(self).table_name, connection=db_connection)
+            self.record_state(connection=db_connection, status='completed')
+            self.bump_data_version(connection=db_connection)
+
+    # check the internal table against the constraints of the db table in one columnar pass,
+    # keep the valid rows and append the others to the quarantine file of the table
+    def validate(self, connection: sqlalchemy.Connection):
+        cls = type(self)
+        known_keys = {}
+        for column, (referenced_table, referenced_column) in cls.constraints.foreign_keys.items():
+            keys = ETL.reference_keys.get(referenced_table, pd.Index([]))
+            missing = pd.Index(self._table[column].dropna().unique()).difference(keys)
+            if len(missing):
+                # keys loaded by earlier runs
+                keys = keys.union(_select_existing(
+                    connection=connection,
+                    table_name=referenced_table,
+                    column=referenced_column,
+                    values=missing.to_list(),
+                ))
+                ETL.reference_keys[referenced_table] = keys
+            known_keys[referenced_table] = keys
+        self._table, rejected = validation.validate(
+            table=self._table,
+            constraints=cls.constraints,
+            reference_keys=known_keys,
+        )
+        if cls.season_column is None:
+            key_column = cls.key_columns[0]
+            ETL.reference_keys[cls.table_name] = ETL.reference_keys.get(
+                cls.table_name, pd.Index([])
+            ).union(pd.Index(self._table[key_column].unique()))
+        if len(rejected):
+            self._quarantine(rejected)
+        return self
+
+    # append rejected rows with their reasons to the quarantine file of the db table
+    def _quarantine(self, rejected: pd.DataFrame) -> None:
+        cls = type(self)
+        QUARANTINE_DIR.mkdir(parents=True, exist_ok=True)
+        path = QUARANTINE_DIR / f"{cls.table_name}.csv"
+        rejected = rejected.assign(
+            stage=cls.__name__,
+            source_seasons=','.join(str(source.season) for source in self.source.parts()),
+            quarantined_at=pd.Timestamp.now(tz='UTC').isoformat(timespec='seconds'),
+        )
+        rejected.to_csv(path, mode='a', header=not path.exists(), index=False)
+        logger.warning(
+            "quarantined %d rows of %s to %s: %s",
+            len(rejected), cls.table_name, path, '; '.join(rejected['reason'].unique()[:5]),
+        )
+
+    # write the internal table to the warehouse: fact tables replace their season partition,
+    # dimension tables replace the rows with the same key in every load mode
+    def _write_warehouse(self) -> None:
+        cls = type(self)
+        if cls.season_column is None:
+            self.changed_keys = ETL.warehouse.upsert(
+                table_name=cls.table_name,
+                table=self._table,
+                key_columns=cls.key_columns,
+                estimates=cls.estimates,
+            )
+        else:
+            ETL.warehouse.write_partition(table_name=cls.table_name, season=self.source.season, table=self._table)
+        ETL.warehouse.bump_data_version(seasons=[source.season for source in self.source.parts()])
+
+    # record the load state of this season and stage in the load_state table
+    def record_state(
+        self,
+        connection: sqlalchemy.Connection,
+        status: str,
+        row_count: int | None = None,
+    ) -> None:
+        cls = type(self)
+        if self.cascaded_seasons and status == 'completed':
+            # the facts of these seasons have to be loaded again
+            connection.execute(
+                statement=sqlalchemy.sql.text(
+                    """delete from load_state where stage in :stages and season in :seasons"""
+                ).bindparams(
+                    sqlalchemy.bindparam('stages', expanding=True),
+                    sqlalchemy.bindparam('seasons', expanding=True),
+                ),
+                parameters={
+                    'stages'    : [fact_class.__name__ for fact_class in FACTS],
+                    'seasons'   : sorted(self.cascaded_seasons),
+                },
+            )
+        query = sqlalchemy.sql.text(
+            """
+            insert into load_state (season, stage, source_hash, row_count, status, updated_at)
+            values (:season, :stage, :source_hash, :row_count, :status, current_timestamp)
+            on conflict (season, stage) do update set
+                source_hash = excluded.source_hash,
+                row_count   = excluded.row_count,
+                status      = excluded.status,
+                updated_at  = excluded.updated_at
+            """
+        )
+        # a table built across seasons records its state for every season it was built from
+        connection.execute(
+            statement=query,
+            parameters=[
+                {
+                    'season'        : source.season,
+                    'stage'         : cls.__name__,
+                    'source_hash'   : source.content_hash,
+                    'row_count'     : len(self._table) if row_count is None else row_count,
+                    'status'        : status,
+                }
+                for source in self.source.parts()
+            ],
+        )
+
+    # bump the data version of every season of the source, so cached results of them expire
+    def bump_data_version(self, connection: sqlalchemy.Connection) -> None:
+        bump_data_version(seasons=[source.season for source in self.source.parts()], connection=connection)
+
+    # remember the seasons of the facts that deleting the dimension rows the internal table
+    # replaces cascades into
+    def _cascade(self, connection: sqlalchemy.Connection) -> None:
+        cls = type(self)
+        if cls.season_column is not None:
+            return
+        self.cascaded_seasons |= cls.referencing_seasons(
+            keys=self._table[cls.key_columns[0]].dropna().unique().tolist(), connection=connection
+        )
+
+    # seasons of the facts referencing the given keys of this dimension table
+    @classmethod
+    def referencing_seasons(cls, keys: list, connection: sqlalchemy.Connection | None) -> set[int]:
+        seasons = set()
+        if not keys:
+            return seasons
+        for table_name, column in cls.referenced_by:
+            if ETL.warehouse is None:
+                found = backend.select_in(
+                    connection=connection,
+                    table_name=table_name,
+                    column=column,
+                    values=keys,
+                    result_column='season',
+                )
+            elif ETL.warehouse.exists(table_name):
+                found = ETL.warehouse.read_table(
+                    table_name, columns=['season'], filters=[(column, 'in', keys)]
+                )['season']
+            else:
+                continue
+            seasons.update(int(season) for season in found)
+        return seasons
+
+    # delete the db records the internal table replaces
     @abc.abstractmethod
-    def load(self):
+    def _delete(self, connection: sqlalchemy.Connection):
         pass
 
+    # merge the internal table into the db table through a staging table,
+    # writing only new and changed rows
+    def upsert(self, connection: sqlalchemy.Connection) -> None:
+        columns = list(self._table.columns)
+        self._create_stage(connection=connection, columns=columns)
+        self.bulk_load(table_name=self._stage_name, connection=connection)
+        self._merge_stage(connection=connection, columns=columns)
+
+    # name of the staging table of the target db table
+    @property
+    def _stage_name(self) -> str:
+        return f"stage_{type(self).table_name}"
+
+    # create an empty staging table with the given columns of the target db table
+    def _create_stage(self, connection: sqlalchemy.Connection, columns: list[str]) -> None:
+        backend.create_stage(
+            connection=connection,
+            stage_name=self._stage_name,
+            table_name=type(self).table_name,
+            columns=columns,
+        )
+
+    # merge the staging table into the target db table, then drop it
+    def _merge_stage(self, connection: sqlalchemy.Connection, columns: list[str]) -> None:
+        cls = type(self)
+        target = cls.table_name
+        stage = self._stage_name
+        if cls.season_column is None:
+            self.changed_keys = backend.changed_keys(
+                connection=connection,
+                stage_name=stage,
+                table_name=target,
+                columns=columns,
+                key_columns=cls.key_columns,
+                estimates=cls.estimates,
+            )
+        backend.merge_stage(
+            connection=connection,
+            stage_name=stage,
+            table_name=target,
+            columns=columns,
+            key_columns=cls.key_columns,
+            estimates=cls.estimates,
+        )
+        if cls.season_column is not None:
+            # remove rows of the loaded season that are no longer in the source
+            key_match = ' and '.join(
+                f'"{stage}"."{column}" = "{target}"."{column}"' for column in cls.key_columns
+            )
+            connection.execute(
+                statement=sqlalchemy.sql.text(
+                    f'delete from "{target}" where "{cls.season_column}" = :season '
+                    f'and not exists (select 1 from "{stage}" where {key_match})'
+                ),
+                parameters={'season': self.source.season},
+            )
+        connection.exec_driver_sql(f'drop table "{stage}"')
+
+    # name of the season partition of a fact table
+    @property
+    def _partition_name(self) -> str:
+        return f"{type(self).table_name}_{self.source.season}"
+
+    # create the season partition of a fact table if it does not exist yet
+    def _ensure_partition(self, connection: sqlalchemy.Connection) -> None:
+        # other databases stand in with unpartitioned fact tables (see create_sqlite.sql)
+        if not backend.supports_partitions(connection):
+            return
+        connection.exec_driver_sql(
+            f'create table if not exists "{self._partition_name}" '
+            f'partition of "{type(self).table_name}" for values in ({int(self.source.season)})'
+        )
+
+    # create an empty table to build the new season partition in, outside of the fact table
+    def _create_partition(self, connection: sqlalchemy.Connection) -> None:
+        cls = type(self)
+        new_partition = self._partition_name + '_new'
+        connection.exec_driver_sql(f'drop table if exists "{new_partition}"')
+        # copies column defaults, not-null constraints and the indexes of the fact table
+        connection.exec_driver_sql(
+            f'create table "{new_partition}" (like "{cls.table_name}" including all)'
+        )
+        # the check proves the partition bound, so attaching it skips the validation scan
+        connection.exec_driver_sql(
+            f'alter table "{new_partition}" add constraint "{new_partition}_season_check" '
+            f'check ("{cls.season_column}" = {int(self.source.season)})'
+        )
+
+    # atomically replace the season partition with the newly built one, without row deletes
+    def _swap_partition(self, connection: sqlalchemy.Connection) -> None:
+        cls = type(self)
+        partition = self._partition_name
+        connection.exec_driver_sql(f"""
+            do $$
+            begin
+                if to_regclass('"{partition}"') is not null then
+                    alter table "{cls.table_name}" detach partition "{partition}";
+                    drop table "{partition}";
+                end if;
+            end $$
+        """)
+        connection.exec_driver_sql(f'alter table "{partition}_new" rename to "{partition}"')
+        # give the indexes built on the new table the names of the dropped partition's indexes
+        connection.exec_driver_sql(f"""
+            do $$
+            declare
+                index_name text;
+            begin
+                for index_name in
+                    select indexname from pg_indexes
+                    where tablename = '{partition}' and indexname like '{partition}\\_new\\_%%'
+                loop
+                    execute format(
+                        'alter index %%I rename to %%I',
+                        index_name,
+                        replace(regexp_replace(index_name, '\\d+$', ''), '{partition}_new_', '{partition}_')
+                    );
+                end loop;
+            end $$
+        """)
+        connection.exec_driver_sql(
+            f'alter table "{cls.table_name}" attach partition "{partition}" '
+            f'for values in ({int(self.source.season)})'
+        )
+
+    # prepare streaming the source chunk by chunk into the db table
+    def open_stream(self, connection: sqlalchemy.Connection) -> None:
+        # hashes of the keys loaded from earlier chunks
+        self._seen_keys = np.empty(0, dtype=np.uint64)
+        self._stream_columns = None
+        self._stream_rows = 0
+        self._stream_writer = None
+        # tables of the chunks that are only loaded once the stream closes
+        self._stream_tables = []
+        if type(self).season_column is None:
+            return
+        if ETL.warehouse is not None:
+            self._stream_writer = ETL.warehouse.partition_writer(
+                table_name=type(self).table_name, season=self.source.season
+            )
+            return
+        if type(self).table_load_mode() == 'swap':
+            self._create_partition(connection=connection)
+            return
+        self._ensure_partition(connection=connection)
+        if not type(self).stages_stream():
+            self._delete(connection=connection)
+
+    # extract, transform and load one chunk of the source, skipping keys of earlier chunks
+    def load_chunk(self, chunk: pd.DataFrame, connection: sqlalchemy.Connection) -> None:
+        cls = type(self)
+        if cls.cross_season:
+            # the rows of every chunk are transformed together once the stream closes, so the
+            # latest values and the estimates cover the whole stream like a batch load
+            self._stream_tables.append(cls(source=Chunk(parent=self.source, table=chunk)).extract()._table)
+            return
+        etl = cls(source=Chunk(parent=self.source, table=chunk)).extract().transform()
+        key_hashes = pd.util.hash_pandas_object(
+            etl._table[list(cls.key_columns)], index=False
+        ).to_numpy()
+        is_new = ~np.isin(key_hashes, self._seen_keys)
+        etl._table = etl._table[is_new].reset_index(drop=True)
+        self._seen_keys = np.union1d(self._seen_keys, key_hashes[is_new])
+        etl.validate(connection=connection)
+        self._stream_rows += len(etl._table)
+        if self._stream_writer is not None:
+            self._stream_writer.write(etl._table)
+            return
+        if ETL.warehouse is not None:
+            # dimension rows are written once the stream closes, as one version of the table
+            self._stream_tables.append(etl._table)
+            return
+        if cls.table_load_mode() == 'swap':
+            etl.bulk_load(table_name=self._partition_name + '_new', connection=connection)
+            return
+        if cls.stages_stream():
+            # chunks accumulate in the staging table, which is merged once at the end
+            if self._stream_columns is None:
+                self._stream_columns = list(etl._table.columns)
+                self._create_stage(connection=connection, columns=self._stream_columns)
+            etl.bulk_load(table_name=self._stage_name, connection=connection)
+            return
+        if cls.season_column is None:
+            etl._cascade(connection=connection)
+            self.cascaded_seasons |= etl.cascaded_seasons
+            etl._delete(connection=connection)
+        etl.bulk_load(table_name=cls.table_name, connection=connection)
+
+    # finish streaming the source into the db table
+    def close_stream(self, connection: sqlalchemy.Connection) -> None:
+        if type(self).cross_season:
+            if self._stream_tables:
+                self._table = concat_tables(self._stream_tables)
+                self.transform().load(connection=connection)
+            return
+        if ETL.warehouse is not None:
+            if self._stream_writer is not None:
+                self._stream_writer.commit()
+                ETL.warehouse.bump_data_version(seasons=[self.source.season])
+            elif self._stream_tables:
+                self._table = concat_tables(self._stream_tables)
+                self._write_warehouse()
+            return
+        if type(self).stages_stream():
+            if self._stream_columns is not None:
+                # merging a season also removes its rows that are no longer in the source
+                self._merge_stage(connection=connection, columns=self._stream_columns)
+            elif type(self).table_load_mode() == 'replace':
+                self._delete(connection=connection)
+        elif type(self).table_load_mode() == 'swap':
+            self._swap_partition(connection=connection)
+        self.record_state(connection=connection, status='completed', row_count=self._stream_rows)
+        self.bump_data_version(connection=connection)
+
+    # stream the internal table into a db table, return the throughput in rows per second
+    def bulk_load(self, table_name: str, connection: sqlalchemy.Connection) -> float:
+        start_time = time.perf_counter()
+        table = type(self)._prepare_for_load(self._table)
+        backend.bulk_insert(table_name=table_name, table=table, connection=connection)
+        elapsed_time = time.perf_counter() - start_time
+        rows_per_second = len(table) / elapsed_time if elapsed_time > 0 else float('inf')
+        logger.info(
+            "loaded %d rows into %s in %.3fs (%.0f rows/s)",
+            len(table), table_name, elapsed_time, rows_per_second,
+        )
+        return rows_per_second
+
+    # write whole-number float columns as nullable integers, so integer db columns accept them,
+    # and date columns as dates, which every bulk loader writes as iso dates
+    @classmethod
+    def _prepare_for_load(cls, table: pd.DataFrame) -> pd.DataFrame:
+        table = table.copy()
+        for column in cls.date_columns:
+            if column in table.columns:
+                table[column] = pd.to_datetime(table[column], format='mixed')
+        for column in table.select_dtypes(include='float').columns:
+            values = table[column].dropna()
+            if (values % 1 == 0).all():
+                table[column] = table[column].astype('Int64')
+        return table
+
 
 class ATP(DataSource):
 
@@ -108,6 +794,66 @@ class ATP(DataSource):
         'loser_rank'        : float,
         'loser_rank_points' : float,
     }
+    # compact schema: nullable small integers, categories for low-cardinality
+    # fields and arrow-backed strings for names, ids and scores
+    compact_type_mapping = {
+        'tourney_id'        : 'category',
+        'tourney_name'      : 'category',
+        'surface'           : 'category',
+        'draw_size'         : 'Int16',
+        'tourney_level'     : 'category',
+        'tourney_date'      : str,
+        'match_num'         : 'Int16',
+        'winner_id'         : 'string[pyarrow]',
+        'winner_seed'       : 'Int8',
+        'winner_entry'      : 'category',
+        'winner_name'       : 'string[pyarrow]',
+        'winner_hand'       : 'category',
+        'winner_ht'         : 'Int16',
+        'winner_ioc'        : 'category',
+        'winner_age'        : 'float32',
+        'loser_id'          : 'string[pyarrow]',
+        'loser_seed'        : 'Int8',
+        'loser_entry'       : 'category',
+        'loser_name'        : 'string[pyarrow]',
+        'loser_hand'        : 'category',
+        'loser_ht'          : 'Int16',
+        'loser_ioc'         : 'category',
+        'loser_age'         : 'float32',
+        'score'             : 'string[pyarrow]',
+        'best_of'           : 'Int8',
+        'round'             : 'category',
+        'minutes'           : 'Int16',
+        'w_ace'             : 'Int16',
+        'w_df'              : 'Int16',
+        'w_svpt'            : 'Int16',
+        'w_1stIn'           : 'Int16',
+        'w_1stWon'          : 'Int16',
+        'w_2ndWon'          : 'Int16',
+        'w_SvGms'           : 'Int16',
+        'w_bpSaved'         : 'Int16',
+        'w_bpFaced'         : 'Int16',
+        'l_ace'             : 'Int16',
+        'l_df'              : 'Int16',
+        'l_svpt'            : 'Int16',
+        'l_1stIn'           : 'Int16',
+        'l_1stWon'          : 'Int16',
+        'l_2ndWon'          : 'Int16',
+        'l_SvGms'           : 'Int16',
+        'l_bpSaved'         : 'Int16',
+        'l_bpFaced'         : 'Int16',
+        'winner_rank'       : 'Int16',
+        'winner_rank_points': 'Int32',
+        'loser_rank'        : 'Int16',
+        'loser_rank_points' : 'Int32',
+    }
+    # parse with the compact schema instead of the default one
+    compact = False
+
+    # implement
+    @classmethod
+    def cache_prefix(cls) -> str:
+        return f"{cls.file_prefix}compact_" if cls.compact else cls.file_prefix
 
     # implement
     @property
@@ -115,19 +861,67 @@ class ATP(DataSource):
         # return the cached table
         if self._table is not None:
             return self._table
-        # read data file from data repository
-        self._table: pd.DataFrame = pd.read_csv(
-            f"{DATA_REPO}{type(self).file_prefix}{self.season}.csv",
+        # read data file from the local cache or the data repository
+        self._table: pd.DataFrame = self._cached_table()
+        return self._table
+
+    # implement
+    @property
+    def url(self) -> str:
+        return f"{DATA_REPO}{type(self).file_prefix}{self.season}.csv"
+
+    # implement
+    def _parse(self, raw: bytes) -> pd.DataFrame:
+        return self._read_csv(io.BytesIO(raw))
+
+    # implement
+    def chunks(self, chunksize: int):
+        cls = type(self)
+        if cls.offline and self.content_hash is None:
+            self.content_hash = self._cached_key().rsplit('-', maxsplit=1)[1]
+        if self.content_hash is not None:
+            key = self.cache_key(content_hash=self.content_hash)
+            if cls.cache.path(key).exists():
+                yield from cls.cache.iter_chunks(key, chunksize=chunksize)
+                return
+        # stream the csv from the data repository, hashing it on the way
+        with cls.fetcher.stream(self.url) as reader:
+            yield from self._read_csv(io.BufferedReader(reader), chunksize=chunksize)
+            self.content_hash = reader.hexdigest()
+            # the next run asks the server whether the file changed instead of reading it again
+            cls.fetcher.remember(
+                FetchResult(
+                    url=self.url,
+                    raw=None,
+                    etag=reader.headers.get('ETag'),
+                    last_modified=reader.headers.get('Last-Modified'),
+                ),
+                content_hash=self.content_hash,
+            )
+
+    # read a season csv, whole or as an iterator of chunks
+    def _read_csv(self, buffer, chunksize: int | None = None):
+        return pd.read_csv(
+            buffer,
             header=0,
             parse_dates=['tourney_date'],
             date_format=r'YYYYmmdd',
-            dtype=type(self).type_mapping,
+            dtype=type(self).compact_type_mapping if type(self).compact else type(self).type_mapping,
+            chunksize=chunksize,
         )
-        return self._table
 
 
 class Tournaments(ETL):
 
+    table_name = 'tournaments'
+    key_columns = ('tourney_id',)
+    referenced_by = (('matches', 'tourney_id'),)
+    constraints = validation.Constraints(
+        not_null=('tourney_id', 'tourney_name'),
+        max_lengths={'tourney_id': 255, 'tourney_name': 255, 'tourney_level': 255, 'surface': 255},
+        unique=(('tourney_id',),),
+    )
+
     # implement
     def extract(self):
         self._table = self.source.table[[
@@ -146,26 +940,31 @@ class Tournaments(ETL):
         return self
 
     # implement
-    def load(self):
+    def _delete(self, connection: sqlalchemy.Connection):
         # delete all records in the internal table from db table
         inserting_ids = self._table['tourney_id'].to_list()
-        query = sqlalchemy.sql.text(
-            f"""delete from tournaments where tourney_id = any(:ids)"""
-        )
-        with engine.begin() as db_connection:
-            db_connection.execute(
-                statement=query, 
-                parameters={'ids': inserting_ids}
-            )
-        # insert all records in the internal table to db
-        self._table.to_sql(name="tournaments", con=engine, if_exists='append', index=False)
+        backend.delete_in(connection=connection, table_name=type(self).table_name, column='tourney_id', values=inserting_ids)
 
 
 class Players(ETL):
 
-    # implement
+    table_name = 'players'
+    key_columns = ('player_id',)
+    cross_season = True
+    # estimated from the ages at the appearances of the loaded seasons only
+    estimates = {'birth_year': 'birth_year_appearances'}
+    referenced_by = (('matches', 'winner_id'), ('matches', 'loser_id'))
+    constraints = validation.Constraints(
+        not_null=('player_id', 'name', 'ioc'),
+        check_sets={'hand': ('R', 'L', 'A', 'U')},
+        max_lengths={'player_id': 15, 'name': 255, 'hand': 5, 'ioc': 5},
+        unique=(('player_id',),),
+    )
+
+    # implement: one row per player and match, dated to read the age against
     def extract(self):
         winner_table: pd.DataFrame = self.source.table[[
+            'tourney_date',
             'winner_id',
             'winner_name',
             'winner_hand',
@@ -174,6 +973,7 @@ class Players(ETL):
             'winner_age',
         ]].rename(mapper=type(self).__rename_column, axis=1)
         loser_table: pd.DataFrame = self.source.table[[
+            'tourney_date',
             'loser_id',
             'loser_name',
             'loser_hand',
@@ -181,38 +981,43 @@ class Players(ETL):
             'loser_ioc',
             'loser_age',
         ]].rename(mapper=type(self).__rename_column, axis=1)
-        self._table = pd.concat(
-            [winner_table, loser_table],
-            ignore_index=True,
-            axis=0,
-        )
+        self._table = concat_tables([winner_table, loser_table])
         return self
     
-    # implement
+    # implement: one row per player, from the appearances of one or many seasons
     def transform(self):
-        self._table['birth_year'] = self.source.season - self._table['age'].floordiv(1)
-        self._table['birth_year'] = self._table['birth_year'].mode().squeeze()
-        self._table = self._table.drop(labels=['age'], axis=1)
-        self._table = self._table.drop_duplicates().reset_index(drop=True)
+        appearances = self._table.sort_values(by='tourney_date', kind='stable')
+        # birth year implied by the age at each appearance, the most frequent one per player
+        tourney_date = pd.to_datetime(appearances['tourney_date'], format='%Y%m%d')
+        appearances['birth_year'] = np.floor(
+            tourney_date.dt.year + (tourney_date.dt.dayofyear - 1) / 365.25
+            - appearances['age'].astype(float)
+        )
+        birth_years = (
+            appearances.dropna(subset=['birth_year'])
+            .groupby(['player_id', 'birth_year']).size().rename('count').reset_index()
+            # ties go to the earlier year
+            .sort_values(by=['player_id', 'count', 'birth_year'], ascending=[True, False, True])
+            .drop_duplicates(subset='player_id')
+            .set_index('player_id')['birth_year']
+        )
+        # latest known name, hand, height and country, nulls do not overwrite earlier values
+        self._table = appearances.groupby('player_id')[['name', 'hand', 'height', 'ioc']].last()
+        self._table['birth_year'] = birth_years
+        self._table['birth_year_appearances'] = appearances.groupby('player_id')['birth_year'].count()
+        self._table = self._table.reset_index()
         return self
 
     # implement
-    def load(self):
+    def _delete(self, connection: sqlalchemy.Connection):
         # delete all records in the internal table from db table
         inserting_ids = self._table['player_id'].to_list()
-        query = sqlalchemy.sql.text(
-            f"""delete from players where player_id = any(:ids)"""
-        )
-        with engine.begin() as db_connection:
-            db_connection.execute(
-                statement=query, 
-                parameters={'ids': inserting_ids}
-            )
-        # insert all records in the internal table to db
-        self._table.to_sql(name="players", con=engine, if_exists='append', index=False)
+        backend.delete_in(connection=connection, table_name=type(self).table_name, column='player_id', values=inserting_ids)
 
     @staticmethod
     def __rename_column(raw_name: str):
+        if raw_name == 'tourney_date':
+            return raw_name
         if raw_name.endswith('_id'):
             return 'player_id'
         if raw_name.endswith('_ht'):
@@ -222,6 +1027,20 @@ class Players(ETL):
 
 class Matches(ETL):
 
+    table_name = 'matches'
+    key_columns = ('season', 'tourney_id', 'match_num')
+    season_column = 'season'
+    constraints = validation.Constraints(
+        not_null=('season', 'tourney_id', 'match_num', 'winner_id', 'loser_id'),
+        max_lengths={'tourney_id': 255, 'winner_id': 15, 'loser_id': 15, 'score': 255, 'round': 50},
+        unique=(('season', 'tourney_id', 'match_num'),),
+        foreign_keys={
+            'tourney_id': ('tournaments', 'tourney_id'),
+            'winner_id' : ('players', 'player_id'),
+            'loser_id'  : ('players', 'player_id'),
+        },
+    )
+
     # implement
     def extract(self):
         self._table = self.source.table[[
@@ -238,22 +1057,21 @@ class Matches(ETL):
     def transform(self):
         self._table = self._table.drop_duplicates().reset_index(drop=True)
         self._table.insert(loc=0, column='season', value=self.source.season)
+        # sets, games, tiebreaks and retirement flags as columns next to the raw score
+        self._table = pd.concat([self._table, scores.parse(self._table['score'])], axis=1)
         return self
 
     # implement
-    def load(self):
+    def _delete(self, connection: sqlalchemy.Connection):
         # delete all records in the internal table from db table
         inserting_season = self.source.season
         query = sqlalchemy.sql.text(
             f"""delete from matches where season = :season"""
         )
-        with engine.begin() as db_connection:
-            db_connection.execute(
-                statement=query, 
-                parameters={'season': inserting_season}
-            )
-        # insert all records in the internal table to db
-        self._table.to_sql(name="matches", con=engine, if_exists='append', index=False)
+        connection.execute(
+            statement=query, 
+            parameters={'season': inserting_season}
+        )
 
     # private static method for explicit naming
     @staticmethod
@@ -282,6 +1100,19 @@ class Matches(ETL):
 
 class Rankings(ETL):
 
+    table_name = 'rankings'
+    key_columns = ('season', 'tourney_id', 'player_id')
+    season_column = 'season'
+    constraints = validation.Constraints(
+        not_null=('season', 'tourney_id', 'player_id'),
+        max_lengths={'tourney_id': 255, 'player_id': 15},
+        unique=(('season', 'tourney_id', 'player_id'),),
+        foreign_keys={
+            'tourney_id': ('tournaments', 'tourney_id'),
+            'player_id' : ('players', 'player_id'),
+        },
+    )
+
     # implement
     def extract(self):
         winner_table = self.source.table[[
@@ -296,11 +1127,7 @@ class Rankings(ETL):
             'loser_rank',
             'loser_rank_points'
         ]].rename(mapper=type(self).__rename_column, axis=1)
-        self._table = pd.concat(
-            [winner_table, loser_table],
-            ignore_index=True,
-            axis=0,
-        )
+        self._table = concat_tables([winner_table, loser_table])
         return self
 
     # implement
@@ -310,19 +1137,16 @@ class Rankings(ETL):
         return self
 
     # implement
-    def load(self):
+    def _delete(self, connection: sqlalchemy.Connection):
         # delete all records in the internal table from db table
         inserting_season = self.source.season
         query = sqlalchemy.sql.text(
-            f"""delete from rankings where season = :season""",
+            f"""delete from rankings where season = :season"""
+        )
+        connection.execute(
+            statement=query, 
+            parameters={'season': inserting_season}
         )
-        with engine.begin() as db_connection:
-            db_connection.execute(
-                statement=query, 
-                parameters={'season': inserting_season}
-            )
-        # insert all records in the internal table to db
-        self._table.to_sql(name="rankings", con=engine, if_exists='append', index=False)
 
     @staticmethod
     def __rename_column(raw_name: str):
@@ -337,32 +1161,626 @@ class Rankings(ETL):
         }
         return name_mapping[raw_name]
 
-if __name__ == '__main__':
+"""
+INSERTING ORDER:
+FOR EACH SEASON, SEPARATELY INSERT TABLES BY THE FOLLOWING ORDER:
+    1. tournaments      : dimension table
+    2. players          : dimension table
+    3. rankings         : fact table
+    4. matches          : fact table
+THE PLAYERS TABLE IS BUILT ONCE FROM THE MATCHES OF ALL SEASONS AND LOADED
+BEFORE ANY OTHER TABLE.
+DIMENSION TABLES OF ALL SEASONS ARE LOADED BEFORE ANY FACT TABLE, BECAUSE
+RELOADING A DIMENSION CASCADES DELETES INTO THE FACT TABLES.
+IN UPSERT AND SWAP LOAD MODES NOTHING CASCADES, SO THE OTHER THREE TABLES OF
+A SEASON ARE LOADED TOGETHER IN ONE TRANSACTION.
+"""
+DIMENSIONS  = (Tournaments, Players)
+FACTS       = (Rankings, Matches)
+
 
-    start_season    = 1991
-    end_season      = 2023
-
-    for season in range(start_season, end_season+1):
-        atp_source = ATP(season=season)
-        Tournaments(source=atp_source).extract().transform().load()
-    for season in range(start_season, end_season+1):
-        atp_source = ATP(season=season)
-        Players(source=atp_source).extract().transform().load()
-    for season in range(start_season, end_season+1):
-        atp_source = ATP(season=season)
-        Rankings(source=atp_source).extract().transform().load()
-    for season in range(start_season, end_season+1):
-        atp_source = ATP(season=season)
-        Matches(source=atp_source).extract().transform().load()
-
-
-    """
-    INSERTING ORDER:
-    FOR EACH SEASON, SEPARATELY INSERT TABLES BY THE FOLLOWING ORDER:
-        1. tournaments      : dimension table
-        2. players          : dimension table
-        3. rankings         : fact table
-        4. matches          : fact table
-    """
+# denormalized match facts of the given seasons, in the shape of the match_facts table
+MATCH_FACTS_QUERY = """
+    SELECT 
+        m."season",
+        m."tourney_id",
+        m."match_num",
+        t."tourney_name",
+        t."tourney_level",
+        t."tourney_date",
+        t."surface",
+        t."draw_size",
+        pw."name"       AS "winner_name",
+        pw."hand"       AS "winner_hand",
+        pw."height"     AS "winner_height",
+        pw."ioc"        AS "winner_ioc",
+        pw."birth_year" AS "winner_birth_year",
+        pl."name"       AS "loser_name",
+        pl."hand"       AS "loser_hand",
+        pl."height"     AS "loser_height",
+        pl."ioc"        AS "loser_ioc",
+        pl."birth_year" AS "loser_birth_year",
+        m."score",
+        m."best_of",
+        m."round",
+        m."minutes",
+        m."winner_aces",
+        m."winner_double_faults",
+        m."winner_serve_points",
+        m."winner_first_serve_in",
+        m."winner_first_serve_won",
+        m."winner_second_serve_won",
+        m."winner_service_games",
+        m."winner_break_points_saved",
+        m."winner_break_points_faced",
+        m."loser_aces",
+        m."loser_double_faults",
+        m."loser_serve_points",
+        m."loser_first_serve_in",
+        m."loser_first_serve_won",
+        m."loser_second_serve_won",
+        m."loser_service_games",
+        m."loser_break_points_saved",
+        m."loser_break_points_faced",
+        rw."rank"       AS "winner_rank",
+        rw."points"     AS "winner_points",
+        rl."rank"       AS "loser_rank",
+        rl."points"     AS "loser_points",
+        m."set1_winner_games",
+        m."set1_loser_games",
+        m."set1_tiebreak",
+        m."set2_winner_games",
+        m."set2_loser_games",
+        m."set2_tiebreak",
+        m."set3_winner_games",
+        m."set3_loser_games",
+        m."set3_tiebreak",
+        m."set4_winner_games",
+        m."set4_loser_games",
+        m."set4_tiebreak",
+        m."set5_winner_games",
+        m."set5_loser_games",
+        m."set5_tiebreak",
+        m."sets_played",
+        m."winner_sets",
+        m."loser_sets",
+        m."winner_games",
+        m."loser_games",
+        m."total_games",
+        m."match_tiebreak",
+        m."retired",
+        m."walkover",
+        m."defaulted",
+        m."unfinished"
+    FROM "tournaments" t
+    JOIN "matches" m ON t."tourney_id" = m."tourney_id"
+    JOIN "players" pw ON m."winner_id" = pw."player_id"
+    JOIN "players" pl ON m."loser_id" = pl."player_id"
+    LEFT JOIN "rankings" rw 
+        ON rw."player_id" = pw."player_id" 
+        AND rw."tourney_id" = t."tourney_id" 
+        AND rw."season" = m."season"
+    LEFT JOIN "rankings" rl 
+        ON rl."player_id" = pl."player_id" 
+        AND rl."tourney_id" = t."tourney_id" 
+        AND rl."season" = m."season"
+    WHERE m."season" IN :seasons
+"""
 
 
+# rebuild the match_facts rows of the given seasons only
+def refresh_match_facts(
+    seasons: list[int],
+    connection: sqlalchemy.Connection | None = None,
+) -> None:
+    if not seasons:
+        return
+    if ETL.warehouse is not None:
+        facts = ETL.warehouse.read_sql(
+            sql=sqlalchemy.sql.text(MATCH_FACTS_QUERY).bindparams(
+                sqlalchemy.bindparam('seasons', expanding=True)
+            ),
+            params={'seasons': list(seasons)},
+        )
+        for season in seasons:
+            ETL.warehouse.write_partition(
+                table_name='match_facts', season=season, table=facts[facts['season'] == season]
+            )
+        ETL.warehouse.bump_data_version(seasons=seasons)
+        logger.info("refreshed match_facts for seasons %s", ', '.join(map(str, seasons)))
+        return
+    with begin(connection) as db_connection:
+        for query in (
+            """DELETE FROM "match_facts" WHERE "season" IN :seasons""",
+            f"""INSERT INTO "match_facts" {MATCH_FACTS_QUERY}""",
+        ):
+            db_connection.execute(
+                statement=sqlalchemy.sql.text(query).bindparams(
+                    sqlalchemy.bindparam('seasons', expanding=True)
+                ),
+                parameters={'seasons': list(seasons)},
+            )
+        bump_data_version(seasons=seasons, connection=db_connection)
+    logger.info("refreshed match_facts for seasons %s", ', '.join(map(str, seasons)))
+
+
+# seasons of the facts referencing a dimension row changed by the given loads
+def referencing_seasons(etls: list[ETL], connection: sqlalchemy.Connection | None = None) -> list[int]:
+    seasons = set()
+    with begin(connection) as db_connection:
+        for etl in etls:
+            # dimension tables have single column keys
+            seasons |= type(etl).referencing_seasons(
+                keys=etl.changed_keys[type(etl).key_columns[0]].to_list(), connection=db_connection
+            )
+    return sorted(seasons)
+
+
+# rebuild the match_facts, and so bump the data version, of the seasons referencing a dimension
+# row changed by the given loads, except for the seasons whose facts were already refreshed
+def refresh_referencing_seasons(etls: list[ETL], refreshed_seasons: list[int]) -> None:
+    seasons = [season for season in referencing_seasons(etls) if season not in set(refreshed_seasons)]
+    if seasons:
+        logger.info("dimension rows referenced by seasons %s changed", ', '.join(map(str, seasons)))
+        refresh_match_facts(seasons=seasons)
+
+
+# previous rows of every player at a season boundary: the last features.WINDOW
+# player_features rows of each player before the season, in match order
+PLAYER_FEATURES_STATE_QUERY = f"""
+    SELECT "player_id", "elo_after", "matches_played", {', '.join(f'"{column}"' for column in features.STAT_COLUMNS)}
+    FROM (
+        SELECT 
+            f.*,
+            row_number() OVER (
+                PARTITION BY f."player_id"
+                ORDER BY f."tourney_date" DESC, f."tourney_id" DESC, f."match_num" DESC
+            ) AS "recency"
+        FROM "player_features" f
+        WHERE f."season" < :season
+    ) s
+    WHERE "recency" <= :window
+    ORDER BY "tourney_date", "tourney_id", "match_num"
+"""
+
+# matches from a season on, in the order the ratings are updated
+PLAYER_FEATURES_MATCHES_QUERY = """
+    SELECT 
+        m."season",
+        m."tourney_id",
+        m."match_num",
+        t."tourney_date",
+        m."winner_id",
+        m."loser_id",
+        m."winner_aces",
+        m."winner_serve_points",
+        m."winner_first_serve_in",
+        m."winner_first_serve_won",
+        m."winner_second_serve_won",
+        m."winner_service_games",
+        m."winner_break_points_saved",
+        m."winner_break_points_faced",
+        m."loser_aces",
+        m."loser_serve_points",
+        m."loser_first_serve_in",
+        m."loser_first_serve_won",
+        m."loser_second_serve_won",
+        m."loser_service_games",
+        m."loser_break_points_saved",
+        m."loser_break_points_faced"
+    FROM "matches" m
+    JOIN "tournaments" t ON t."tourney_id" = m."tourney_id"
+    WHERE m."season" >= :season
+    ORDER BY t."tourney_date", m."tourney_id", m."match_num"
+"""
+
+
+# recompute the player ratings and rolling stats from a season on, resuming from the
+# state saved in player_features at the boundary of that season; ratings are sequential,
+# so every later season is recomputed as well
+def refresh_player_features(
+    season: int,
+    connection: sqlalchemy.Connection | None = None,
+) -> None:
+    start_time = time.perf_counter()
+    if ETL.warehouse is not None:
+        if ETL.warehouse.exists('player_features'):
+            history = ETL.warehouse.read_sql(
+                sql=PLAYER_FEATURES_STATE_QUERY,
+                params={'season': season, 'window': features.WINDOW},
+            )
+        else:
+            history = pd.DataFrame(columns=['player_id', 'elo_after', 'matches_played', *features.STAT_COLUMNS])
+        matches = ETL.warehouse.read_sql(sql=PLAYER_FEATURES_MATCHES_QUERY, params={'season': season})
+        table = features.compute(matches=matches, history=history)
+        ETL.warehouse.delete_partitions(
+            table_name='player_features',
+            seasons=[loaded for loaded in ETL.warehouse.seasons('player_features') if loaded >= season],
+        )
+        for partition_season, partition in table.groupby('season'):
+            ETL.warehouse.write_partition(table_name='player_features', season=partition_season, table=partition)
+        logger.info(
+            "refreshed player_features from season %d (%d rows) in %.3fs",
+            season, len(table), time.perf_counter() - start_time,
+        )
+        return
+    with begin(connection) as db_connection:
+        history = pd.read_sql(
+            sql=sqlalchemy.sql.text(PLAYER_FEATURES_STATE_QUERY),
+            con=db_connection,
+            params={'season': season, 'window': features.WINDOW},
+        )
+        matches = pd.read_sql(
+            sql=sqlalchemy.sql.text(PLAYER_FEATURES_MATCHES_QUERY),
+            con=db_connection,
+            params={'season': season},
+        )
+        table = features.compute(matches=matches, history=history)
+        db_connection.execute(
+            statement=sqlalchemy.sql.text("""delete from "player_features" where "season" >= :season"""),
+            parameters={'season': season},
+        )
+        backend.bulk_insert(
+            table_name='player_features', table=ETL._prepare_for_load(table), connection=db_connection,
+        )
+    logger.info(
+        "refreshed player_features from season %d (%d rows) in %.3fs",
+        season, len(table), time.perf_counter() - start_time,
+    )
+
+
+# values of a db table column that exist among the given values
+def _select_existing(
+    connection: sqlalchemy.Connection,
+    table_name: str,
+    column: str,
+    values: list,
+) -> pd.Index:
+    if ETL.warehouse is not None:
+        return ETL.warehouse.select_existing(table_name=table_name, column=column, values=values)
+    return backend.select_in(connection=connection, table_name=table_name, column=column, values=values)
+
+# increment the data version of the given seasons
+def bump_data_version(seasons: list[int], connection: sqlalchemy.Connection) -> None:
+    query = sqlalchemy.sql.text(
+        """
+        insert into data_version (season, version, updated_at)
+        values (:season, 1, current_timestamp)
+        on conflict (season) do update set
+            version     = data_version.version + 1,
+            updated_at  = excluded.updated_at
+        """
+    )
+    connection.execute(statement=query, parameters=[{'season': season} for season in seasons])
+
+
+# source hash of every completed stage, as {season: {stage: source_hash}}
+def completed_stages(seasons: list[int]) -> dict[int, dict[str, str]]:
+    query = sqlalchemy.sql.text(
+        """
+        select season, stage, source_hash from load_state
+        where status = 'completed' and season in :seasons
+        """
+    ).bindparams(sqlalchemy.bindparam('seasons', expanding=True))
+    completed = {}
+    with backend.get_engine().connect() as db_connection:
+        for season, stage, source_hash in db_connection.execute(query, {'seasons': seasons}):
+            completed.setdefault(season, {})[stage] = source_hash
+    return completed
+
+
+# set class level switches in pool worker processes
+def _initialize_worker(offline: bool, compact: bool) -> None:
+    DataSource.offline = offline
+    ATP.compact = compact
+    # measurements of the workers reach the sinks through the parent process
+    instrumentation.collector.sinks = []
+
+
+# extract a season once and transform it for every ETL class whose stage
+# has not already been completed from the same source file;
+# cross-season tables are always extracted and left for the caller to combine
+def transform_season(
+    season: int,
+    completed: dict[str, str] | None = None,
+    etl_classes: tuple[type[ETL], ...] = DIMENSIONS + FACTS,
+    content_hash: str | None = None,
+) -> list[ETL]:
+    completed = completed or {}
+    atp_source = ATP(season=season)
+    # a known content hash reads the prefetched parse without downloading again
+    atp_source.content_hash = content_hash
+    if content_hash is None:
+        # reading the table sets the content hash of the source file
+        atp_source.table
+    etls = []
+    for etl_class in etl_classes:
+        if etl_class.cross_season:
+            etls.append(etl_class(source=atp_source).extract())
+        elif completed.get(etl_class.__name__) != atp_source.content_hash:
+            etls.append(etl_class(source=atp_source).extract().transform())
+    # release the shared source frame so only transformed tables are sent back
+    atp_source._table = None
+    return etls
+
+
+# measurements of the steps of ETL instances and of the downloads of their sources, once per source
+def _step_metrics(etls) -> list[instrumentation.StepMetrics]:
+    records = []
+    sources = {}
+    for etl in etls:
+        records += etl.metrics
+        for source in etl.source.parts():
+            sources[id(source)] = source
+    for source in sources.values():
+        records += source.metrics
+    return records
+
+
+# mark stages as running before loading, so a crashed run shows where it stopped
+def _mark_running(etls: list[ETL]) -> None:
+    # a warehouse keeps no load state
+    if ETL.warehouse is not None:
+        return
+    with backend.begin() as db_connection:
+        for etl in etls:
+            etl.record_state(connection=db_connection, status='running')
+
+
+# extract and transform seasons in parallel, build cross-season tables once,
+# then load in dimension-then-fact order;
+# stages completed from an unchanged source file are skipped unless forced
+def run(
+    seasons: list[int],
+    workers: int | None = None,
+    offline: bool = False,
+    load_mode: str = 'replace',
+    force: bool = False,
+) -> None:
+    ETL.load_mode = load_mode
+    completed = {} if force or ETL.warehouse is not None else completed_stages(seasons)
+    # download changed season files concurrently before fanning out to the workers
+    hashes = {} if offline else ATP.prefetch(seasons)
+    fact_etls = []
+    # seasons whose facts were loaded within the loop, in upsert and swap mode
+    merged_seasons = []
+    # loaded dimensions, whose changed rows may show in the facts of other seasons
+    dimension_etls = []
+    # seasons whose facts replaced dimension rows cascaded into
+    cascaded_seasons = set()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_initialize_worker,
+        initargs=(offline, ATP.compact),
+    ) as executor:
+        results = dict(zip(seasons, executor.map(
+            transform_season,
+            seasons,
+            [completed.get(season) for season in seasons],
+            [DIMENSIONS + FACTS] * len(seasons),
+            [hashes.get(season) for season in seasons],
+        )))
+        instrumentation.collector.absorb(_step_metrics(etl for etls in results.values() for etl in etls))
+        # facts reference the cross-season dimensions, so those are loaded first
+        for etl_class in DIMENSIONS:
+            if not etl_class.cross_season:
+                continue
+            parts = [etl for etls in results.values() for etl in etls if isinstance(etl, etl_class)]
+            if all(
+                completed.get(etl.source.season, {}).get(etl_class.__name__) == etl.source.content_hash
+                for etl in parts
+            ):
+                logger.info("%s is up to date, skipped", etl_class.table_name)
+                continue
+            etl = etl_class.combine(parts).transform()
+            _mark_running([etl])
+            etl.load()
+            dimension_etls.append(etl)
+        for season, etls in results.items():
+            etls = [etl for etl in etls if not type(etl).cross_season]
+            if not etls:
+                logger.info("season %d is up to date, skipped", season)
+                continue
+            _mark_running(etls)
+            if load_mode in ('upsert', 'swap'):
+                with begin() as db_connection:
+                    for etl in etls:
+                        etl.load(connection=db_connection)
+                    refresh_match_facts(seasons=[season], connection=db_connection)
+                merged_seasons.append(season)
+                dimension_etls.extend(etl for etl in etls if isinstance(etl, DIMENSIONS))
+                continue
+            for etl in etls:
+                if isinstance(etl, DIMENSIONS):
+                    etl.load()
+                    dimension_etls.append(etl)
+                    cascaded_seasons |= etl.cascaded_seasons
+                else:
+                    fact_etls.append(etl)
+        if cascaded_seasons:
+            # replaced dimension rows cascaded into the facts of skipped seasons as well
+            pending = {(etl.source.season, type(etl)) for etl in fact_etls}
+            reloads = {
+                season: tuple(
+                    fact_class for fact_class in FACTS
+                    if (season, fact_class) not in pending
+                )
+                for season in sorted(cascaded_seasons)
+            }
+            reloads = {season: fact_classes for season, fact_classes in reloads.items() if fact_classes}
+            for etls in executor.map(
+                transform_season,
+                reloads.keys(),
+                [None] * len(reloads),
+                reloads.values(),
+                [hashes.get(season) for season in reloads],
+            ):
+                instrumentation.collector.absorb(_step_metrics(etls))
+                _mark_running(etls)
+                fact_etls.extend(etls)
+    # sort facts by class so each table is loaded season by season
+    for fact_class in FACTS:
+        for etl in fact_etls:
+            if isinstance(etl, fact_class):
+                etl.load()
+    refresh_match_facts(seasons=sorted({etl.source.season for etl in fact_etls}))
+    loaded_seasons = [etl.source.season for etl in fact_etls] + merged_seasons
+    refresh_referencing_seasons(etls=dimension_etls, refreshed_seasons=loaded_seasons)
+    if loaded_seasons:
+        refresh_player_features(season=min(loaded_seasons))
+
+
+# push a season through extract, transform and load chunk by chunk in a single read,
+# return the streamed ETL instances
+def stream_season(
+    source: DataSource,
+    chunksize: int,
+    etl_classes: tuple[type[ETL], ...] = DIMENSIONS + FACTS,
+    connection: sqlalchemy.Connection | None = None,
+) -> list[ETL]:
+    with begin(connection) as db_connection:
+        etls = [etl_class(source=source) for etl_class in etl_classes]
+        for etl in etls:
+            etl.open_stream(connection=db_connection)
+        for chunk in source.chunks(chunksize=chunksize):
+            for etl in etls:
+                etl.load_chunk(chunk, connection=db_connection)
+        for etl in etls:
+            etl.close_stream(connection=db_connection)
+    return etls
+
+
+# stream seasons with memory bounded by the chunk size instead of the file size;
+# cross-season dimensions are built once from the rows of every season like in run,
+# and stages completed from an unchanged source file are skipped unless forced
+def run_streaming(
+    seasons: list[int],
+    chunksize: int,
+    offline: bool = False,
+    load_mode: str = 'replace',
+    force: bool = False,
+) -> None:
+    ETL.load_mode = load_mode
+    DataSource.offline = offline
+    completed = {} if force or ETL.warehouse is not None else completed_stages(seasons)
+    sources = {season: ATP(season=season) for season in seasons}
+    for source in sources.values():
+        # an unchanged file is read back from its cached parse when there is one
+        source.content_hash = source.known_hash()
+
+    # stages of a season whose source file changed since they completed
+    def stale_stages(season: int, etl_classes: tuple[type[ETL], ...]) -> tuple[type[ETL], ...]:
+        content_hash = sources[season].content_hash
+        return tuple(
+            etl_class for etl_class in etl_classes
+            if content_hash is None or completed.get(season, {}).get(etl_class.__name__) != content_hash
+        )
+
+    dimension_etls = []
+    # facts reference the cross-season dimensions, so those are loaded first
+    cross_season = tuple(etl_class for etl_class in DIMENSIONS if etl_class.cross_season)
+    stale = tuple(
+        etl_class for etl_class in cross_season
+        if any(stale_stages(season, (etl_class,)) for season in seasons)
+    )
+    for etl_class in cross_season:
+        if etl_class not in stale:
+            logger.info("%s is up to date, skipped", etl_class.table_name)
+    if stale:
+        dimension_etls += stream_season(
+            source=Seasons(parents=list(sources.values())), chunksize=chunksize, etl_classes=stale,
+        )
+    season_dimensions = tuple(etl_class for etl_class in DIMENSIONS if not etl_class.cross_season)
+    loaded_seasons = []
+    if load_mode in ('upsert', 'swap'):
+        for season in seasons:
+            etl_classes = stale_stages(season, season_dimensions + FACTS)
+            if not etl_classes:
+                logger.info("season %d is up to date, skipped", season)
+                continue
+            with begin() as db_connection:
+                etls = stream_season(
+                    source=sources[season], chunksize=chunksize, etl_classes=etl_classes, connection=db_connection,
+                )
+                refresh_match_facts(seasons=[season], connection=db_connection)
+            dimension_etls.extend(etl for etl in etls if isinstance(etl, DIMENSIONS))
+            loaded_seasons.append(season)
+    else:
+        # dimensions of all seasons first, then facts, reading each source again
+        fact_stages = {}
+        for season in seasons:
+            etl_classes = stale_stages(season, season_dimensions)
+            if etl_classes:
+                dimension_etls += stream_season(source=sources[season], chunksize=chunksize, etl_classes=etl_classes)
+            fact_stages[season] = stale_stages(season, FACTS)
+        # replaced dimension rows cascaded into the facts of these seasons as well
+        for season in set().union(*[etl.cascaded_seasons for etl in dimension_etls]):
+            if season not in sources:
+                sources[season] = ATP(season=season)
+                sources[season].content_hash = sources[season].known_hash()
+            fact_stages[season] = FACTS
+        for season, etl_classes in sorted(fact_stages.items()):
+            if not etl_classes:
+                logger.info("season %d is up to date, skipped", season)
+                continue
+            stream_season(source=sources[season], chunksize=chunksize, etl_classes=etl_classes)
+            loaded_seasons.append(season)
+        if loaded_seasons:
+            refresh_match_facts(seasons=loaded_seasons)
+    refresh_referencing_seasons(etls=dimension_etls, refreshed_seasons=loaded_seasons)
+    if loaded_seasons:
+        refresh_player_features(season=min(loaded_seasons))
+
+
+# command line entry point
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='ATP ETL pipeline')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='extract, transform and load seasons')
+    run_parser.add_argument('--seasons', type=parse_seasons, default=parse_seasons('1991-2023'))
+    run_parser.add_argument('--workers', type=int, default=None, help='process pool size')
+    run_parser.add_argument('--offline', action='store_true', help='read seasons from the local cache only')
+    run_parser.add_argument('--load-mode', choices=['replace', 'upsert', 'swap'], default='replace')
+    run_parser.add_argument('--force', action='store_true', help='reprocess seasons with unchanged source files')
+    run_parser.add_argument('--chunksize', type=int, default=None, help='stream each season in chunks of this many rows')
+    run_parser.add_argument('--compact', action='store_true', help='parse seasons with the compact schema')
+    run_parser.add_argument('--metrics-log', action='store_true', help='log the measurements of every step as json')
+    run_parser.add_argument('--prometheus', type=pathlib.Path, default=None, help='write step totals to this prometheus text file')
+    run_parser.add_argument('--warehouse', type=pathlib.Path, default=None, help='load into a parquet warehouse in this directory instead of the database')
+    run_parser.add_argument('--database-url', default=None, help='database to load, e.g. sqlite:///atp.sqlite (see backend.py)')
+    args = parser.parse_args(argv)
+    ATP.compact = args.compact
+    if args.database_url is not None:
+        backend.configure(url=args.database_url)
+    if args.warehouse is not None:
+        # duckdb is only imported by the warehouse target
+        import warehouse
+        ETL.warehouse = warehouse.Warehouse(directory=args.warehouse)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.metrics_log:
+        instrumentation.collector.sinks.append(instrumentation.JSONLogSink())
+    if args.prometheus is not None:
+        instrumentation.collector.sinks.append(instrumentation.PrometheusSink(path=args.prometheus))
+    instrumentation.collector.reset()
+    if args.command == 'run' and args.chunksize:
+        run_streaming(
+            seasons=args.seasons,
+            chunksize=args.chunksize,
+            offline=args.offline,
+            load_mode=args.load_mode,
+            force=args.force,
+        )
+    elif args.command == 'run':
+        run(
+            seasons=args.seasons,
+            workers=args.workers,
+            offline=args.offline,
+            load_mode=args.load_mode,
+            force=args.force,
+        )
+    instrumentation.collector.close()
+    logger.info("run summary:\n%s", instrumentation.collector.summary().to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+
+# most sets of a match, best of five
+MAX_SETS = 5
+
+# one set of a score, from the point of view of the match winner: games like "6-4",
+# games with the tiebreak points of the tiebreak loser like "7-6(4)" or "7-6(10-8)",
+# or a match tiebreak played instead of a deciding set like "[10-8]"
+SET_PATTERN = (
+    r'(?P<winner_games>\d+)-(?P<loser_games>\d+)'
+    r'(?:\((?P<tiebreak>\d+)(?:-(?P<tiebreak_other>\d+))?\))?'
+    r'|\[(?P<match_tiebreak_winner>\d+)-(?P<match_tiebreak_loser>\d+)\]'
+)
+
+# flags of matches that did not end by being played out: (column, pattern), matched
+# ignoring case, with the short codes and the long forms of the files
+FLAG_PATTERNS = {
+    'retired'   : r'\bRET\b|\bRetired\b',
+    'walkover'  : r'W/O|\bWalkover\b',
+    'defaulted' : r'\bDEF\b|\bDef\.|\bDefault(?:ed)?\b',
+    'unfinished': r'unfinished|\bABN\b|\bABD\b|\bAbandoned\b|\bIn Progress\b',
+}
+
+# columns added to a frame by parse, in table order
+COLUMNS = [
+    *[
+        f'set{number}_{column}'
+        for number in range(1, MAX_SETS + 1)
+        for column in ('winner_games', 'loser_games', 'tiebreak')
+    ],
+    'sets_played', 'winner_sets', 'loser_sets', 'winner_games', 'loser_games', 'total_games',
+    'match_tiebreak', *FLAG_PATTERNS,
+]
+
+
+# parse scores like "7-6(4) 3-6 6-4 RET" into per set games and tiebreak points,
+# set and game totals and flags, without a python loop over the rows;
+# set<n>_tiebreak holds the points of the player who lost the tiebreak of set n,
+# totals are missing for matches without a played set, e.g. walkovers
+def parse(score: pd.Series) -> pd.DataFrame:
+    # most scores repeat across matches, so every distinct score is parsed once
+    codes, distinct = pd.factorize(score.astype('string'))
+    # missing scores take the row parsed from a trailing missing value
+    table = _parse_distinct(pd.Series(distinct, dtype='string').reindex(range(len(distinct) + 1)))
+    codes = np.where(codes < 0, len(distinct), codes)
+    return table.iloc[codes].set_axis(score.index)
+
+
+# parse every score of a series, see parse
+def _parse_distinct(score: pd.Series) -> pd.DataFrame:
+    sets = score.str.extractall(SET_PATTERN).astype('Int64')
+    # a match tiebreak counts as a set won 1-0
+    is_match_tiebreak = sets['match_tiebreak_winner'].notna()
+    match_tiebreak_won = (sets['match_tiebreak_winner'] > sets['match_tiebreak_loser']).astype('Int64')
+    winner_games = sets['winner_games'].mask(is_match_tiebreak, match_tiebreak_won)
+    loser_games = sets['loser_games'].mask(is_match_tiebreak, 1 - match_tiebreak_won)
+    tiebreak = sets['tiebreak'].mask(
+        sets['tiebreak_other'].notna(), np.minimum(sets['tiebreak'], sets['tiebreak_other'])
+    ).mask(is_match_tiebreak, np.minimum(sets['match_tiebreak_winner'], sets['match_tiebreak_loser']))
+    # a set counts when it reached six games with a two game lead, or went to a tiebreak
+    # (7-6, with or without its points); the last set of a retirement usually did neither
+    high = np.maximum(winner_games, loser_games)
+    low = np.minimum(winner_games, loser_games)
+    completed = ((high >= 6) & (high - low >= 2)) | ((high == 7) & (low == 6)) | tiebreak.notna()
+
+    per_set = pd.DataFrame({
+        'winner_games'  : winner_games,
+        'loser_games'   : loser_games,
+        'tiebreak'      : tiebreak,
+    }).unstack('match')
+    table = pd.DataFrame(index=score.index)
+    for number in range(1, MAX_SETS + 1):
+        for column in ('winner_games', 'loser_games', 'tiebreak'):
+            values = per_set[(column, number - 1)] if (column, number - 1) in per_set.columns else None
+            table[f'set{number}_{column}'] = pd.Series(values, index=per_set.index, dtype='Int64').reindex(score.index)
+
+    # every set of the score was played, the unfinished one of a retirement too,
+    # but only completed sets are won
+    totals = pd.DataFrame({
+        'sets_played'   : pd.Series(1, index=completed.index),
+        'winner_sets'   : (completed & (winner_games > loser_games)).astype(int),
+        'loser_sets'    : (completed & (winner_games < loser_games)).astype(int),
+        'winner_games'  : winner_games,
+        'loser_games'   : loser_games,
+        # also "1-0(8)", a match tiebreak written as a set
+        'match_tiebreak': is_match_tiebreak | (completed & (high == 1)),
+    }).groupby(level=0).agg({
+        'sets_played'   : 'sum',
+        'winner_sets'   : 'sum',
+        'loser_sets'    : 'sum',
+        'winner_games'  : 'sum',
+        'loser_games'   : 'sum',
+        'match_tiebreak': 'any',
+    }).reindex(score.index)
+    for column in ('sets_played', 'winner_sets', 'loser_sets', 'winner_games', 'loser_games'):
+        table[column] = totals[column].astype('Int64')
+    table['total_games'] = table['winner_games'] + table['loser_games']
+    table['match_tiebreak'] = totals['match_tiebreak'].fillna(False).astype(bool)
+    for column, pattern in FLAG_PATTERNS.items():
+        table[column] = score.str.contains(pattern, case=False, regex=True).fillna(False).astype(bool)
+    return table[COLUMNS]
@@ -0,0 +1,86 @@
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+import backend
+import pipeline
+
+
+SCHEMA = pathlib.Path(__file__).resolve().parent.parent / 'create_sqlite.sql'
+
+
+@pytest.fixture
+def connection(tmp_path):
+    engine = backend.create_engine(f"sqlite:///{tmp_path / 'atp.sqlite'}")
+    with engine.begin() as db_connection:
+        db_connection.connection.driver_connection.executescript(SCHEMA.read_text())
+        yield db_connection
+    engine.dispose()
+
+
+# tournaments as read from a season file, with the dates as text like "19910101"
+def tournaments(dates):
+    return pd.DataFrame({
+        'tourney_id'    : [f'1991-{number:03d}' for number in range(len(dates))],
+        'tourney_name'  : [f'Open {number}' for number in range(len(dates))],
+        'tourney_level' : 'A',
+        'tourney_date'  : pd.Series(dates, dtype='object'),
+        'surface'       : 'Hard',
+        'draw_size'     : 32,
+    })
+
+
+def test_dates_round_trip_through_sqlite_as_iso_text(connection):
+    table = pipeline.ETL._prepare_for_load(tournaments(['19910101', '19911230', None]))
+    backend.bulk_insert(table_name='tournaments', table=table, connection=connection)
+    rows = connection.exec_driver_sql(
+        'select "tourney_date", typeof("tourney_date") from "tournaments" order by "tourney_id"'
+    ).all()
+    assert rows == [('1991-01-01', 'text'), ('1991-12-30', 'text'), (None, 'null')]
+    assert pd.to_datetime([date for date, _ in rows]).year.dropna().tolist() == [1991, 1991]
+
+
+def test_dates_compare_with_iso_date_parameters(connection):
+    table = pipeline.ETL._prepare_for_load(tournaments(['19910101', '19910603', '19920101']))
+    backend.bulk_insert(table_name='tournaments', table=table, connection=connection)
+    earlier = connection.execute(
+        sqlalchemy.sql.text('select count(*) from "tournaments" where "tourney_date" <= :date'),
+        {'date': '1991-06-03'},
+    ).scalar()
+    assert earlier == 2
+
+
+def test_staged_merge_keeps_unchanged_dates_unchanged(connection):
+    table = pipeline.ETL._prepare_for_load(tournaments(['19910101', '19910603']))
+    backend.bulk_insert(table_name='tournaments', table=table, connection=connection)
+    columns = list(table.columns)
+    backend.create_stage(connection=connection, stage_name='stage_tournaments', table_name='tournaments', columns=columns)
+    backend.bulk_insert(table_name='stage_tournaments', table=table, connection=connection)
+    changed = backend.changed_keys(
+        connection=connection,
+        stage_name='stage_tournaments',
+        table_name='tournaments',
+        columns=columns,
+        key_columns=('tourney_id',),
+    )
+    assert changed.empty
+
+
+def test_sqlite_statistical_aggregates_match_numpy():
+    engine = backend.create_engine('sqlite://')
+    x = [180.0, 185.0, 190.0, 193.0, 198.0, None, 201.0]
+    y = [4.0, 6.0, 5.0, 9.0, 12.0, 30.0, None]
+    with engine.connect() as db_connection:
+        db_connection.exec_driver_sql('create table "facts" ("x" real, "y" real)')
+        db_connection.exec_driver_sql('insert into "facts" values (?, ?)', list(zip(x, y)))
+        row = db_connection.exec_driver_sql(
+            'select regr_slope("y", "x"), regr_intercept("y", "x"), corr("y", "x"), regr_count("y", "x"), '
+            'regr_slope("y", "x") filter (where "x" > 1000) from "facts"'
+        ).one()
+    engine.dispose()
+    pairs = [(a, b) for a, b in zip(x, y) if a is not None and b is not None]
+    slope, intercept = np.polyfit([a for a, _ in pairs], [b for _, b in pairs], deg=1)
+    correlation = np.corrcoef([a for a, _ in pairs], [b for _, b in pairs])[0, 1]
+    assert row[:3] == pytest.approx((slope, intercept, correlation))
+    assert row[3:] == (5, None)
@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+import pytest
+from cache import FrameCache, QueryCache
+
+
+def frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({'player_id': [str(number) for number in range(rows)], 'rank': range(rows)})
+
+
+# set the last access time of a cache entry, so the order of use does not hinge on clock resolution
+def touch(cache: FrameCache, key: str, when: int) -> None:
+    os.utime(cache.path(key), (when, when))
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'feather'])
+def test_frames_round_trip_and_missing_keys_miss(tmp_path, file_format):
+    cache = FrameCache(directory=tmp_path, max_bytes=10 ** 6, file_format=file_format)
+    assert cache.get('atp-2001-abc') is None
+    cache.put('atp-2001-abc', frame(5))
+    pd.testing.assert_frame_equal(cache.get('atp-2001-abc'), frame(5))
+    chunks = list(cache.iter_chunks('atp-2001-abc', chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+def test_eviction_removes_the_least_recently_used_entries(tmp_path):
+    cache = FrameCache(directory=tmp_path, max_bytes=10 ** 6)
+    for number, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, frame(100))
+        touch(cache, key, 1000 + number)
+    # reading an entry marks it as recently used
+    cache.get('a')
+    cache.max_bytes = cache.path('a').stat().st_size * 2
+    cache.evict()
+    assert [key for key in 'abc' if cache.path(key).exists()] == ['a', 'c']
+    assert cache.size <= cache.max_bytes
+
+
+def test_eviction_keeps_the_latest_entry_over_budget(tmp_path):
+    cache = FrameCache(directory=tmp_path, max_bytes=1)
+    cache.put('a', frame(100))
+    cache.put('b', frame(100))
+    assert cache.get('b') is not None
+    assert cache.get('a') is None
+
+
+def test_latest_picks_the_most_recently_used_key_with_the_prefix(tmp_path):
+    cache = FrameCache(directory=tmp_path, max_bytes=10 ** 6)
+    assert cache.latest('atp-2001-') is None
+    for number, key in enumerate(['atp-2001-old', 'atp-2001-new', 'atp-2002-other']):
+        cache.put(key, frame(1))
+        touch(cache, key, 1000 + number)
+    assert cache.latest('atp-2001-') == 'atp-2001-new'
+
+
+# a link to a missing file is listed like an entry another process removed right after the listing
+def test_entries_removed_by_another_process_are_skipped(tmp_path):
+    cache = FrameCache(directory=tmp_path, max_bytes=1)
+    cache.put('a', frame(10))
+    size = cache.size
+    os.symlink(tmp_path / 'gone.parquet', cache.path('atp-2001-vanished'))
+    assert cache.size == size
+    assert cache.latest('atp-2001-') is None
+    assert cache.get('atp-2001-vanished') is None
+    cache.put('b', frame(10))
+    assert cache.get('b') is not None
+
+
+def test_query_keys_ignore_layout_but_not_literals_or_sources():
+    key = QueryCache.key('select *\n  from "matches" where "surface" = \'Hard\'', None, 3, 'sqlite:atp')
+    assert key == QueryCache.key('select * from "matches"   where "surface" = \'Hard\'', None, 3, 'sqlite:atp')
+    assert key != QueryCache.key('select * from "matches" where "surface" = \'Hard \'', None, 3, 'sqlite:atp')
+    assert key != QueryCache.key('select * from "matches" where "surface" = \'Hard\'', None, 4, 'sqlite:atp')
+    assert key != QueryCache.key('select * from "matches" where "surface" = \'Hard\'', None, 3, 'sqlite:other')
+    assert key != QueryCache.key('select * from "matches" where "surface" = \'Hard\'', {'x': 1}, 3, 'sqlite:atp')
+
+
+def test_query_results_count_hits_and_misses(tmp_path):
+    cache = QueryCache(directory=tmp_path, max_bytes=10 ** 6)
+    key = QueryCache.key('select 1', None, 1, 'sqlite:atp')
+    assert cache.get(key) is None
+    cache.put(key, frame(3))
+    pd.testing.assert_frame_equal(cache.get(key), frame(3))
+    stats = cache.stats
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+    assert stats['bytes'] > 0
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+import features
+
+
+# matches among a few players in one season, in match order, some without stats
+def matches(count: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    winners = rng.integers(0, 6, count)
+    losers = (winners + rng.integers(1, 6, count)) % 6
+    table = pd.DataFrame({
+        'season'        : 2001,
+        'tourney_id'    : [f'2001-{number // 8:03d}' for number in range(count)],
+        'match_num'     : np.arange(count),
+        'winner_id'     : [f'1000{code}' for code in winners],
+        'loser_id'      : [f'1000{code}' for code in losers],
+        'tourney_date'  : pd.Timestamp('2001-01-01') + pd.to_timedelta(np.arange(count) // 8 * 7, unit='D'),
+    })
+    for side in ('winner', 'loser'):
+        serve_points = rng.integers(40, 120, count)
+        first_in = rng.binomial(serve_points, 0.6)
+        first_won = rng.binomial(first_in, 0.7)
+        columns = {
+            'aces'              : rng.integers(0, 20, count),
+            'service_games'     : serve_points // 6,
+            'serve_points'      : serve_points,
+            'first_serve_in'    : first_in,
+            'first_serve_won'   : first_won,
+            'second_serve_won'  : rng.binomial(serve_points - first_in, 0.5),
+            'break_points_saved': rng.integers(0, 4, count),
+            'break_points_faced': rng.integers(4, 8, count),
+        }
+        for column, values in columns.items():
+            table[f'{side}_{column}'] = pd.array(values, dtype='Int64')
+    table.loc[table.index % 7 == 3, 'winner_aces'] = pd.NA
+    return table
+
+
+def empty_history() -> pd.DataFrame:
+    return pd.DataFrame(columns=features.COLUMNS)
+
+
+def test_ratings_match_a_match_by_match_update():
+    table = matches(200)
+    codes = {player_id: code for code, player_id in enumerate(sorted(set(table['winner_id']) | set(table['loser_id'])))}
+    winner_codes = table['winner_id'].map(codes).to_numpy()
+    loser_codes = table['loser_id'].map(codes).to_numpy()
+    result = features.ratings(winner_codes, loser_codes, np.full(len(codes), 1500.0), np.zeros(len(codes)))
+    rating, count = [1500.0] * len(codes), [0] * len(codes)
+    for position, (winner, loser) in enumerate(zip(winner_codes, loser_codes)):
+        expected = 1 / (1 + 10 ** ((rating[loser] - rating[winner]) / 400))
+        assert result['winner_before'][position] == pytest.approx(rating[winner])
+        assert result['win_probability'][position] == pytest.approx(expected)
+        rating[winner] += features.K_SCALE / (count[winner] + features.K_OFFSET) ** features.K_SHAPE * (1 - expected)
+        rating[loser] -= features.K_SCALE / (count[loser] + features.K_OFFSET) ** features.K_SHAPE * (1 - expected)
+        count[winner] += 1
+        count[loser] += 1
+        assert result['loser_after'][position] == pytest.approx(rating[loser])
+
+
+def test_rolling_stats_cover_the_previous_window_of_recorded_matches():
+    table = matches(200)
+    result = features.compute(table, empty_history())
+    player = result[result['player_id'] == '10000'].reset_index(drop=True)
+    assert np.isnan(player.loc[0, 'rolling_aces_per_service_game'])
+    assert player['matches_played'].tolist() == list(range(len(player)))
+    for position in range(1, len(player)):
+        window = player.iloc[max(0, position - features.WINDOW):position]
+        recorded = window['aces'].notna()
+        expected = window.loc[recorded, 'aces'].sum() / window.loc[recorded, 'service_games'].sum()
+        assert player.loc[position, 'rolling_aces_per_service_game'] == pytest.approx(expected)
+        expected = window['first_serve_in'].sum() / window['serve_points'].sum()
+        assert player.loc[position, 'rolling_first_serve_pct'] == pytest.approx(expected)
+
+
+def test_features_continue_from_the_history_of_earlier_matches():
+    table = matches(200)
+    whole = features.compute(table, empty_history())
+    earlier = features.compute(table.iloc[:120], empty_history())
+    later = features.compute(table.iloc[120:].reset_index(drop=True), history=earlier)
+    pd.testing.assert_frame_equal(later, whole.iloc[240:].reset_index(drop=True), check_dtype=False)
@@ -0,0 +1,182 @@
+import hashlib
+import http.client
+import http.server
+import threading
+import urllib.error
+import pytest
+from fetcher import Fetcher
+
+
+ETAG = '"season-2023-v1"'
+LAST_MODIFIED = 'Mon, 02 Jan 2023 10:00:00 GMT'
+BODY = b'tourney_id,tourney_name\n2023-001,Brisbane\n'
+LONG_BODY = b''.join(b'2023-%03d,Open %d\n' % (number, number) for number in range(1000))
+
+
+# local stand-in of the data repository: /data answers conditional requests,
+# /flaky fails with a 503 a number of times before it succeeds, /missing is a 404,
+# /cut sends half the body a number of times before it succeeds, honoring ranges or not
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    # failures left per path, and every request seen as (path, headers)
+    failures = {}
+    requests = []
+    ranges = True
+
+    # implement
+    def do_GET(self):
+        type(self).requests.append((self.path, dict(self.headers)))
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.path == '/cut':
+            self.send_cut()
+            return
+        if type(self).failures.get(self.path, 0) > 0:
+            type(self).failures[self.path] -= 1
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if (
+            self.headers.get('If-None-Match') == ETAG
+            or self.headers.get('If-Modified-Since') == LAST_MODIFIED
+        ):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    # answer with the body from the requested offset, cut short while failures are left
+    def send_cut(self):
+        offset = 0
+        if type(self).ranges and self.headers.get('Range') and self.headers.get('If-Range') == ETAG:
+            offset = int(self.headers['Range'].removeprefix('bytes=').rstrip('-'))
+        body = LONG_BODY[offset:]
+        self.send_response(206 if offset else 200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if type(self).failures.get(self.path, 0) > 0:
+            type(self).failures[self.path] -= 1
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+    # implement: keep the test output quiet
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.failures = {}
+    Handler.requests = []
+    Handler.ranges = True
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+    return Fetcher(state_path=tmp_path / 'validators.json', retries=3, backoff=0)
+
+
+def test_first_download_returns_body_and_validators(server, fetcher):
+    result = fetcher.fetch(f"{server}/data")
+    assert result.raw == BODY
+    assert result.etag == ETAG
+    assert result.last_modified == LAST_MODIFIED
+
+
+def test_unchanged_file_answers_304_with_remembered_hash(server, fetcher):
+    fetcher.remember(fetcher.fetch(f"{server}/data"), content_hash='abc')
+    result = fetcher.fetch(f"{server}/data")
+    assert result.raw is None
+    assert result.content_hash == 'abc'
+    _, headers = Handler.requests[-1]
+    assert headers['If-None-Match'] == ETAG
+    assert headers['If-Modified-Since'] == LAST_MODIFIED
+
+
+def test_validators_persist_between_fetchers(server, fetcher, tmp_path):
+    fetcher.remember(fetcher.fetch(f"{server}/data"), content_hash='abc')
+    result = Fetcher(state_path=tmp_path / 'validators.json').fetch(f"{server}/data")
+    assert result.raw is None
+    assert result.content_hash == 'abc'
+
+
+def test_if_modified_since_alone_answers_304(server, fetcher):
+    fetcher.validators[f"{server}/data"] = {'etag': None, 'last_modified': LAST_MODIFIED, 'content_hash': 'abc'}
+    result = fetcher.fetch(f"{server}/data")
+    assert result.raw is None
+    assert result.content_hash == 'abc'
+
+
+def test_unconditional_fetch_downloads_again(server, fetcher):
+    fetcher.remember(fetcher.fetch(f"{server}/data"), content_hash='abc')
+    assert fetcher.fetch(f"{server}/data", conditional=False).raw == BODY
+
+
+def test_transient_failures_are_retried(server, fetcher):
+    Handler.failures['/flaky'] = 2
+    assert fetcher.fetch(f"{server}/flaky").raw == BODY
+    assert [path for path, _ in Handler.requests] == ['/flaky'] * 3
+
+
+def test_retries_give_up_after_the_limit(server, fetcher):
+    Handler.failures['/flaky'] = 10
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetcher.fetch(f"{server}/flaky")
+    assert error.value.code == 503
+    assert len(Handler.requests) == fetcher.retries + 1
+
+
+def test_permanent_failures_are_not_retried(server, fetcher):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetcher.fetch(f"{server}/missing")
+    assert error.value.code == 404
+    assert len(Handler.requests) == 1
+
+
+def test_stream_hashes_the_body(server, fetcher):
+    with fetcher.stream(f"{server}/data") as reader:
+        assert reader.read() == BODY
+    assert reader.hexdigest() == hashlib.sha256(BODY).hexdigest()
+
+
+def test_bodies_cut_short_are_downloaded_again(server, fetcher):
+    Handler.failures['/cut'] = 2
+    assert fetcher.fetch(f"{server}/cut").raw == LONG_BODY
+    assert len(Handler.requests) == 3
+
+
+@pytest.mark.parametrize('ranges', [True, False])
+def test_stream_resumes_where_the_connection_was_lost(server, fetcher, ranges):
+    Handler.ranges = ranges
+    Handler.failures['/cut'] = 2
+    with fetcher.stream(f"{server}/cut") as reader:
+        assert reader.read() == LONG_BODY
+    assert reader.hexdigest() == hashlib.sha256(LONG_BODY).hexdigest()
+    assert [headers.get('Range') for _, headers in Handler.requests][0] is None
+    assert all(headers['If-Range'] == ETAG for _, headers in Handler.requests[1:])
+    assert len(Handler.requests) == 3
+
+
+# without ranges every attempt is cut before the offset the stream stopped at
+def test_stream_gives_up_after_the_limit(server, fetcher):
+    Handler.ranges = False
+    Handler.failures['/cut'] = 10
+    with pytest.raises(http.client.IncompleteRead):
+        with fetcher.stream(f"{server}/cut") as reader:
+            reader.read()
+    assert len(Handler.requests) == fetcher.retries + 1
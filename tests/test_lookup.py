@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lookup import MatchIndex
+
+
+def index() -> MatchIndex:
+    matches = pd.DataFrame(
+        [
+            (2001, '2001-001', 1, '2001-01-01', 'A', 'B'),
+            (2001, '2001-001', 2, '2001-01-01', 'C', 'D'),
+            (2001, '2001-001', 3, '2001-01-01', 'B', 'C'),
+            (2001, '2001-002', 1, '2001-02-05', 'B', 'A'),
+            (2002, '2002-001', 1, '2002-01-07', 'A', 'C'),
+            (2002, '2002-001', 2, '2002-01-07', 'A', 'B'),
+        ],
+        columns=['season', 'tourney_id', 'match_num', 'tourney_date', 'winner_id', 'loser_id'],
+    )
+    rankings = pd.DataFrame(
+        [
+            ('A', '2001-01-01', 10, 1000),
+            ('A', '2001-02-05', 8, 1200),
+            ('B', '2001-02-05', 30, 500),
+            ('A', '2002-01-07', 3, 3000),
+            # a ranked player without matches
+            ('E', '2001-01-01', 99, 20),
+        ],
+        columns=['player_id', 'tourney_date', 'rank', 'points'],
+    )
+    return MatchIndex.build(matches=matches, rankings=rankings, data_version=[[2001, 2], [2002, 1]])
+
+
+def test_matches_of_a_player_in_match_order():
+    match_index = index()
+    matches = match_index.frame(match_index.player_matches_of('B'))
+    assert matches[['tourney_id', 'match_num']].values.tolist() == [
+        ['2001-001', 1], ['2001-001', 3], ['2001-002', 1], ['2002-001', 2],
+    ]
+    assert len(match_index.player_matches_of('E')) == 0
+    with pytest.raises(KeyError):
+        match_index.player_matches_of('Z')
+
+
+def test_head_to_head_is_symmetric():
+    match_index = index()
+    meetings = match_index.frame(match_index.head_to_head('A', 'B'))
+    assert meetings[['winner_id', 'loser_id']].values.tolist() == [['A', 'B'], ['B', 'A'], ['A', 'B']]
+    assert match_index.head_to_head('B', 'A').tolist() == match_index.head_to_head('A', 'B').tolist()
+    assert len(match_index.head_to_head('A', 'D')) == 0
+
+
+def test_rank_as_of_takes_the_latest_ranking_on_or_before_the_date():
+    match_index = index()
+    assert match_index.rank_as_of('A', '2000-12-31') is None
+    assert match_index.rank_as_of('A', '2001-01-01') == (10.0, 1000.0)
+    assert match_index.rank_as_of('A', '2001-06-30') == (8.0, 1200.0)
+    assert match_index.rank_as_of('A', '2030-01-01') == (3.0, 3000.0)
+    # never the ranking of the player before in code order
+    assert match_index.rank_as_of('B', '2001-01-31') is None
+    assert match_index.rank_as_of('C', '2002-01-07') is None
+
+
+def test_vectorized_ranks_agree_with_single_lookups():
+    match_index = index()
+    player_ids = ['A', 'A', 'B', 'B', 'C', 'E', 'Z']
+    dates = ['2000-12-31', '2001-03-01', '2001-01-31', '2003-01-01', '2002-01-07', '2001-01-01', '2001-01-01']
+    ranks, points = match_index.ranks_as_of(player_ids, dates)
+    for position, (player_id, date) in enumerate(zip(player_ids, dates)):
+        try:
+            expected = match_index.rank_as_of(player_id, date)
+        except KeyError:
+            expected = None
+        if expected is None:
+            assert np.isnan(ranks[position]) and np.isnan(points[position])
+        else:
+            assert (ranks[position], points[position]) == expected
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_snapshots_answer_like_the_built_index(tmp_path, mmap):
+    built = index()
+    built.save(tmp_path / 'lookup.idx')
+    loaded = MatchIndex.load(tmp_path / 'lookup.idx', mmap=mmap)
+    for name in MatchIndex.array_names:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(built, name))
+    assert isinstance(loaded.rank_keys.base, np.memmap) == mmap
+    assert loaded.data_version == [[2001, 2], [2002, 1]]
+    pd.testing.assert_frame_equal(loaded.frame(loaded.head_to_head('A', 'B')), built.frame(built.head_to_head('A', 'B')))
+    assert loaded.rank_as_of('A', '2001-06-30') == (8.0, 1200.0)
+
+
+def test_loading_another_file_fails(tmp_path):
+    (tmp_path / 'other.idx').write_bytes(b'not an index')
+    with pytest.raises(ValueError):
+        MatchIndex.load(tmp_path / 'other.idx')
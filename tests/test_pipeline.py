@@ -0,0 +1,159 @@
+import functools
+import http.server
+import pathlib
+import threading
+import pandas as pd
+import pytest
+import backend
+import pipeline
+from cache import FrameCache
+from fetcher import Fetcher
+
+
+SCHEMA = pathlib.Path(__file__).resolve().parent.parent / 'create_sqlite.sql'
+SEASONS = [2001, 2002]
+PLAYERS = [f'1000{number:02d}' for number in range(10)]
+
+
+# a season file of 40 matches in 4 tournaments, in which players change their name,
+# lose their height and gain a year of age halfway through the last season
+def season_file(season: int) -> pd.DataFrame:
+    rows = []
+    for number in range(40):
+        winner, loser = PLAYERS[number % 10], PLAYERS[(number * 3 + 1) % 10]
+        month = number // 10 + 1
+        row = {
+            'tourney_id'        : f'{season}-{month:03d}',
+            'tourney_name'      : f'Open {month}',
+            'surface'           : 'Hard',
+            'draw_size'         : 32,
+            'tourney_level'     : 'A',
+            'tourney_date'      : f'{season}{month:02d}01',
+            'match_num'         : number,
+        }
+        for side, player_id in (('winner', winner), ('loser', loser)):
+            index = PLAYERS.index(player_id)
+            late = season == SEASONS[-1] and number >= 20
+            row.update({
+                f'{side}_id'    : player_id,
+                f'{side}_seed'  : None,
+                f'{side}_entry' : None,
+                f'{side}_name'  : f'Player {index}' + (' Jr' if late else ''),
+                f'{side}_hand'  : 'L' if index % 3 == 0 else 'R',
+                f'{side}_ht'    : None if late else 180 + index,
+                f'{side}_ioc'   : 'USA',
+                f'{side}_age'   : season - 1975 - index + (month - 1) / 12 + (0.9 if number % 7 == 0 else 0.1) + late,
+            })
+        row.update({'score': '6-4 6-4', 'best_of': 3, 'round': 'R32', 'minutes': 80})
+        for prefix in ('w', 'l'):
+            for column in ('ace', 'df', 'svpt', '1stIn', '1stWon', '2ndWon', 'SvGms', 'bpSaved', 'bpFaced'):
+                row[f'{prefix}_{column}'] = number % 9
+        row.update({
+            'winner_rank'       : number + 1,
+            'winner_rank_points': 1000 - number,
+            'loser_rank'        : number + 50,
+            'loser_rank_points' : 500 - number,
+        })
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def repository(tmp_path):
+    directory = tmp_path / 'repository'
+    directory.mkdir()
+    for season in SEASONS:
+        season_file(season).to_csv(directory / f'atp_matches_{season}.csv', index=False)
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=directory)
+    handler.log_message = lambda *args: None
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+# point the pipeline at a fresh sqlite database, cache and quarantine in the given directory
+@pytest.fixture
+def target(monkeypatch, repository):
+    def use(directory: pathlib.Path) -> None:
+        directory.mkdir()
+        engine = backend.create_engine(f"sqlite:///{directory / 'atp.sqlite'}")
+        with engine.begin() as db_connection:
+            db_connection.connection.driver_connection.executescript(SCHEMA.read_text())
+        backend.configure(engine=engine)
+        monkeypatch.setattr(pipeline.DataSource, 'cache', FrameCache(directory=directory / 'cache', max_bytes=10 ** 8))
+        monkeypatch.setattr(pipeline.DataSource, 'fetcher', Fetcher(state_path=directory / 'validators.json'))
+        monkeypatch.setattr(pipeline.ETL, 'reference_keys', {})
+        monkeypatch.setattr(pipeline, 'QUARANTINE_DIR', directory / 'quarantine')
+
+    monkeypatch.setattr(pipeline, 'DATA_REPO', repository)
+    monkeypatch.setattr(pipeline.ETL, 'load_mode', pipeline.ETL.load_mode)
+    monkeypatch.setattr(backend, 'engine', None)
+    yield use
+    backend.configure()
+
+
+def read_table(table_name: str) -> pd.DataFrame:
+    table = pd.read_sql(f'select * from "{table_name}"', backend.get_engine())
+    return table.sort_values(by=list(table.columns[:1])).reset_index(drop=True)
+
+
+def data_version() -> list:
+    return pd.read_sql('select "season", "version" from "data_version"', backend.get_engine()).values.tolist()
+
+
+@pytest.mark.parametrize('load_mode', ['replace', 'upsert'])
+def test_streaming_builds_the_dimension_tables_of_a_batch_load(target, tmp_path, load_mode):
+    target(tmp_path / 'batch')
+    pipeline.run(seasons=SEASONS, workers=1, load_mode=load_mode)
+    batch = {table_name: read_table(table_name) for table_name in ('players', 'tournaments')}
+    target(tmp_path / 'stream')
+    pipeline.run_streaming(seasons=SEASONS, chunksize=15, load_mode=load_mode)
+    for table_name, table in batch.items():
+        pd.testing.assert_frame_equal(read_table(table_name), table)
+    players = batch['players'].set_index('player_id')
+    assert players.loc[PLAYERS[0], 'name'] == 'Player 0 Jr'
+    assert players.loc[PLAYERS[0], 'height'] == 180
+
+
+def test_streaming_skips_unchanged_seasons_unless_forced(target, tmp_path):
+    target(tmp_path / 'stream')
+    pipeline.run_streaming(seasons=SEASONS, chunksize=15, load_mode='upsert')
+    versions = data_version()
+    pipeline.run_streaming(seasons=SEASONS, chunksize=15, load_mode='upsert')
+    assert data_version() == versions
+    pipeline.run_streaming(seasons=SEASONS, chunksize=15, load_mode='upsert', force=True)
+    assert data_version() != versions
+
+
+@pytest.mark.parametrize('load_mode', ['replace', 'upsert'])
+def test_birth_years_from_more_appearances_replace_earlier_estimates(target, tmp_path, load_mode):
+    target(tmp_path / 'all')
+    pipeline.run(seasons=SEASONS, workers=1, load_mode=load_mode)
+    expected = read_table('players')
+    target(tmp_path / 'growing')
+    pipeline.run(seasons=SEASONS[-1:], workers=1, load_mode=load_mode)
+    partial = read_table('players')
+    pipeline.run(seasons=SEASONS, workers=1, load_mode=load_mode, force=True)
+    pd.testing.assert_frame_equal(read_table('players'), expected)
+    assert (partial['birth_year'] < expected['birth_year']).all()
+    assert (partial['birth_year_appearances'] < expected['birth_year_appearances']).all()
+    # a later load of fewer seasons keeps the estimate of the wider one
+    pipeline.run(seasons=SEASONS[:1], workers=1, load_mode=load_mode, force=True)
+    pd.testing.assert_frame_equal(read_table('players')[['player_id', 'birth_year', 'birth_year_appearances']],
+                                  expected[['player_id', 'birth_year', 'birth_year_appearances']])
+
+
+def test_rows_breaking_constraints_are_quarantined_and_the_rest_loaded(target, tmp_path):
+    table = season_file(2003)
+    table.loc[5, 'winner_id'] = None
+    table.to_csv(tmp_path / 'repository' / 'atp_matches_2003.csv', index=False)
+    target(tmp_path / 'load')
+    pipeline.run(seasons=[2003], workers=1)
+    assert len(read_table('matches')) == 39
+    quarantined = pd.read_csv(tmp_path / 'load' / 'quarantine' / 'matches.csv', dtype=str)
+    assert quarantined[['match_num', 'reason', 'stage', 'source_seasons']].values.tolist() == [
+        ['5', 'winner_id is null', 'Matches', '2003'],
+    ]
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+import scores
+
+
+# parse one score into a row of plain values
+def parse_one(score):
+    row = scores.parse(pd.Series([score], dtype='object')).iloc[0]
+    return {column: (None if pd.isna(value) else value) for column, value in row.items()}
+
+
+# flags a score sets, by column
+def flags(row):
+    return {column for column in scores.FLAG_PATTERNS if row[column]}
+
+
+def test_completed_match():
+    row = parse_one('6-3 4-6 6-2')
+    assert [row['set1_winner_games'], row['set1_loser_games']] == [6, 3]
+    assert [row['set2_winner_games'], row['set2_loser_games']] == [4, 6]
+    assert row['set4_winner_games'] is None
+    assert [row['sets_played'], row['winner_sets'], row['loser_sets']] == [3, 2, 1]
+    assert [row['winner_games'], row['loser_games'], row['total_games']] == [16, 11, 27]
+    assert not row['match_tiebreak']
+    assert flags(row) == set()
+
+
+def test_tiebreak_sets_keep_the_points_of_the_tiebreak_loser():
+    row = parse_one('7-6(4) 6-7(10-8) 7-6(12)')
+    assert [row['set1_tiebreak'], row['set2_tiebreak'], row['set3_tiebreak']] == [4, 8, 12]
+    assert [row['set2_winner_games'], row['set2_loser_games']] == [6, 7]
+    assert [row['winner_sets'], row['loser_sets']] == [2, 1]
+    assert not row['match_tiebreak']
+
+
+def test_super_tiebreak_counts_as_a_set_won_one_nil():
+    row = parse_one('6-4 3-6 [10-8]')
+    assert [row['set3_winner_games'], row['set3_loser_games'], row['set3_tiebreak']] == [1, 0, 8]
+    assert [row['sets_played'], row['winner_sets'], row['loser_sets']] == [3, 2, 1]
+    assert row['total_games'] == 20
+    assert row['match_tiebreak']
+
+
+def test_match_tiebreak_written_as_a_set():
+    assert parse_one('6-4 3-6 1-0(8)')['match_tiebreak']
+
+
+def test_retirement_plays_the_unfinished_set_but_leaves_it_unwon():
+    row = parse_one('6-4 2-1 RET')
+    assert [row['set2_winner_games'], row['set2_loser_games']] == [2, 1]
+    assert [row['sets_played'], row['winner_sets'], row['loser_sets']] == [2, 1, 0]
+    assert flags(row) == {'retired'}
+
+
+def test_walkover_has_no_sets():
+    row = parse_one('W/O')
+    assert row['sets_played'] is None
+    assert row['total_games'] is None
+    assert flags(row) == {'walkover'}
+
+
+@pytest.mark.parametrize('score, flag', [
+    ('6-3 Ret.', 'retired'),
+    ('6-3 1-0 Retired', 'retired'),
+    ('Walkover', 'walkover'),
+    ('6-2 3-1 DEF', 'defaulted'),
+    ('6-2 Def.', 'defaulted'),
+    ('6-2 3-6 Default', 'defaulted'),
+    ('6-4 ABN', 'unfinished'),
+    ('6-4 3-3 ABD', 'unfinished'),
+    ('6-4 3-3 Played and abandoned', 'unfinished'),
+    ('6-4 Played and unfinished', 'unfinished'),
+    ('6-4 In Progress', 'unfinished'),
+])
+def test_flags_match_short_codes_and_long_forms(score, flag):
+    assert flags(parse_one(score)) == {flag}
+
+
+@pytest.mark.parametrize('score', [None, '', 'NA'])
+def test_empty_scores_have_no_sets_and_no_flags(score):
+    row = parse_one(score)
+    assert all(row[f'set{number}_winner_games'] is None for number in range(1, scores.MAX_SETS + 1))
+    assert row['sets_played'] is None
+    assert row['total_games'] is None
+    assert not row['match_tiebreak']
+    assert flags(row) == set()
+
+
+def test_repeated_and_missing_scores_keep_their_rows():
+    table = scores.parse(pd.Series(['6-1 6-1', None, '6-1 6-1', 'W/O'], index=[10, 11, 12, 13]))
+    assert list(table.index) == [10, 11, 12, 13]
+    assert list(table.columns) == scores.COLUMNS
+    assert table['total_games'].tolist()[::2] == [14, 14]
+    assert table['walkover'].tolist() == [False, False, False, True]
@@ -0,0 +1,53 @@
+import pandas as pd
+import validation
+
+
+CONSTRAINTS = validation.Constraints(
+    not_null=('player_id', 'name'),
+    check_sets={'hand': ('R', 'L')},
+    max_lengths={'ioc': 3},
+    unique=(('player_id',),),
+    foreign_keys={'ioc': ('countries', 'ioc')},
+)
+
+
+def players(rows):
+    return pd.DataFrame(rows, columns=['player_id', 'name', 'hand', 'ioc'])
+
+
+def test_rows_satisfying_every_constraint_pass():
+    table = players([('1', 'Ann', 'R', 'USA'), ('2', 'Bea', None, None)])
+    valid, rejected = validation.validate(table, CONSTRAINTS, {'countries': pd.Index(['USA'])})
+    pd.testing.assert_frame_equal(valid, table)
+    assert rejected.empty
+    assert list(rejected.columns) == [*table.columns, 'reason']
+
+
+def test_rejected_rows_name_every_failed_check():
+    table = players([
+        ('1', 'Ann', 'R', 'USA'),
+        (None, 'Bea', 'X', 'FRA'),
+        ('1', None, 'L', 'USAX'),
+    ])
+    valid, rejected = validation.validate(table, CONSTRAINTS, {'countries': pd.Index(['USA', 'FRA'])})
+    assert valid['name'].tolist() == ['Ann']
+    assert rejected['reason'].tolist() == [
+        "player_id is null; hand not in ('R', 'L')",
+        'name is null; ioc longer than 3; duplicate player_id; ioc not in countries.ioc',
+    ]
+    # rejected rows keep their values for the quarantine file
+    assert rejected['hand'].tolist() == ['X', 'L']
+
+
+def test_the_first_of_duplicate_rows_is_kept():
+    table = players([('1', 'Ann', 'R', 'USA'), ('1', 'Ann B', 'R', 'USA')])
+    valid, rejected = validation.validate(table, CONSTRAINTS)
+    assert valid['name'].tolist() == ['Ann']
+    assert rejected['name'].tolist() == ['Ann B']
+
+
+def test_references_are_only_checked_against_known_keys():
+    table = players([('1', 'Ann', 'R', 'XYZ')])
+    valid, rejected = validation.validate(table, CONSTRAINTS)
+    assert len(valid) == 1
+    assert rejected.empty
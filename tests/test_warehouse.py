@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+from warehouse import Warehouse
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    return Warehouse(directory=tmp_path / 'warehouse')
+
+
+def matches(season: int, count: int, winner_id: str = 'A') -> pd.DataFrame:
+    return pd.DataFrame({
+        'season'        : season,
+        'tourney_id'    : f'{season}-001',
+        'match_num'     : range(count),
+        'tourney_date'  : f'{season}0101',
+        'winner_id'     : winner_id,
+    })
+
+
+def test_writing_a_partition_replaces_that_season_only(warehouse):
+    warehouse.write_partition('matches', 2001, matches(2001, 3))
+    warehouse.write_partition('matches', 2002, matches(2002, 2))
+    warehouse.write_partition('matches', 2001, matches(2001, 4, winner_id='B'))
+    assert warehouse.seasons('matches') == [2001, 2002]
+    table = warehouse.read_table('matches').sort_values(['season', 'match_num'], ignore_index=True)
+    assert table.groupby('season')['winner_id'].agg(list).to_dict() == {2001: ['B'] * 4, 2002: ['A'] * 2}
+    assert table['tourney_date'].map(type).eq(type(pd.Timestamp('2001-01-01').date())).all()
+    read = warehouse.read_table('matches', columns=['match_num'], filters=[('season', '=', 2002)])
+    assert sorted(read['match_num']) == [0, 1]
+
+
+def test_a_partition_writer_replaces_the_partition_on_commit(warehouse):
+    warehouse.write_partition('matches', 2001, matches(2001, 3))
+    writer = warehouse.partition_writer('matches', 2001)
+    writer.write(matches(2001, 2, winner_id='B'))
+    writer.write(matches(2001, 2, winner_id='C'))
+    # readers see the old partition until the commit
+    assert warehouse.read_table('matches')['winner_id'].tolist() == ['A'] * 3
+    writer.commit()
+    assert sorted(warehouse.read_table('matches')['winner_id']) == ['B', 'B', 'C', 'C']
+    assert [path.name for path in warehouse.path('matches').iterdir()] == ['season=2001']
+
+
+def test_deleted_partitions_leave_the_queries(warehouse):
+    for season in (2001, 2002):
+        warehouse.write_partition('matches', season, matches(season, 2))
+    warehouse.delete_partitions('matches', [2001])
+    assert warehouse.seasons('matches') == [2002]
+    result = warehouse.read_sql(
+        'SELECT "season", count(*) AS "matches" FROM "matches" WHERE "season" IN :seasons GROUP BY "season"',
+        {'seasons': [2001, 2002]},
+    )
+    assert result.values.tolist() == [[2002, 2]]
+
+
+def test_upserts_replace_rows_by_key_and_return_the_changed_keys(warehouse):
+    players = pd.DataFrame({'player_id': ['A', 'B'], 'name': ['Ann', 'Bea'], 'height': [180.0, None]})
+    assert warehouse.upsert('players', players, key_columns=('player_id',)).empty
+    update = pd.DataFrame({'player_id': ['B', 'C'], 'name': ['Bea', 'Cy'], 'height': [170.0, 190.0]})
+    changed = warehouse.upsert('players', update, key_columns=('player_id',))
+    assert changed['player_id'].tolist() == ['B']
+    table = warehouse.read_table('players').sort_values('player_id')
+    assert table['height'].tolist()[1:] == [170.0, 190.0]
+    assert warehouse.upsert('players', update, key_columns=('player_id',)).empty
+
+
+def test_upserts_keep_estimates_with_more_support(warehouse):
+    estimates = {'birth_year': 'birth_year_appearances'}
+    players = pd.DataFrame({'player_id': ['A', 'B'], 'birth_year': [1980, 1990], 'birth_year_appearances': [10, 2]})
+    warehouse.upsert('players', players, key_columns=('player_id',), estimates=estimates)
+    update = pd.DataFrame({'player_id': ['A', 'B'], 'birth_year': [1981, 1991], 'birth_year_appearances': [3, 3]})
+    changed = warehouse.upsert('players', update, key_columns=('player_id',), estimates=estimates)
+    assert changed['player_id'].tolist() == ['B']
+    table = warehouse.read_table('players').sort_values('player_id')
+    assert table[['birth_year', 'birth_year_appearances']].values.tolist() == [[1980, 10], [1991, 3]]
+
+
+def test_data_versions_count_the_loads_of_every_season(warehouse):
+    assert warehouse.data_version() == []
+    warehouse.bump_data_version([2001, 2002])
+    warehouse.bump_data_version([2002])
+    assert warehouse.data_version() == [[2001, 1], [2002, 2]]
+    assert warehouse.data_version([2002]) == [[2002, 2]]
@@ -0,0 +1,61 @@
+import dataclasses
+import functools
+import numpy as np
+import pandas as pd
+
+
+# constraints of a db table, checked on data frames before they are loaded
+@dataclasses.dataclass(frozen=True)
+class Constraints:
+    not_null: tuple[str, ...] = ()
+    # allowed values of a column, nulls pass like in a sql check constraint
+    check_sets: dict[str, tuple] = dataclasses.field(default_factory=dict)
+    # length limits of varchar columns
+    max_lengths: dict[str, int] = dataclasses.field(default_factory=dict)
+    # column sets that are unique in the table, the first of duplicate rows is kept
+    unique: tuple[tuple[str, ...], ...] = ()
+    # column: (referenced table, referenced column)
+    foreign_keys: dict[str, tuple[str, str]] = dataclasses.field(default_factory=dict)
+
+
+# split a table into the rows that satisfy the constraints and the rows that do not;
+# rejected rows get a "reason" column naming every failed check.
+# reference_keys holds the known keys of every referenced table
+def validate(
+    table: pd.DataFrame,
+    constraints: Constraints,
+    reference_keys: dict[str, pd.Index] | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    reference_keys = reference_keys or {}
+    failures = {}
+    for column in constraints.not_null:
+        failures[f'{column} is null'] = table[column].isna().to_numpy()
+    for column, allowed in constraints.check_sets.items():
+        values = table[column]
+        failures[f'{column} not in {allowed}'] = (values.notna() & ~values.isin(allowed)).to_numpy()
+    for column, max_length in constraints.max_lengths.items():
+        lengths = table[column].astype('string').str.len()
+        failures[f'{column} longer than {max_length}'] = (lengths > max_length).fillna(False).to_numpy(dtype=bool)
+    for columns in constraints.unique:
+        failures[f'duplicate {", ".join(columns)}'] = table.duplicated(subset=list(columns), keep='first').to_numpy()
+    for column, (referenced_table, referenced_column) in constraints.foreign_keys.items():
+        if referenced_table not in reference_keys:
+            continue
+        values = table[column]
+        failures[f'{column} not in {referenced_table}.{referenced_column}'] = (
+            values.notna() & ~values.isin(reference_keys[referenced_table])
+        ).to_numpy()
+    if not failures:
+        return table, table.iloc[0:0].assign(reason=pd.Series(dtype=str))
+    masks = np.column_stack(list(failures.values()))
+    rejected = masks.any(axis=1)
+    if not rejected.any():
+        return table, table.iloc[0:0].assign(reason=pd.Series(dtype=str))
+    # names of the failed checks of every rejected row, joined without a per-row loop
+    names = np.array([f'{name}; ' for name in failures], dtype=object)
+    reasons = functools.reduce(
+        np.add,
+        [np.where(masks[rejected, index], names[index], '') for index in range(len(names))],
+    )
+    rejected_table = table[rejected].assign(reason=pd.Series(reasons, index=table.index[rejected]).str[:-2])
+    return table[~rejected].reset_index(drop=True), rejected_table.reset_index(drop=True)
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import uuid
+import duckdb
+import pandas as pd
+import pyarrow
+import pyarrow.parquet
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+import atomic
+
+
+logger = logging.getLogger(__name__)
+
+
+# writer of one season partition of a table, e.g. chunk by chunk while streaming;
+# the partition is replaced when the writer is committed
+class PartitionWriter:
+
+    # concrete constructor
+    def __init__(self, warehouse: 'Warehouse', table_name: str, season: int) -> None:
+        # assign instance variables
+        self.warehouse = warehouse
+        self.path = warehouse.partition_path(table_name, season)
+        # parts are written next to the partition and moved into place on commit
+        self.temp_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}.tmp")
+        self.parts = 0
+
+    # write a frame as the next part file of the partition
+    def write(self, table: pd.DataFrame) -> None:
+        self.temp_path.mkdir(parents=True, exist_ok=True)
+        # the season is stored in the partition path only
+        table = table.drop(columns=[self.warehouse.partition_column], errors='ignore')
+        self.warehouse.write_file(self.temp_path / f"part-{self.parts:05d}.parquet", table)
+        self.parts += 1
+
+    # replace the partition by the written parts
+    def commit(self) -> None:
+        self.temp_path.mkdir(parents=True, exist_ok=True)
+        old_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}.old")
+        if self.path.exists():
+            os.replace(self.path, old_path)
+        os.replace(self.temp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+# embedded columnar warehouse: a directory of parquet tables, partitioned by season
+# like "matches/season=2023/part-00000.parquet", queried in-process with duckdb
+class Warehouse:
+
+    # column of the season partitions
+    partition_column = 'season'
+
+    # columns stored as dates, whatever type they have in the loaded frames
+    date_columns = ('tourney_date',)
+
+    # (pattern, replacement) rewriting postgresql syntax duckdb spells differently
+    rewrites = (
+        (re.compile(r'TABLESAMPLE BERNOULLI \(([^)]+)\) REPEATABLE \((\d+)\)', re.IGNORECASE),
+         r'TABLESAMPLE \1 PERCENT (bernoulli, \2)'),
+    )
+
+    # concrete constructor
+    def __init__(self, directory: str | os.PathLike, compression: str = 'zstd') -> None:
+        # assign instance variables
+        self.directory = pathlib.Path(directory)
+        self.compression = compression
+
+    # directory of a table
+    def path(self, table_name: str) -> pathlib.Path:
+        return self.directory / table_name
+
+    # directory of a season partition of a table
+    def partition_path(self, table_name: str, season: int) -> pathlib.Path:
+        return self.path(table_name) / f"{self.partition_column}={int(season)}"
+
+    # whether a table has been written
+    def exists(self, table_name: str) -> bool:
+        return any(self.path(table_name).glob('*.parquet')) or bool(self.seasons(table_name))
+
+    # seasons of the partitions of a table
+    def seasons(self, table_name: str) -> list[int]:
+        prefix = f"{self.partition_column}="
+        return sorted(
+            int(path.name[len(prefix):]) for path in self.path(table_name).glob(f"{prefix}*")
+            if path.is_dir()
+        )
+
+    # write a frame to a parquet file, through a temporary file so readers never see a partial file
+    def write_file(self, path: pathlib.Path, table: pd.DataFrame) -> None:
+        table = self._stored(table)
+        with atomic.replacing(path) as temp_path:
+            pyarrow.parquet.write_table(
+                pyarrow.Table.from_pandas(table, preserve_index=False),
+                temp_path,
+                compression=self.compression,
+            )
+
+    # writer replacing a season partition of a table
+    def partition_writer(self, table_name: str, season: int) -> PartitionWriter:
+        self.path(table_name).mkdir(parents=True, exist_ok=True)
+        return PartitionWriter(warehouse=self, table_name=table_name, season=season)
+
+    # replace a season partition of a table
+    def write_partition(self, table_name: str, season: int, table: pd.DataFrame) -> None:
+        writer = self.partition_writer(table_name=table_name, season=season)
+        writer.write(table)
+        writer.commit()
+
+    # remove season partitions of a table
+    def delete_partitions(self, table_name: str, seasons: list[int]) -> None:
+        for season in seasons:
+            shutil.rmtree(self.partition_path(table_name, season), ignore_errors=True)
+
+    # replace the rows of an unpartitioned table that share their key with the given rows,
+    # keeping existing estimates, as {column: support column}, that are supported by more rows
+    # than the new ones or that the new rows do not know; return the keys of the replaced rows
+    # whose values changed, not counting changes of the supports alone
+    def upsert(
+        self,
+        table_name: str,
+        table: pd.DataFrame,
+        key_columns: tuple[str, ...],
+        estimates: dict[str, str] | None = None,
+    ) -> pd.DataFrame:
+        estimates = estimates or {}
+        self.path(table_name).mkdir(parents=True, exist_ok=True)
+        path = self.path(table_name) / 'data.parquet'
+        key_columns = list(key_columns)
+        changed = table.iloc[0:0][key_columns]
+        if path.exists():
+            existing = self.read_table(table_name)
+            if estimates:
+                # tables written before a support column existed read it as unknown
+                known = existing.drop_duplicates(subset=key_columns, keep='last').set_index(key_columns).reindex(
+                    columns=[column for column in table.columns if column not in key_columns]
+                )
+                keys = pd.MultiIndex.from_frame(table[key_columns])
+                table = table.copy()
+                for estimate, support in estimates.items():
+                    known_support = known[support].reindex(keys).astype(float).to_numpy()
+                    replaces = table[estimate].notna().to_numpy() & ~(
+                        known_support > table[support].astype(float).to_numpy()
+                    )
+                    for column in (estimate, support):
+                        kept = known[column].reindex(keys).to_numpy()
+                        table[column] = table[column].where(replaces, kept)
+            replaced = pd.MultiIndex.from_frame(existing[key_columns]).isin(
+                pd.MultiIndex.from_frame(table[key_columns])
+            )
+            changed = self._changed_keys(
+                existing[replaced].drop(columns=list(estimates.values()), errors='ignore'),
+                table.drop(columns=list(estimates.values())),
+                key_columns,
+            )
+            table = pd.concat([existing[~replaced], table], ignore_index=True)
+        self.write_file(path, table)
+        return changed
+
+    # keys of the old rows that differ from the new rows with the same key, nulls compare equal
+    def _changed_keys(self, old: pd.DataFrame, new: pd.DataFrame, key_columns: list[str]) -> pd.DataFrame:
+        # compared as stored, e.g. dates as dates
+        new = self._stored(new).drop_duplicates(subset=key_columns, keep='last').set_index(key_columns)
+        old = old.set_index(key_columns)
+        value_columns = [column for column in new.columns if column in old.columns]
+        old = old[value_columns].astype(object)
+        new = new.reindex(old.index)[value_columns].astype(object)
+        equal = (old == new) | (old.isna() & new.isna())
+        return old.index[~equal.all(axis=1).to_numpy()].to_frame(index=False)
+
+    # a frame with the column types it is stored with
+    def _stored(self, table: pd.DataFrame) -> pd.DataFrame:
+        table = table.reset_index(drop=True)
+        for column in type(self).date_columns:
+            if column in table.columns:
+                table[column] = pd.to_datetime(table[column], format='mixed').dt.date
+        return table
+
+    # read a table with column and predicate pushdown, e.g. filters=[('season', 'in', [2022, 2023])];
+    # files are memory mapped instead of read into buffers
+    def read_table(
+        self,
+        table_name: str,
+        columns: list[str] | None = None,
+        filters: list | None = None,
+    ) -> pd.DataFrame:
+        return pyarrow.parquet.read_table(
+            self.path(table_name),
+            columns=columns,
+            filters=filters,
+            memory_map=True,
+            partitioning='hive',
+        ).to_pandas()
+
+    # values of a table column that exist among the given values
+    def select_existing(self, table_name: str, column: str, values: list) -> pd.Index:
+        if not self.exists(table_name):
+            return pd.Index([])
+        table = self.read_table(table_name, columns=[column], filters=[(column, 'in', list(values))])
+        return pd.Index(table[column].unique())
+
+    # in-process duckdb connection with a view over every table; scans of the views
+    # skip partitions and row groups outside of the filters and read only the used columns
+    def connect(self) -> duckdb.DuckDBPyConnection:
+        connection = duckdb.connect()
+        if not self.directory.exists():
+            return connection
+        for path in sorted(self.directory.iterdir()):
+            if path.name.startswith('.') or not path.is_dir():
+                continue
+            if self.seasons(path.name):
+                pattern, hive = path / f"{self.partition_column}=*" / '*.parquet', 'true'
+            elif any(path.glob('*.parquet')):
+                pattern, hive = path / '*.parquet', 'false'
+            else:
+                continue
+            connection.execute(
+                f"""CREATE VIEW "{path.name}" AS SELECT * FROM read_parquet("""
+                f"""'{pattern}', hive_partitioning = {hive}, union_by_name = true)"""
+            )
+        return connection
+
+    # run a query of the postgresql dialect over the tables, with parameters bound inline
+    def read_sql(self, sql: str | sqlalchemy.TextClause, params: dict | None = None) -> pd.DataFrame:
+        if isinstance(sql, str):
+            sql = sqlalchemy.sql.text(sql)
+        # typed from their values, so every parameter renders as a literal
+        # (duckdb takes no parameters in clauses like TABLESAMPLE)
+        statement = sql.bindparams(*[
+            sqlalchemy.bindparam(name, value, expanding=isinstance(value, (list, tuple)))
+            for name, value in (params or {}).items()
+        ])
+        query = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+        for pattern, replacement in type(self).rewrites:
+            query = pattern.sub(replacement, query)
+        connection = self.connect()
+        try:
+            return connection.execute(query).df()
+        finally:
+            connection.close()
+
+    # path of the data versions of the seasons
+    @property
+    def _data_version_path(self) -> pathlib.Path:
+        return self.directory / 'data_version.json'
+
+    # data versions of the given seasons, or of every season, as [[season, version], ...]
+    def data_version(self, seasons: list[int] | None = None) -> list[list[int]]:
+        if not self._data_version_path.exists():
+            return []
+        versions = json.loads(self._data_version_path.read_text())
+        return [
+            [int(season), version] for season, version in sorted(versions.items(), key=lambda item: int(item[0]))
+            if seasons is None or int(season) in seasons
+        ]
+
+    # increment the data version of the given seasons
+    def bump_data_version(self, seasons: list[int]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        versions = dict((str(season), version) for season, version in self.data_version())
+        for season in seasons:
+            versions[str(season)] = versions.get(str(season), 0) + 1
+        atomic.write_text(self._data_version_path, json.dumps(versions))